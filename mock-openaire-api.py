@@ -0,0 +1,308 @@
+"""Local stand-in for the OpenAIRE Graph API and its token endpoint.
+
+Serves the endpoints the ETL uses (/v1/organizations, /v1/dataSources,
+/v1/projects, /v2/researchProducts and the client-credentials token endpoint)
+from a deterministic synthetic universe of organisations and data sources.
+Latency, server errors and 429 throttling are configurable, so the ETL can be
+tested and benchmarked without credentials or the live API.
+
+    python mock-openaire-api.py --orgs 60 --latency-ms 40 --error-rate 0.01 --rate-limit 200
+
+Point the ETL at it with OPENAIRE_BASE_URL=http://127.0.0.1:8765 and
+OPENAIRE_TOKEN_URL=http://127.0.0.1:8765/oidc/token. `write_baseline()` writes a
+matching nl-orgs baseline sheet; GET /_stats returns the request counters.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+PRODUCT_TYPES = ["publication", "dataset", "software", "other"]
+DATASOURCE_TYPES = ["Institutional Repository", "CRIS System", "Data Repository", "Journal Platform"]
+COMPATIBILITY_LEVELS = [
+    "OpenAIRE 4.0 (inst.&thematic. repo.)",
+    "OpenAIRE CRIS v1.1",
+    "collected from a compatible aggregator",
+    "not available",
+]
+
+
+@dataclass
+class MockConfig:
+    orgs: int = 60
+    seed: int = 1
+    max_datasources_per_org: int = 4
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    rate_limit: float = 0.0  # requests/second before answering 429; 0 disables
+    retry_after: int = 1
+    token_lifetime: int = 3600
+
+
+class SyntheticGraph:
+    """Deterministic organisations, data sources and counts derived from the seed."""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.orgs: Dict[str, Dict[str, Any]] = {}
+        self.datasources: Dict[str, Dict[str, Any]] = {}
+        self.org_by_ror: Dict[str, str] = {}
+        for index in range(config.orgs):
+            org_id = f"openorgs____::{self._digest('org', index)[:32]}"
+            ror = f"https://ror.org/0mock{index:04d}"
+            datasource_ids = []
+            for position in range(1 + self._number("datasources", index) % config.max_datasources_per_org):
+                ds_id = f"mockds______::{self._digest('ds', index, position)[:32]}"
+                datasource_ids.append(ds_id)
+                self.datasources[ds_id] = self._datasource(ds_id, index, position)
+            self.orgs[org_id] = {"id": org_id, "index": index, "ror": ror, "datasources": datasource_ids}
+            self.org_by_ror[ror] = org_id
+
+    def _digest(self, *parts: Any) -> str:
+        return hashlib.sha1("|".join(map(str, (self.config.seed, *parts))).encode("utf-8")).hexdigest()
+
+    def _number(self, *parts: Any) -> int:
+        return int(self._digest(*parts)[:8], 16)
+
+    def _datasource(self, ds_id: str, org_index: int, position: int) -> Dict[str, Any]:
+        number = self._number("ds-meta", ds_id)
+        indexed_day = 1 + number % 28
+        return {
+            "id": ds_id,
+            "officialName": f"Mock datasource {org_index}.{position}",
+            "englishName": f"Mock datasource {org_index}.{position}",
+            "type": {"value": DATASOURCE_TYPES[number % len(DATASOURCE_TYPES)]},
+            "websiteUrl": f"https://repository{org_index}-{position}.example.org",
+            "openaireCompatibility": COMPATIBILITY_LEVELS[(number // 7) % len(COMPATIBILITY_LEVELS)],
+            "lastIndexedDate": f"2025-11-{indexed_day:02d}",
+            "dateOfValidation": "2024-01-15",
+        }
+
+    def org_rows(self) -> List[Dict[str, Any]]:
+        """Baseline rows for every organisation, in the nl-orgs sheet's column names."""
+        rows = []
+        for org in sorted(self.orgs.values(), key=lambda entry: entry["index"]):
+            datasources = org["datasources"]
+            rows.append(
+                {
+                    "full_name_in_English": f"Mock University {org['index']}",
+                    "acronym_EN": f"MU{org['index']}",
+                    "main_grouping": "mock",
+                    "ROR": org["ror"],
+                    "OpenAIRE Data Source ID (Main/CRIS)": datasources[0],
+                    "OpenAIRE Data Source (Secondary/Repository)": datasources[1] if len(datasources) > 1 else "",
+                }
+            )
+        return rows
+
+    def count(self, path: str, filters: Dict[str, str]) -> int:
+        """numFound for a filter set; product totals are the sum of the per-type counts."""
+        if path == "/v1/dataSources":
+            if "id" in filters:
+                return int(filters["id"] in self.datasources)
+            org = self.orgs.get(filters.get("relOrganizationId", ""))
+            return len(org["datasources"]) if org else 0
+        if path == "/v2/researchProducts" and "type" not in filters:
+            return sum(self.count(path, dict(filters, type=product_type)) for product_type in PRODUCT_TYPES)
+        scope = filters.get("relOrganizationId") or filters.get("relCollectedFromDatasourceId") or ""
+        if scope not in self.orgs and scope not in self.datasources:
+            return 0
+        ceiling = 200 if path == "/v1/projects" else 20000
+        return self._number(path, scope, filters.get("type", "")) % ceiling
+
+    def respond(self, path: str, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        page = max(int(params.pop("page", 1) or 1), 1)
+        page_size = max(int(params.pop("pageSize", 10) or 10), 1)
+        params.pop("cursor", None)
+        if path == "/v1/organizations":
+            org_id = self.org_by_ror.get(params.get("pid", ""))
+            results = [{"id": org_id, "legalName": f"Mock University {self.orgs[org_id]['index']}"}] if org_id else []
+            return self._page(results, len(results), page, page_size)
+        if path == "/v1/dataSources":
+            if "id" in params:
+                records = [self.datasources[params["id"]]] if params["id"] in self.datasources else []
+            else:
+                org = self.orgs.get(params.get("relOrganizationId", ""))
+                records = [self.datasources[ds_id] for ds_id in org["datasources"]] if org else []
+            window = records[(page - 1) * page_size : page * page_size]
+            return self._page(window, len(records), page, page_size)
+        if path in {"/v1/projects", "/v2/researchProducts"}:
+            return self._page([], self.count(path, params), page, page_size)
+        return None
+
+    @staticmethod
+    def _page(results: List[Dict[str, Any]], num_found: int, page: int, page_size: int) -> Dict[str, Any]:
+        return {"header": {"numFound": num_found, "pageSize": page_size, "page": page, "queryTime": 1}, "results": results}
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.graph = SyntheticGraph(config)
+        self.stats: Counter = Counter()
+        self.lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._window_started = time.monotonic()
+        self._window_requests = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def draw(self) -> float:
+        with self.lock:
+            return self._random.random()
+
+    def over_rate_limit(self) -> bool:
+        """Fixed one-second window counter, like the gateway in front of the real API."""
+        if not self.config.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self._window_started >= 1.0:
+                self._window_started = now
+                self._window_requests = 0
+            self._window_requests += 1
+            return self._window_requests > self.config.rate_limit
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockServer
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(f"status:{status}")
+
+    def _simulate_conditions(self) -> bool:
+        """Apply latency, throttling and injected errors; returns True when a response was already sent."""
+        config = self.server.config
+        if config.latency_ms or config.jitter_ms:
+            time.sleep(max(config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms), 0.0) / 1000)
+        if self.server.over_rate_limit() or self.server.draw() < config.throttle_rate:
+            self._send(429, {"error": "Too Many Requests"}, {"Retry-After": str(config.retry_after)})
+            return True
+        if self.server.draw() < config.error_rate:
+            self._send(503 if self.server.draw() < 0.5 else 500, {"error": "injected failure"})
+            return True
+        return False
+
+    def do_GET(self) -> None:
+        parsed = urlparse(self.path)
+        path = parsed.path.removeprefix("/graph")
+        if path == "/_stats":
+            with self.server.lock:
+                stats = dict(self.server.stats)
+            self._send(200, {"requests": stats, "orgs": len(self.server.graph.orgs), "datasources": len(self.server.graph.datasources)})
+            return
+        self.server.record(f"GET {path}")
+        if not self.headers.get("Authorization", "").startswith("Bearer mock-"):
+            self._send(401, {"error": "missing or unknown bearer token"})
+            return
+        if self._simulate_conditions():
+            return
+        params = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+        payload = self.server.graph.respond(path, params)
+        if payload is None:
+            self._send(404, {"error": f"unknown endpoint {path}"})
+        else:
+            self._send(200, payload)
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8"))
+        self.server.record(f"POST {path}")
+        if path != "/oidc/token" or form.get("grant_type") != ["client_credentials"]:
+            self._send(400, {"error": "unsupported_grant_type"})
+            return
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            self._send(401, {"error": "invalid_client"})
+            return
+        token = f"mock-{int(time.time() * 1000)}"
+        self._send(200, {"access_token": token, "token_type": "Bearer", "expires_in": self.server.config.token_lifetime})
+
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Start the mock API on a background thread; port 0 picks a free port."""
+    server = MockServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="mock-openaire-api", daemon=True).start()
+    return server
+
+
+def write_baseline(graph: SyntheticGraph, path: Path) -> Path:
+    """Write the synthetic organisations as the nl-orgs baseline workbook the ETL reads in step 2."""
+    import pandas as pd
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(graph.org_rows()).to_excel(path, sheet_name="nl-orgs", index=False)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a synthetic OpenAIRE Graph API for local ETL runs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--orgs", type=int, default=MockConfig.orgs, help="number of synthetic organisations")
+    parser.add_argument("--seed", type=int, default=MockConfig.seed)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter on the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500/503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/second before 429s (0: unlimited)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--write-baseline", type=Path, metavar="XLSX", help="write the matching nl-orgs baseline and exit")
+    args = parser.parse_args()
+    config = MockConfig(
+        orgs=args.orgs,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+    )
+    if args.write_baseline:
+        print(f"Wrote {config.orgs} organisations to {write_baseline(SyntheticGraph(config), args.write_baseline)}")
+        return
+    server = MockServer((args.host, args.port), config)
+    print(f"Mock OpenAIRE API with {len(server.graph.orgs)} organisations and {len(server.graph.datasources)} data sources on {server.base_url}")
+    print(f"  OPENAIRE_BASE_URL={server.base_url} OPENAIRE_TOKEN_URL={server.base_url}/oidc/token")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
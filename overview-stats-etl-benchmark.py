@@ -0,0 +1,177 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "pandas",
+#     "matplotlib",
+#     "openpyxl",
+#     "python-dotenv",
+#     "requests",
+#     "httpx",
+#     "tqdm",
+#     "pyarrow",
+#     "ipython",
+#     "marimo>=0.17.0",
+# ]
+# ///
+"""End-to-end throughput benchmark for ETL steps 5, 7 and 8.
+
+For each scale factor the benchmark:
+- starts mock-openaire-api.py seeded with scale × the current organisation count
+- writes a matching baseline into a scratch data folder
+- runs the org-metrics, datasources and snapshot stages through overview-stats-etl-cli.py
+- reports stage timings, throughput, and the request and error counts the mock saw
+
+    python overview-stats-etl-benchmark.py                          # 1x, 10x and 100x
+    python overview-stats-etl-benchmark.py --scales 1 10 --latency-ms 50 --error-rate 0.01
+
+Each run starts from an empty data folder, so nothing comes from the response
+cache or the incremental carry-forward. The adaptive rate limiter's ceiling is
+raised (--api-max-rate) because the mock is not the production API; pass
+--api-max-rate 50 to measure with the production limits.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+HERE = Path(__file__).resolve().parent
+CLI = HERE / "overview-stats-etl-cli.py"
+BASELINE_PATH = HERE / "data" / "nl_orgs_baseline.xlsx"
+STAGES = ["org-metrics", "datasources", "snapshot"]
+
+
+def load_mock_module():
+    spec = importlib.util.spec_from_file_location("mock_openaire_api", HERE / "mock-openaire-api.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # dataclasses look the module up by name
+    spec.loader.exec_module(module)
+    return module
+
+
+def current_org_count(default: int) -> int:
+    """Rows in the real baseline sheet, or `default` when it has not been downloaded."""
+    if not BASELINE_PATH.exists():
+        return default
+    import pandas as pd
+
+    baseline = pd.read_excel(BASELINE_PATH, sheet_name="nl-orgs", dtype=str, keep_default_na=False)
+    return len(baseline) or default
+
+
+def run_scale(mock, scale: int, org_count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    config = mock.MockConfig(
+        orgs=org_count,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+    )
+    server = mock.start_server(config)
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"etl-benchmark-{scale}x-") as scratch:
+            data_dir = Path(scratch) / "data"
+            mock.write_baseline(server.graph, data_dir / "nl_orgs_baseline.xlsx")
+            timings_path = Path(scratch) / "timings.json"
+            env = dict(
+                os.environ,
+                OPENAIRE_BASE_URL=server.base_url,
+                OPENAIRE_TOKEN_URL=f"{server.base_url}/oidc/token",
+                OPENAIRE_API_INITIAL_RATE=str(args.api_max_rate),
+                OPENAIRE_API_MAX_RATE=str(args.api_max_rate),
+                ETL_DATA_DIR=str(data_dir),
+                ETL_NO_TOKEN_CACHE="1",
+                CLIENT_ID="mock-client",
+                CLIENT_SECRET="mock-secret",
+            )
+            command = [sys.executable, str(CLI), *(argument for stage in STAGES for argument in ("--only", stage)), "--timings-json", str(timings_path)]
+            print(f"[{scale}x] {org_count} organisations, {len(server.graph.datasources)} data sources on {server.base_url}")
+            started = time.perf_counter()
+            completed = subprocess.run(command, cwd=scratch, env=env, capture_output=True, text=True)
+            wall_seconds = time.perf_counter() - started
+            if completed.returncode != 0 or not timings_path.exists():
+                print(completed.stdout[-4000:])
+                print(completed.stderr[-4000:], file=sys.stderr)
+                raise SystemExit(f"[{scale}x] ETL run failed with exit code {completed.returncode}")
+            timings = json.loads(timings_path.read_text(encoding="utf-8"))
+        with urllib.request.urlopen(f"{server.base_url}/_stats") as response:
+            requests_seen = json.load(response)["requests"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    api_requests = sum(count for key, count in requests_seen.items() if key.startswith("GET "))
+    stage_seconds = {stage: timings["stages"][stage]["seconds"] for stage in STAGES}
+    datasource_count = len(server.graph.datasources)
+    return {
+        "scale": scale,
+        "organisations": org_count,
+        "datasources": datasource_count,
+        "wall_seconds": round(wall_seconds, 3),
+        "stage_seconds": stage_seconds,
+        "orgs_per_second": round(org_count / stage_seconds["org-metrics"], 2) if stage_seconds["org-metrics"] else None,
+        "datasources_per_second": {
+            stage: round(datasource_count / stage_seconds[stage], 2) if stage_seconds[stage] else None for stage in ("datasources", "snapshot")
+        },
+        "api_requests": api_requests,
+        "api_requests_per_second": round(api_requests / sum(stage_seconds.values()), 2) if sum(stage_seconds.values()) else None,
+        "throttled": requests_seen.get("status:429", 0),
+        "server_errors": requests_seen.get("status:500", 0) + requests_seen.get("status:503", 0),
+        "requests_by_endpoint": {key: count for key, count in sorted(requests_seen.items()) if not key.startswith("status:")},
+    }
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print()
+    header = f"{'scale':>6} {'orgs':>7} {'datasrc':>8} {'step 5 s':>9} {'step 7 s':>9} {'step 8 s':>9} {'orgs/s':>8} {'ds/s (8)':>9} {'req/s':>8} {'429s':>6} {'5xx':>5}"
+    print(header)
+    for result in results:
+        seconds = result["stage_seconds"]
+        print(
+            f"{str(result['scale']) + 'x':>6} {result['organisations']:>7,} {result['datasources']:>8,} "
+            f"{seconds['org-metrics']:>9.2f} {seconds['datasources']:>9.2f} {seconds['snapshot']:>9.2f} "
+            f"{result['orgs_per_second'] or 0:>8.1f} {result['datasources_per_second']['snapshot'] or 0:>9.1f} "
+            f"{result['api_requests_per_second'] or 0:>8.1f} {result['throttled']:>6,} {result['server_errors']:>5,}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ETL steps 5, 7 and 8 against the local mock OpenAIRE API.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="multiples of the current organisation count")
+    parser.add_argument("--base-orgs", type=int, help="organisation count at 1x (default: rows in data/nl_orgs_baseline.xlsx, else 60)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="mock latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock responses that are 500/503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of mock responses that are 429")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="mock requests/second before 429s (0: unlimited)")
+    parser.add_argument("--api-max-rate", type=float, default=1000.0, help="ceiling for the ETL's adaptive rate limiter")
+    parser.add_argument("--output", type=Path, help="results JSON (default: data/benchmarks/etl_benchmark_<timestamp>.json)")
+    args = parser.parse_args()
+
+    mock = load_mock_module()
+    base_orgs = args.base_orgs or current_org_count(default=60)
+    results = [run_scale(mock, scale, base_orgs * scale, args) for scale in args.scales]
+    print_results(results)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    output = args.output or HERE / "data" / "benchmarks" / f"etl_benchmark_{stamp}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    settings = {key: value for key, value in vars(args).items() if key != "output"}
+    output.write_text(json.dumps({"run_at": stamp, "settings": settings, "results": results}, indent=2), encoding="utf-8")
+    print(f"Saved benchmark results to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
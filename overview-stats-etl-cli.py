@@ -0,0 +1,359 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "pandas",
+#     "matplotlib",
+#     "openpyxl",
+#     "python-dotenv",
+#     "requests",
+#     "httpx",
+#     "tqdm",
+#     "pyarrow",
+#     "ipython",
+#     "marimo>=0.17.0",
+#     "duckdb==1.4.3",
+# ]
+# ///
+"""Headless runner for overview-stats-etl-pipline.py.
+
+The notebook cells are grouped into stages by their section headings. Stage
+dependencies come from the names each cell takes and returns, plus the
+artifacts stages exchange on disk. Independent stages run concurrently, and a
+timing table is printed at the end.
+
+    python overview-stats-etl-cli.py                   # every stage
+    python overview-stats-etl-cli.py --only snapshot   # one stage (plus setup)
+    python overview-stats-etl-cli.py --skip charts     # everything but the charts
+    python overview-stats-etl-cli.py --list            # show stages and dependencies
+"""
+
+import argparse
+import ast
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+NOTEBOOK = Path(__file__).with_name("overview-stats-etl-pipline.py")
+
+# Section number (from "## 7. ..." headings) -> stage; "3a"-style subsections fall back to their number
+SECTION_STAGES = {
+    "1": "setup",
+    "2": "setup",
+    "2a": "benchmark",
+    "3": "setup",
+    "4": "setup",
+    "5": "org-metrics",
+    "6": "charts",
+    "7": "datasources",
+    "8": "snapshot",
+    "9": "snapshot",
+    "10": "charts",
+    "11": "charts",
+    "12": "charts",
+    "13": "charts",
+    "14": "curated-oai",
+    "15": "endpoints",
+    "16": "probe",
+    "16a": "harvest",
+    "17": "charts",
+    "18": "dashboard-data",
+    "DATALAKE": "duckdb",
+}
+
+# Stages that read another stage's artifact from disk rather than one of its returned names
+ARTIFACT_DEPENDENCIES = {
+    "endpoints": {"datasources", "curated-oai"},
+    "probe": {"endpoints"},
+    "harvest": {"probe", "snapshot"},
+    "dashboard-data": {"org-metrics", "snapshot", "probe"},
+    "charts": {"org-metrics", "snapshot", "probe"},
+    "duckdb": {"org-metrics", "datasources", "snapshot", "probe"},
+}
+
+# Names a skipped stage would have returned that can be read back from its last artifact instead
+HYDRATED_NAMES = {
+    "enriched_df": "nl_orgs_openaire",
+    "datasources_df": "nl_orgs_openaire_datasources",
+}
+
+# Notebook flags read through etl_flag(); forwarded as ETL_<NAME>=1
+ETL_FLAGS = ["refresh", "full-snapshot", "no-token-cache", "excel", "benchmark-parsing", "record", "replay", "harvest", "harvest-records", "prune"]
+
+
+@dataclass
+class Cell:
+    name: str
+    stage: str
+    params: List[str]
+    returns: List[str]
+    function: Callable[..., Any]
+    is_async: bool
+
+
+@dataclass
+class StageResult:
+    status: str = "pending"
+    cells: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+    depends_on: Set[str] = field(default_factory=set)
+
+
+def section_stage(heading: str) -> Optional[str]:
+    """Map a markdown heading such as '### 3h. Typed artifact storage' to its stage name."""
+    title = heading.lstrip("#").strip()
+    match = re.match(r"(\d+)([a-z]?)\.", title)
+    if match is None:
+        return SECTION_STAGES.get(title.split()[0]) if title else None
+    number, suffix = match.groups()
+    return SECTION_STAGES.get(number + suffix) or SECTION_STAGES.get(number)
+
+
+def load_cells(path: Path) -> List[Cell]:
+    """Compile every code cell of the notebook, tagged with the stage of the section it sits in, in run order."""
+    source = path.read_text(encoding="utf-8")
+    tree = ast.parse(source, filename=str(path))
+    cells: List[Cell] = []
+    stage = "setup"
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or not node.decorator_list:
+            continue
+        params = [arg.arg for arg in node.args.args]
+        returned = node.body[-1].value if isinstance(node.body[-1], ast.Return) else None
+        if isinstance(returned, ast.Tuple):
+            returns = [element.id for element in returned.elts]
+        elif isinstance(returned, ast.Name):
+            returns = [returned.id]
+        else:
+            returns = []
+        if params == ["mo"] and not returns:
+            # Markdown cell: its heading decides the stage of the cells that follow
+            heading = re.search(r'"""\s*(#+ [^\n]+)', ast.get_source_segment(source, node) or "")
+            if heading and section_stage(heading.group(1)):
+                stage = section_stage(heading.group(1))
+            continue
+        node.decorator_list = []
+        namespace: Dict[str, Any] = {"__file__": str(path), "__name__": "__etl_cell__"}
+        exec(compile(ast.Module(body=[node], type_ignores=[]), str(path), "exec"), namespace)
+        cells.append(
+            Cell(
+                name=f"{path.name}:{node.lineno}",
+                stage=stage,
+                params=params,
+                returns=returns,
+                function=namespace[node.name],
+                is_async=isinstance(node, ast.AsyncFunctionDef),
+            )
+        )
+    return topological_order(cells)
+
+
+def topological_order(cells: List[Cell]) -> List[Cell]:
+    """Order cells so each runs after the cells defining its parameters (as marimo does), keeping notebook order otherwise."""
+    providers = {name: index for index, cell in enumerate(cells) for name in cell.returns}
+    ordered: List[Cell] = []
+    placed: Set[int] = set()
+
+    def place(index: int, visiting: Set[int]) -> None:
+        if index in placed:
+            return
+        if index in visiting:
+            raise SystemExit(f"Cycle between notebook cells around {cells[index].name}.")
+        visiting.add(index)
+        for param in cells[index].params:
+            if param in providers:
+                place(providers[param], visiting)
+        placed.add(index)
+        ordered.append(cells[index])
+
+    for index in range(len(cells)):
+        place(index, set())
+    return ordered
+
+
+def stage_dependencies(cells: List[Cell]) -> Dict[str, Set[str]]:
+    providers = {name: cell.stage for cell in cells for name in cell.returns}
+    dependencies: Dict[str, Set[str]] = {cell.stage: set() for cell in cells}
+    for cell in cells:
+        for param in cell.params:
+            provider = providers.get(param)
+            if provider is None:
+                raise SystemExit(f"{cell.name} uses {param!r}, which no cell defines.")
+            if provider != cell.stage:
+                dependencies[cell.stage].add(provider)
+    for stage, extra in ARTIFACT_DEPENDENCIES.items():
+        dependencies.setdefault(stage, set()).update(extra & dependencies.keys())
+    return dependencies
+
+
+def select_stages(cells: List[Cell], dependencies: Dict[str, Set[str]], only: List[str], skip: List[str]):
+    """Resolve --only/--skip into the stages to run and the names to read back from artifacts."""
+    known = list(dict.fromkeys(cell.stage for cell in cells))
+    for stage in [*only, *skip]:
+        if stage not in known:
+            raise SystemExit(f"Unknown stage {stage!r}; choose from: {', '.join(known)}")
+    selected = set(only or known) - set(skip)
+    providers = {name: cell.stage for cell in cells for name in cell.returns}
+    hydrated: Set[str] = set()
+    pending = list(selected)
+    while pending:
+        stage = pending.pop()
+        for cell in (cell for cell in cells if cell.stage == stage):
+            for param in cell.params:
+                provider = providers[param]
+                if provider in selected:
+                    continue
+                if param in HYDRATED_NAMES and provider != "setup":
+                    hydrated.add(param)
+                    continue
+                if provider != "setup":
+                    print(f"Stage {stage} needs {param!r} from {provider}; running {provider} as well.")
+                selected.add(provider)
+                pending.append(provider)
+    if hydrated:
+        # Stored artifacts are read through the notebook's own read_artifact()
+        selected.add(providers["read_artifact"])
+    ordered = [stage for stage in known if stage in selected]
+    return ordered, {stage: dependencies[stage] & selected for stage in ordered}, hydrated
+
+
+class StageRunner:
+    """Runs stages on a thread pool; async cells share one event loop so their locks and clients stay valid."""
+
+    def __init__(self, cells: List[Cell], jobs: int):
+        self.cells = cells
+        self.jobs = jobs
+        self.namespace: Dict[str, Any] = {}
+        self.namespace_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="etl-event-loop", daemon=True)
+
+    def run_cell(self, cell: Cell) -> None:
+        with self.namespace_lock:
+            kwargs = {param: self.namespace[param] for param in cell.params}
+        if cell.is_async:
+            returned = asyncio.run_coroutine_threadsafe(cell.function(**kwargs), self.loop).result()
+        else:
+            returned = cell.function(**kwargs)
+        if cell.returns:
+            with self.namespace_lock:
+                self.namespace.update(zip(cell.returns, returned))
+
+    def run_stage(self, stage: str, result: StageResult) -> None:
+        started = time.perf_counter()
+        try:
+            for cell in (cell for cell in self.cells if cell.stage == stage):
+                self.run_cell(cell)
+                result.cells += 1
+        finally:
+            result.seconds = time.perf_counter() - started
+
+    def finish(self, stage: str, result: StageResult, error: Optional[BaseException]) -> None:
+        result.status = "ok" if error is None else "failed"
+        if error is not None:
+            result.error = f"{type(error).__name__}: {error}"
+            print(f"Stage {stage} failed: {result.error}")
+
+    def hydrate(self, names: Set[str]) -> None:
+        read_artifact = self.namespace["read_artifact"]
+        for name in sorted(names):
+            frame = read_artifact(HYDRATED_NAMES[name])
+            if frame is None:
+                raise FileNotFoundError(f"{name!r} is needed but artifact {HYDRATED_NAMES[name]} does not exist yet; run its stage first.")
+            print(f"Using the stored {HYDRATED_NAMES[name]} artifact for {name!r}.")
+            self.namespace[name] = frame
+
+    def run(self, stages: List[str], dependencies: Dict[str, Set[str]], hydrated: Set[str]) -> Dict[str, StageResult]:
+        results = {stage: StageResult(depends_on=dependencies[stage]) for stage in stages}
+        self.loop_thread.start()
+        # Every stage depends on setup, so it runs first; the stored artifacts can be read once it has
+        setup = results.get("setup")
+        if setup is not None:
+            error = None
+            try:
+                self.run_stage("setup", setup)
+                self.hydrate(hydrated)
+            except Exception as exc:
+                error = exc
+            self.finish("setup", setup, error)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="etl-stage") as pool:
+            while True:
+                for stage in stages:
+                    result = results[stage]
+                    if result.status != "pending":
+                        continue
+                    upstream = [results[dependency].status for dependency in result.depends_on]
+                    if any(status in {"failed", "blocked"} for status in upstream):
+                        result.status = "blocked"
+                    elif all(status == "ok" for status in upstream):
+                        result.status = "running"
+                        running[pool.submit(self.run_stage, stage, result)] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    self.finish(stage, results[stage], future.exception())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        return results
+
+
+def print_timing_table(results: Dict[str, StageResult], wall_seconds: float) -> None:
+    print()
+    print(f"{'stage':<16} {'status':<8} {'cells':>5} {'seconds':>9}  after")
+    for stage, result in results.items():
+        after = ", ".join(sorted(result.depends_on)) or "-"
+        print(f"{stage:<16} {result.status:<8} {result.cells:>5} {result.seconds:>9.2f}  {after}")
+    stage_seconds = sum(result.seconds for result in results.values())
+    print(f"Wall time {wall_seconds:.2f}s for {stage_seconds:.2f}s of stage time.")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the OpenAIRE overview ETL without the marimo UI.")
+    parser.add_argument("--only", action="append", default=[], metavar="STAGE", help="run only this stage (repeatable)")
+    parser.add_argument("--skip", action="append", default=[], metavar="STAGE", help="skip this stage (repeatable)")
+    parser.add_argument("--jobs", type=int, default=4, help="stages to run at the same time (default: 4)")
+    parser.add_argument("--list", action="store_true", help="print the stages and their dependencies, then exit")
+    parser.add_argument("--timings-json", type=Path, metavar="PATH", help="also write the stage timings to this JSON file")
+    for flag in ETL_FLAGS:
+        parser.add_argument(f"--{flag}", action="store_true", help=f"forwarded to the notebook as ETL_{flag.upper().replace('-', '_')}=1")
+    args = parser.parse_args(argv)
+
+    cells = load_cells(NOTEBOOK)
+    dependencies = stage_dependencies(cells)
+    if args.list:
+        for stage in dict.fromkeys(cell.stage for cell in cells):
+            count = sum(cell.stage == stage for cell in cells)
+            print(f"{stage:<16} {count:>3} cells  after: {', '.join(sorted(dependencies[stage])) or '-'}")
+        return 0
+
+    for flag in ETL_FLAGS:
+        if getattr(args, flag.replace("-", "_")):
+            os.environ[f"ETL_{flag.upper().replace('-', '_')}"] = "1"
+    # Charts are written to img/ only; plt.show() becomes a no-op
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    warnings.filterwarnings("ignore", message=".*non-interactive.*")
+
+    stages, selected_dependencies, hydrated = select_stages(cells, dependencies, args.only, args.skip)
+    started = time.perf_counter()
+    results = StageRunner(cells, jobs=max(1, args.jobs)).run(stages, selected_dependencies, hydrated)
+    wall_seconds = time.perf_counter() - started
+    print_timing_table(results, wall_seconds)
+    if args.timings_json:
+        timings = {stage: {"status": result.status, "cells": result.cells, "seconds": round(result.seconds, 3), "error": result.error} for stage, result in results.items()}
+        args.timings_json.write_text(json.dumps({"wall_seconds": round(wall_seconds, 3), "stages": timings}, indent=2), encoding="utf-8")
+    return 0 if all(result.status == "ok" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
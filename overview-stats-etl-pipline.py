@@ -6,6 +6,7 @@
 #     "openpyxl",
 #     "python-dotenv",
 #     "requests",
+#     "httpx",
 #     "tqdm",
 #     "pyarrow",
 #     "plotly",
@@ -86,18 +87,22 @@ def _():
 @app.cell
 def _():
     import marimo as mo
-    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import asyncio
     import os
     import csv
+    import hashlib
+    import json
+    import threading
     import time
     from copy import deepcopy
     from io import StringIO
     from pathlib import Path
     from datetime import datetime
-    from typing import Any, Dict, Optional, Union
+    from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Union
 
     import matplotlib.pyplot as plt
     import pandas as pd
+    import httpx
     import requests
     from tqdm.auto import tqdm
     from dotenv import load_dotenv
@@ -115,19 +120,17 @@ def _():
     CLIENT_ID = os.getenv("CLIENT_ID")
     CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
-    if not CLIENT_ID or not CLIENT_SECRET:
-        raise RuntimeError(
-            "Missing OpenAIRE credentials. Set CLIENT_ID and CLIENT_SECRET in the environment."
-        )
-
-    BASE_URL = "https://api.openaire.eu/graph"
-    TOKEN_URL = "https://aai.openaire.eu/oidc/token"
+    # The OPENAIRE_* and ETL_DATA_DIR overrides point a run at mock-openaire-api.py and a scratch data folder
+    BASE_URL = os.getenv("OPENAIRE_BASE_URL", "https://api.openaire.eu/graph")
+    TOKEN_URL = os.getenv("OPENAIRE_TOKEN_URL", "https://aai.openaire.eu/oidc/token")
     API_USER_AGENT = "OpenAIRE-tools overview-stats notebook"
-    API_PAUSE_SECONDS = 0.1  # throttle requests a bit to stay within rate limits
+    API_INITIAL_RATE = float(os.getenv("OPENAIRE_API_INITIAL_RATE", 10.0))  # requests/second the adaptive Graph API limiter starts from
+    API_MAX_RATE = float(os.getenv("OPENAIRE_API_MAX_RATE", 50.0))  # ceiling the limiter may grow to while the API keeps answering
     TOKEN_REFRESH_BUFFER = 60  # refresh the token one minute before expiration
+    GRAPH_API_MAX_IN_FLIGHT = 64  # cap on concurrent Graph API requests from the async client
 
-    DATA_DIR = Path("data")
-    DATA_DIR.mkdir(exist_ok=True)
+    DATA_DIR = Path(os.getenv("ETL_DATA_DIR", "data"))
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
     IMG_DIR = Path("img")
     IMG_DIR.mkdir(exist_ok=True)
 
@@ -144,35 +147,59 @@ def _():
         *PRODUCT_TYPE_LABELS.values(),
     ]
 
-    _access_token: Optional[str] = None
-    _access_token_expiry: float = 0.0
+    def etl_flag(name: str) -> bool:
+        """True when `--<name>` was passed to the notebook or `ETL_<NAME>` is set in the environment."""
+        env_value = os.getenv(f"ETL_{name.upper().replace('-', '_')}", "")
+        try:
+            cli_args = mo.cli_args()
+        except Exception:
+            # No marimo runtime: the cells are being run by overview-stats-etl-cli.py, which forwards flags as ETL_* variables
+            cli_args = {}
+        return name in cli_args or env_value.strip().lower() in {"1", "true", "yes"}
+
+    # A --replay run is served from a recorded cassette and needs no credentials
+    if (not CLIENT_ID or not CLIENT_SECRET) and not etl_flag("replay"):
+        raise RuntimeError(
+            "Missing OpenAIRE credentials. Set CLIENT_ID and CLIENT_SECRET in the environment."
+        )
 
     print("Setup complete.")
     return (
-        API_PAUSE_SECONDS,
+        API_INITIAL_RATE,
+        API_MAX_RATE,
         API_USER_AGENT,
         Any,
+        AsyncIterator,
+        Awaitable,
         BASE_URL,
         CLIENT_ID,
         CLIENT_SECRET,
+        Callable,
         DATA_DIR,
         Dict,
+        GRAPH_API_MAX_IN_FLIGHT,
         IMG_DIR,
+        Iterable,
         METRIC_ORDER,
         Optional,
         PRODUCT_TYPE_LABELS,
         Path,
         TOKEN_REFRESH_BUFFER,
         TOKEN_URL,
-        ThreadPoolExecutor,
         Union,
-        as_completed,
+        asyncio,
         datetime,
         deepcopy,
+        etl_flag,
+        hashlib,
+        httpx,
+        json,
         mo,
+        os,
         pd,
         plt,
         requests,
+        threading,
         time,
         tqdm,
     )
@@ -188,7 +215,7 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, Optional, Path, Union, pd, requests):
+def _(DATA_DIR, Optional, Path, Union, hashlib, json, pd, requests):
     # 2. Load the NL organizations reference table
     # Download the latest NL organizations baseline from the Google Sheets URL
 
@@ -323,17 +350,128 @@ def _(DATA_DIR, Optional, Path, Union, pd, requests):
         # Return the parsed university entries
         return parsed
 
+    # Columnar counterparts of _pick, extract_ror_id and normalise_ror_link
+    def _coalesce(df: pd.DataFrame, *columns: str) -> pd.Series:
+        # First non-blank (stripped) value across the columns, "" when all are blank or absent
+        result = pd.Series("", index=df.index, dtype=object)
+        for column in reversed(columns):
+            if column not in df.columns:
+                continue
+            values = df[column].fillna("").astype(str).str.strip().astype(object)
+            result = values.where(values != "", result)
+        return result
+
+    def _extract_ror_ids(values: pd.Series) -> pd.Series:
+        values = values.str.strip()
+        return values.where(~values.str.startswith("http"), values.str.rstrip("/").str.split("/").str[-1])
+
+    def _normalise_ror_links(values: pd.Series) -> pd.Series:
+        values = values.str.strip()
+        bare = values.str.strip("/")
+        links = ("https://ror.org/" + bare).where(bare != "", "")
+        links = links.where(~values.str.startswith("ror.org"), "https://" + values)
+        return links.where(~values.str.startswith("http"), values)
+
+    # Parse university rows from the DataFrame, one column at a time
+    def parse_university_frame(df: pd.DataFrame) -> pd.DataFrame:
+        # Same entries as parse_university_rows, built with column operations instead of iterrows
+        names = _coalesce(df, "full_name_in_English", "University", "organization_name")
+        df = df.loc[names != ""]
+        names = names.loc[df.index]
+        ror_id = _extract_ror_ids(_coalesce(df, "ROR"))
+        ror_link_source = _coalesce(df, "ROR_LINK")
+        ror_link = _normalise_ror_links(ror_link_source.where(ror_link_source != "", ror_id))
+        ror_id = ror_id.where(ror_id != "", _extract_ror_ids(ror_link))
+        main_datasource = _coalesce(df, "OpenAIRE Data Source ID (Main/CRIS)", "OpenAIRE Data Source ID (Main/CRIS) LINK", "main_datasource_id")
+        secondary_datasource = _coalesce(df, "OpenAIRE Data Source (Secondary/Repository)", "OpenAIRE Data Source (Secondary/Repository) LINK", "secondary_datasource_id")
+        # OpenDOAR identifiers belong in the secondary (repository) slot
+        opendoar_main = main_datasource.str.startswith("opendoar") & (secondary_datasource == "")
+        secondary_datasource = secondary_datasource.where(~opendoar_main, main_datasource)
+        main_datasource = main_datasource.where(~opendoar_main, "")
+        parsed = pd.DataFrame(
+            {
+                "name": names,
+                "acronym_EN": _coalesce(df, "acronym_EN"),
+                "acronym_AGG": _coalesce(df, "acronym_AGG"),
+                "grouping": _coalesce(df, "main_grouping"),
+                "ROR": ror_id,
+                "ROR_LINK": ror_link,
+                "OpenAIRE_ORG_ID": _coalesce(df, "OpenAIRE_ORG_ID", "OpenAIRE OpenORG ID", "OpenAIRE OpenORG ID LINK", "openorg_id"),
+                "main_datasource_id": main_datasource,
+                "secondary_datasource_id": secondary_datasource,
+            }
+        ).reset_index(drop=True)
+        # Blank fields become None, as in the row-wise parser
+        return parsed.astype(object).where(parsed != "", None)
+
+    # Fingerprint a parsed university entry
+    def baseline_row_hash(entry: dict[str, Optional[str]]) -> str:
+        # Hash the normalised fields so step 5 can tell new or edited baseline rows from unchanged ones
+        payload = json.dumps({key: value for key, value in entry.items() if key != "baseline_hash"}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
     # Load the NL organizations reference table and parse universities
     nl_orgs_df = load_university_table(TABLE_PATH, NL_ORGS_SHEET_NAME)
     # Parse universities from the loaded DataFrame
-    universities = parse_university_rows(nl_orgs_df)
+    universities_df = parse_university_frame(nl_orgs_df)
+    universities_df["baseline_hash"] = [baseline_row_hash(entry) for entry in universities_df.to_dict("records")]
     # Display the number of parsed universities
-    print(f"Parsed {len(universities)} universities from the reference table (loaded from {TABLE_PATH}).")
-    # Convert the list of universities to a DataFrame for display
-    universities_df = pd.DataFrame(universities)
+    print(f"Parsed {len(universities_df)} universities from the reference table (loaded from {TABLE_PATH}).")
     # Display the DataFrame of universities
     universities_df
-    return normalise_ror_link, universities_df
+    return (
+        normalise_ror_link,
+        parse_university_frame,
+        parse_university_rows,
+        universities_df,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 2a. Baseline parser benchmark
+    `parse_university_frame` resolves the fallback columns, ROR normalisation and the OpenDOAR main → secondary swap with column operations; `parse_university_rows` is the original row-by-row parser it replaces. Pass `--benchmark-parsing` to time both on a synthetic 100,000-row sheet and check that they return the same entries.
+    """)
+    return
+
+
+@app.cell
+def _(etl_flag, parse_university_frame, parse_university_rows, pd, time):
+    # 2a. Benchmark the row-wise and columnar baseline parsers (opt-in)
+    if etl_flag("benchmark-parsing"):
+        _rows = 100_000
+        _ror_ids = [f"0{index:08x}" for index in range(_rows)]
+        # Mix every input shape the parsers handle: fallback name columns, bare/URL/ror.org ROR values,
+        # blank cells, padded values and OpenDOAR identifiers in the main data source column
+        synthetic_sheet = pd.DataFrame(
+            {
+                "full_name_in_English": ["" if index % 10 == 0 else f" University {index} " for index in range(_rows)],
+                "University": [f"Universiteit {index}" if index % 20 == 0 else "" for index in range(_rows)],
+                "acronym_EN": [f"U{index}" if index % 3 else "" for index in range(_rows)],
+                "main_grouping": [["UNL", "NFU", "", "VH"][index % 4] for index in range(_rows)],
+                "ROR": [["", ror_id, f"https://ror.org/{ror_id}/", f" {ror_id} "][index % 4] for index, ror_id in enumerate(_ror_ids)],
+                "ROR_LINK": [["", f"ror.org/{ror_id}", f"https://ror.org/{ror_id}"][index % 3] for index, ror_id in enumerate(_ror_ids)],
+                "OpenAIRE_ORG_ID": [f"openorgs____::{index:032x}" if index % 5 else "" for index in range(_rows)],
+                "OpenAIRE Data Source ID (Main/CRIS)": [["", f"opendoar____::{index}", f"cris________::{index}"][index % 3] for index in range(_rows)],
+                "OpenAIRE Data Source (Secondary/Repository)": [f"opendoar____::{index + 1}" if index % 4 == 0 else "" for index in range(_rows)],
+            }
+        )
+        _started = time.perf_counter()
+        rowwise_entries = parse_university_rows(synthetic_sheet)
+        pd.DataFrame(rowwise_entries)
+        rowwise_seconds = time.perf_counter() - _started
+        _started = time.perf_counter()
+        columnar_frame = parse_university_frame(synthetic_sheet)
+        columnar_seconds = time.perf_counter() - _started
+        parsers_agree = rowwise_entries == columnar_frame.to_dict("records")
+        print(
+            f"Parsed {len(columnar_frame):,} of {_rows:,} synthetic rows: row-wise {rowwise_seconds:.2f}s, "
+            f"columnar {columnar_seconds:.2f}s ({rowwise_seconds / columnar_seconds:.1f}x faster); identical output: {parsers_agree}"
+        )
+    else:
+        print("Baseline parser benchmark skipped; pass --benchmark-parsing to run it.")
+    return
 
 
 @app.cell(hide_code=True)
@@ -347,23 +485,23 @@ def _(mo):
 
 @app.cell
 def _(
-    API_PAUSE_SECONDS,
     API_USER_AGENT,
     Any,
     BASE_URL,
-    CLIENT_ID,
-    CLIENT_SECRET,
     Dict,
     METRIC_ORDER,
     Optional,
+    GRAPH_API_TIMEOUT,
     PRODUCT_TYPE_LABELS,
-    TOKEN_REFRESH_BUFFER,
-    TOKEN_URL,
-    _cell_8_access_token,
-    _cell_8_access_token_expiry,
+    cassette,
+    circuit_breaker_for,
     deepcopy,
+    graph_cache,
+    graph_rate_limiter,
+    graph_retry_policy,
     requests,
-    time,
+    run_metrics,
+    token_manager,
 ):
     # Define scenarios for collecting metrics per organisation
     SCENARIO_DEFS = [
@@ -407,29 +545,17 @@ def _(
 
     EMPTY_METRICS = {metric: None for metric in METRIC_ORDER}
 
+    # One pooled session for all synchronous calls so lookups reuse their connection; http too,
+    # so an OPENAIRE_BASE_URL override such as the local mock API takes the same path
+    graph_session = requests.Session()
+    _graph_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    graph_session.mount("https://", _graph_adapter)
+    graph_session.mount("http://", _graph_adapter)
+
     def obtain_access_token() -> str:
         """Return a cached OpenAIRE access token, refreshing it when needed."""
-        global _access_token, _access_token_expiry
-        now = time.time()
-        if _access_token and now < _access_token_expiry:
-            return _access_token
-
-        response = requests.post(
-            TOKEN_URL,
-            data={"grant_type": "client_credentials"},
-            auth=(CLIENT_ID, CLIENT_SECRET),
-            headers={"User-Agent": API_USER_AGENT},
-            timeout=60,
-        )
-        response.raise_for_status()
-        payload = response.json()
-        token = payload.get("access_token")
-        if not token:
-            raise RuntimeError("OpenAIRE token response did not include an access_token.")
-        expires_in = int(payload.get("expires_in", 3600))
-        _access_token = token
-        _access_token_expiry = now + max(expires_in - TOKEN_REFRESH_BUFFER, 0)
-        return _access_token
+        with run_metrics.timed("access_token"):
+            return token_manager.get_token()
 
     def call_graph_api(path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Invoke the OpenAIRE Graph API and return the decoded JSON payload."""
@@ -438,54 +564,2866 @@ def _(
         effective_params.setdefault("page", 1)
         effective_params.setdefault("pageSize", 1)
 
-        headers = {
-            "User-Agent": API_USER_AGENT,
-            "Authorization": f"Bearer {obtain_access_token()}",
-        }
+        # In record and replay mode every request goes through the cassette
+        cached = None if cassette.active else graph_cache.get(path, effective_params)
+        if cached is not None:
+            run_metrics.count("graph_api_calls_total", endpoint=path, source="cache")
+            return cached
 
-        response = requests.get(
-            url,
-            params=effective_params,
-            headers=headers,
-            timeout=60,
-        )
+        def send() -> requests.Response:
+            headers = {
+                "User-Agent": API_USER_AGENT,
+                "Authorization": f"Bearer {obtain_access_token()}",
+            }
+            return graph_session.get(
+                url,
+                params=effective_params,
+                headers=headers,
+                timeout=GRAPH_API_TIMEOUT,
+            )
+
+        with run_metrics.timed("graph_api_request", endpoint=path):
+            response = cassette.call(
+                url,
+                effective_params,
+                lambda: graph_retry_policy.call(
+                    send,
+                    breaker=circuit_breaker_for(f"graph-api{path}"),
+                    limiter=graph_rate_limiter,
+                ),
+            )
+        source = "cassette" if cassette.replaying else "network"
+        run_metrics.count("graph_api_calls_total", endpoint=path, source=source, status=response.status_code)
+        run_metrics.count("graph_api_response_bytes_total", len(response.content), endpoint=path)
         response.raise_for_status()
-        time.sleep(API_PAUSE_SECONDS)
-        return response.json()
+        payload = response.json()
+        if not cassette.replaying:
+            graph_cache.put(path, effective_params, payload)
+        return payload
+
+    def fetch_num_found(path: str, params: Dict[str, Any]) -> Optional[int]:
+        """Return the total number of matching records for the supplied endpoint."""
+        with run_metrics.timed("num_found", endpoint=path):
+            payload = call_graph_api(path, params)
+        header = payload.get("header", {})
+        num_found = header.get("numFound")
+        if num_found is None:
+            run_metrics.count("num_found_missing_total", endpoint=path)
+        return int(num_found) if num_found is not None else None
+
+    def build_filters(scenario_key: str, entity_id: str) -> Dict[str, Dict[str, Any]]:
+        builder = FILTER_BUILDERS[scenario_key]
+        return {name: dict(filters) for name, filters in builder(entity_id).items()}
+
+    def collect_metrics(scenario_key: str, entity_id: Optional[str]) -> Dict[str, Optional[int]]:
+        if not entity_id:
+            return deepcopy(EMPTY_METRICS)
+
+        filters = build_filters(scenario_key, entity_id)
+        results: Dict[str, Optional[int]] = {}
+
+        results["Funding / Projects"] = fetch_num_found("/v1/projects", filters["projects"])
+        results["Data sources"] = fetch_num_found("/v1/dataSources", filters["dataSources"])
+
+        for rp_type, label in PRODUCT_TYPE_LABELS.items():
+            rp_params = dict(filters["researchProducts"], type=rp_type)
+            results[label] = fetch_num_found("/v2/researchProducts", rp_params)
+
+        return results
+    return (
+        EMPTY_METRICS,
+        build_filters,
+        call_graph_api,
+        collect_metrics,
+        fetch_num_found,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3a. Asynchronous Graph API client
+    The bulk collection steps (5, 7 and 8) issue thousands of small numFound lookups. `AsyncGraphClient` keeps one pooled HTTP connection set open for the whole batch and caps the number of requests in flight, so those lookups run as coroutines instead of one thread per request.
+    """)
+    return
+
+
+@app.cell
+def _(
+    API_USER_AGENT,
+    Any,
+    BASE_URL,
+    Dict,
+    EMPTY_METRICS,
+    GRAPH_API_MAX_IN_FLIGHT,
+    Optional,
+    GRAPH_API_TIMEOUT,
+    PRODUCT_TYPE_LABELS,
+    asyncio,
+    build_filters,
+    cassette,
+    circuit_breaker_for,
+    deepcopy,
+    graph_cache,
+    graph_rate_limiter,
+    graph_retry_policy,
+    httpx,
+    run_metrics,
+    token_manager,
+):
+    class AsyncGraphClient:
+        """Pooled asyncio client for the OpenAIRE Graph API.
+
+        Use it as ``async with AsyncGraphClient() as client:`` around a batch of
+        lookups; the connection pool and in-flight cap live for the whole block.
+        """
+
+        def __init__(self, max_in_flight: int = GRAPH_API_MAX_IN_FLIGHT):
+            self.max_in_flight = max_in_flight
+            self._client: Optional[httpx.AsyncClient] = None
+            self._slots: Optional[asyncio.Semaphore] = None
+
+        async def __aenter__(self) -> "AsyncGraphClient":
+            self._client = httpx.AsyncClient(
+                headers={"User-Agent": API_USER_AGENT},
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight,
+                    max_keepalive_connections=self.max_in_flight,
+                ),
+                timeout=httpx.Timeout(GRAPH_API_TIMEOUT[1], connect=GRAPH_API_TIMEOUT[0]),
+            )
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            return self
+
+        async def __aexit__(self, *exc_info) -> None:
+            await self._client.aclose()
+            self._client = None
+
+        async def call_graph_api(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+            """Coroutine version of `call_graph_api`."""
+            url = f"{BASE_URL}{path}"
+            effective_params = dict(params or {})
+            effective_params.setdefault("page", 1)
+            effective_params.setdefault("pageSize", 1)
+
+            cached = None if cassette.active else graph_cache.get(path, effective_params)
+            if cached is not None:
+                run_metrics.count("graph_api_calls_total", endpoint=path, source="cache")
+                return cached
+
+            async def send() -> httpx.Response:
+                with run_metrics.timed("access_token"):
+                    token = await token_manager.get_token_async()
+                headers = {"Authorization": f"Bearer {token}"}
+                async with self._slots:
+                    return await self._client.get(url, params=effective_params, headers=headers)
+
+            with run_metrics.timed("graph_api_request", endpoint=path):
+                response = await cassette.call_async(
+                    url,
+                    effective_params,
+                    lambda: graph_retry_policy.call_async(
+                        send,
+                        breaker=circuit_breaker_for(f"graph-api{path}"),
+                        limiter=graph_rate_limiter,
+                    ),
+                )
+            source = "cassette" if cassette.replaying else "network"
+            run_metrics.count("graph_api_calls_total", endpoint=path, source=source, status=response.status_code)
+            run_metrics.count("graph_api_response_bytes_total", len(response.content), endpoint=path)
+            response.raise_for_status()
+            payload = response.json()
+            if not cassette.replaying:
+                graph_cache.put(path, effective_params, payload)
+            return payload
+
+        async def fetch_num_found(self, path: str, params: Dict[str, Any]) -> Optional[int]:
+            """Coroutine version of `fetch_num_found`."""
+            with run_metrics.timed("num_found", endpoint=path):
+                payload = await self.call_graph_api(path, params)
+            num_found = payload.get("header", {}).get("numFound")
+            if num_found is None:
+                run_metrics.count("num_found_missing_total", endpoint=path)
+            return int(num_found) if num_found is not None else None
+
+        async def collect_metrics(self, scenario_key: str, entity_id: Optional[str]) -> Dict[str, Optional[int]]:
+            """Coroutine version of `collect_metrics`; the per-entity lookups run concurrently."""
+            if not entity_id:
+                return deepcopy(EMPTY_METRICS)
+
+            filters = build_filters(scenario_key, entity_id)
+            lookups = {
+                "Funding / Projects": ("/v1/projects", filters["projects"]),
+                "Data sources": ("/v1/dataSources", filters["dataSources"]),
+            }
+            for rp_type, label in PRODUCT_TYPE_LABELS.items():
+                lookups[label] = ("/v2/researchProducts", dict(filters["researchProducts"], type=rp_type))
+
+            counts = await asyncio.gather(*(self.fetch_num_found(path, params) for path, params in lookups.values()))
+            return dict(zip(lookups.keys(), counts))
+    return (AsyncGraphClient,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3b. Adaptive rate limiting
+    Every Graph API request (sync or async) and every OAI-PMH probe takes a token from a shared `AdaptiveRateLimiter` before it is sent. The refill rate grows a little with every accepted request and is halved whenever the server answers 429/503, after waiting for its `Retry-After`, so the pipeline settles at the fastest rate the backend accepts.
+    """)
+    return
+
+
+@app.cell
+def _(
+    API_INITIAL_RATE,
+    API_MAX_RATE,
+    Optional,
+    asyncio,
+    datetime,
+    threading,
+    time,
+):
+    from email.utils import parsedate_to_datetime
+
+    THROTTLE_STATUS_CODES = {429, 503}
+
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Return the Retry-After header as seconds to wait (it may be seconds or an HTTP date)."""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0.0)
+
+    class AdaptiveRateLimiter:
+        """Thread-safe token bucket whose refill rate follows AIMD feedback from the server.
+
+        Each accepted response adds `increase` requests/second to the rate; a 429/503
+        multiplies it by `decrease_factor` and pauses the bucket for the server's
+        Retry-After (or `default_backoff` seconds when the header is missing).
+        """
+
+        def __init__(
+            self,
+            name: str,
+            rate: float,
+            min_rate: float,
+            max_rate: float,
+            increase: float = 0.05,
+            decrease_factor: float = 0.5,
+            default_backoff: float = 5.0,
+        ):
+            self.name = name
+            self.rate = rate
+            self.min_rate = min_rate
+            self.max_rate = max_rate
+            self.increase = increase
+            self.decrease_factor = decrease_factor
+            self.default_backoff = default_backoff
+            self.granted = 0
+            self.throttled = 0
+            self._lock = threading.Lock()
+            self._tokens = 1.0
+            self._updated = time.monotonic()
+            self._started: Optional[float] = None
+            self._last_grant = 0.0
+
+        def _reserve(self) -> float:
+            """Take one token and return how long the caller must wait before using it."""
+            with self._lock:
+                now = time.monotonic()
+                if self._started is None:
+                    self._started = now
+                burst = max(self.rate, 1.0)
+                self._tokens = min(burst, self._tokens + max(now - self._updated, 0.0) * self.rate)
+                self._updated = max(now, self._updated)
+                self._tokens -= 1
+                self.granted += 1
+                wait = (self._updated - now) + max(-self._tokens, 0.0) / self.rate
+                self._last_grant = now + wait
+                return wait
+
+        def acquire(self) -> None:
+            wait = self._reserve()
+            if wait:
+                time.sleep(wait)
+
+        async def acquire_async(self) -> None:
+            wait = self._reserve()
+            if wait:
+                await asyncio.sleep(wait)
+
+        def observe(self, status_code: int, retry_after: Optional[str] = None) -> bool:
+            """Feed a response status back into the limiter; returns True when the request was throttled."""
+            with self._lock:
+                if status_code not in THROTTLE_STATUS_CODES:
+                    if status_code < 400:
+                        self.rate = min(self.max_rate, self.rate + self.increase)
+                    return False
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                pause = parse_retry_after(retry_after)
+                pause_until = time.monotonic() + (pause if pause is not None else self.default_backoff)
+                # Empty the bucket and stop refilling it until the pause is over
+                self._tokens = min(self._tokens, 0.0)
+                self._updated = max(self._updated, pause_until)
+                return True
+
+        def summary(self) -> str:
+            elapsed = (self._last_grant - self._started) if self._started is not None else 0.0
+            achieved = self.granted / elapsed if elapsed > 0 else float(self.granted)
+            return (
+                f"Rate limiter '{self.name}': {self.granted} requests at {achieved:.1f} req/s achieved, "
+                f"{self.throttled} throttled responses, current limit {self.rate:.1f} req/s"
+            )
+
+    graph_rate_limiter = AdaptiveRateLimiter("graph-api", rate=API_INITIAL_RATE, min_rate=1.0, max_rate=API_MAX_RATE)
+
+    _host_limiters: dict[str, AdaptiveRateLimiter] = {}
+    _host_limiters_lock = threading.Lock()
+
+    def rate_limiter_for_host(host: str) -> AdaptiveRateLimiter:
+        """Return the shared limiter for an OAI-PMH host, creating it on first use."""
+        with _host_limiters_lock:
+            if host not in _host_limiters:
+                _host_limiters[host] = AdaptiveRateLimiter(f"oai:{host}", rate=2.0, min_rate=0.2, max_rate=10.0)
+            return _host_limiters[host]
+
+    def log_rate_limits() -> None:
+        """Print the achieved Graph API rate and any OAI-PMH hosts that throttled us."""
+        if graph_rate_limiter.granted:
+            print(graph_rate_limiter.summary())
+        with _host_limiters_lock:
+            host_limiters = list(_host_limiters.values())
+        if host_limiters:
+            requests_sent = sum(limiter.granted for limiter in host_limiters)
+            print(f"OAI-PMH probes: {requests_sent} requests across {len(host_limiters)} hosts")
+            for limiter in host_limiters:
+                if limiter.throttled:
+                    print(f"  {limiter.summary()}")
+    return (
+        graph_rate_limiter,
+        log_rate_limits,
+        rate_limiter_for_host,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3c. Persistent response cache
+    Successful Graph API responses are stored in `data/graph_api_cache.sqlite`, keyed by path plus normalised query parameters, so a re-run or a crashed run does not send the same count queries again. Each endpoint has its own time-to-live, the file is trimmed least-recently-used first once it outgrows its size budget, and `--refresh` (or `ETL_REFRESH=1`) bypasses cached entries while still recording fresh responses.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Any,
+    DATA_DIR,
+    Dict,
+    Optional,
+    cassette,
+    etl_flag,
+    graph_rate_limiter,
+    json,
+    log_circuit_breakers,
+    log_rate_limits,
+    run_metrics,
+    threading,
+    time,
+    token_manager,
+):
+    import sqlite3
+    import zlib
+
+    GRAPH_CACHE_PATH = DATA_DIR / "graph_api_cache.sqlite"
+    GRAPH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    GRAPH_CACHE_DEFAULT_TTL = 12 * 3600
+    GRAPH_CACHE_TTLS = {
+        "/v1/organizations": 30 * 24 * 3600,  # OpenORG identifiers hardly ever change
+        "/v1/dataSources": 24 * 3600,
+        "/v1/projects": 24 * 3600,
+        "/v2/researchProducts": 12 * 3600,
+    }
+
+    class GraphResponseCache:
+        """SQLite-backed cache of decoded Graph API payloads with per-endpoint TTLs and LRU eviction."""
+
+        def __init__(
+            self,
+            path,
+            ttls: Dict[str, float],
+            default_ttl: float,
+            max_bytes: int,
+            refresh: bool = False,
+        ):
+            self.ttls = ttls
+            self.default_ttl = default_ttl
+            self.max_bytes = max_bytes
+            self.refresh = refresh
+            self.hits = 0
+            self.misses = 0
+            self.evicted = 0
+            self._lock = threading.Lock()
+            self._con = sqlite3.connect(path, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._con.commit()
+            self._total_bytes = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        @staticmethod
+        def make_key(path: str, params: Dict[str, Any]) -> str:
+            normalised = sorted((str(name), str(value).strip()) for name, value in params.items() if value is not None)
+            return json.dumps([path, normalised], separators=(",", ":"))
+
+        def get(self, path: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            if self.refresh:
+                self.misses += 1
+                return None
+            key = self.make_key(path, params)
+            now = time.time()
+            with self._lock:
+                row = self._con.execute("SELECT payload, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttls.get(path, self.default_ttl):
+                    self.misses += 1
+                    return None
+                self._con.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._con.commit()
+                self.hits += 1
+            return json.loads(zlib.decompress(row[0]))
+
+        def put(self, path: str, params: Dict[str, Any], payload: Dict[str, Any]) -> None:
+            key = self.make_key(path, params)
+            blob = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+            now = time.time()
+            with self._lock:
+                previous = self._con.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._con.execute(
+                    "INSERT OR REPLACE INTO responses (key, path, payload, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, path, blob, len(blob), now, now),
+                )
+                self._total_bytes += len(blob) - (previous[0] if previous else 0)
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+                self._con.commit()
+
+        def _evict(self) -> None:
+            """Drop least-recently-used entries until the cache is back under 90% of its budget."""
+            target = int(self.max_bytes * 0.9)
+            rows = self._con.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+            doomed = []
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                doomed.append((key,))
+                self._total_bytes -= size
+            self._con.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            self.evicted += len(doomed)
+
+        def summary(self) -> str:
+            mode = " (refresh mode)" if self.refresh else ""
+            return (
+                f"Graph API cache{mode}: {self.hits} hits, {self.misses} misses, {self.evicted} evicted, "
+                f"{self._total_bytes / 1_048_576:.1f} MiB on disk"
+            )
+
+    graph_cache = GraphResponseCache(
+        GRAPH_CACHE_PATH,
+        ttls=GRAPH_CACHE_TTLS,
+        default_ttl=GRAPH_CACHE_DEFAULT_TTL,
+        max_bytes=GRAPH_CACHE_MAX_BYTES,
+        refresh=etl_flag("refresh"),
+    )
+
+    def log_graph_api_usage() -> None:
+        """Print cache effectiveness, token refreshes and the achieved request rate after a bulk step, and update the run report."""
+        print(graph_cache.summary())
+        print(token_manager.summary())
+        log_rate_limits()
+        log_circuit_breakers()
+        run_metrics.gauge("graph_cache_hits", graph_cache.hits)
+        run_metrics.gauge("graph_cache_misses", graph_cache.misses)
+        run_metrics.gauge("graph_cache_evicted", graph_cache.evicted)
+        run_metrics.gauge("graph_rate_limit_requests_per_second", graph_rate_limiter.rate)
+        run_metrics.gauge("graph_rate_limit_throttled", graph_rate_limiter.throttled)
+        run_metrics.gauge("token_waits", token_manager.waits)
+        run_metrics.write()
+        if cassette.active:
+            print(cassette.summary())
+            cassette.flush()
+    return graph_cache, log_graph_api_usage, sqlite3
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3d. numFound query planner
+    Collection steps register every count they need with a `NumFoundPlanner` before anything is sent. The planner drops duplicate `(path, filters)` lookups (for example a main and secondary data source with the same identifier, or a data source linked to several organisations), derives `Total Research Products` from the four product-type counts instead of asking for it separately (it is asked for directly when one of those counts failed), and only looks a data source up by `id` when none of its collected-from counts already prove it exists. `summary()` reports how many calls were saved.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Optional,
+    PRODUCT_TYPE_LABELS,
+    asyncio,
+    build_filters,
+):
+    TOTAL_PRODUCTS_LABEL = "Total Research Products"
+
+    class NumFoundPlanner:
+        """Collect the numFound lookups of a run and execute only the minimal set of calls."""
+
+        def __init__(self, known_datasource_ids: Iterable[str] = ()):
+            self.known_datasource_ids = set(known_datasource_ids)
+            self.requested = 0
+            self.sent = 0
+            self.values: dict[tuple, Optional[int]] = {}
+            self.errors: dict[tuple, str] = {}
+            self._lookups: dict[tuple, tuple[str, Dict[str, Any]]] = {}
+            self._derived_totals = 0
+            self._inferred_datasources = 0
+
+        @staticmethod
+        def make_key(path: str, filters: Dict[str, Any]) -> tuple:
+            return (path, tuple(sorted((str(name), str(value)) for name, value in filters.items())))
+
+        def add(self, path: str, filters: Dict[str, Any]) -> tuple:
+            """Register one lookup and return the key its value will be reported under."""
+            key = self.make_key(path, filters)
+            self.requested += 1
+            self._lookups.setdefault(key, (path, dict(filters)))
+            return key
+
+        def add_product_counts(self, filters: Dict[str, Any]) -> Dict[str, tuple]:
+            """Register the total and per-type research product counts for one set of filters."""
+            keys = {TOTAL_PRODUCTS_LABEL: self.add("/v2/researchProducts", filters)}
+            for rp_type, label in PRODUCT_TYPE_LABELS.items():
+                keys[label] = self.add("/v2/researchProducts", dict(filters, type=rp_type))
+            return keys
+
+        def add_metrics(self, scenario_key: str, entity_id: str, labels: Optional[Iterable[str]] = None) -> Dict[str, tuple]:
+            """Register the `collect_metrics` lookups for one entity, optionally restricted to `labels`."""
+            filters = build_filters(scenario_key, entity_id)
+            wanted = set(labels) if labels is not None else None
+            keys: Dict[str, tuple] = {}
+            if wanted is None or "Funding / Projects" in wanted:
+                keys["Funding / Projects"] = self.add("/v1/projects", filters["projects"])
+            if wanted is None or "Data sources" in wanted:
+                keys["Data sources"] = self.add("/v1/dataSources", filters["dataSources"])
+            product_keys = self.add_product_counts(filters["researchProducts"])
+            keys.update({label: key for label, key in product_keys.items() if wanted is None or label in wanted})
+            return keys
+
+        def _plan(self) -> tuple[list[tuple], dict[tuple, list[tuple]], dict[tuple, list[tuple]]]:
+            """Split the unique lookups into calls to send, derivable totals and data source existence checks."""
+            totals: dict[tuple, list[tuple]] = {}
+            existence: dict[tuple, list[tuple]] = {}
+            collected_from: dict[str, list[tuple]] = {}
+            for key, (_, filters) in self._lookups.items():
+                if filters.get("relCollectedFromDatasourceId"):
+                    collected_from.setdefault(str(filters["relCollectedFromDatasourceId"]), []).append(key)
+            for key, (path, filters) in self._lookups.items():
+                if path == "/v2/researchProducts" and "type" not in filters:
+                    parts = [self.make_key(path, dict(filters, type=rp_type)) for rp_type in PRODUCT_TYPE_LABELS]
+                    if all(part in self._lookups for part in parts):
+                        totals[key] = parts
+                elif path == "/v1/dataSources" and list(filters) == ["id"]:
+                    # A data source that something was collected from must exist, so any
+                    # positive relCollectedFromDatasourceId count answers the lookup for free.
+                    existence[key] = collected_from.get(str(filters["id"]), [])
+            to_send = [key for key in self._lookups if key not in totals and key not in existence]
+            return to_send, totals, existence
+
+        async def execute(self, client) -> AsyncIterator[tuple[tuple, Optional[int]]]:
+            """Run the plan on an `AsyncGraphClient`, yielding `(key, value)` pairs as they resolve."""
+            to_send, totals, existence = self._plan()
+            totals_by_part: dict[tuple, list[tuple]] = {}
+            for total_key, parts in totals.items():
+                for part in parts:
+                    totals_by_part.setdefault(part, []).append(total_key)
+            existence_by_evidence: dict[tuple, list[tuple]] = {}
+            for ds_key, evidence in existence.items():
+                for other in evidence:
+                    existence_by_evidence.setdefault(other, []).append(ds_key)
+            pending_existence: set[tuple] = set()
+            pending_totals: set[tuple] = set()
+            finished: asyncio.Queue = asyncio.Queue()
+            tasks: list[asyncio.Task] = []
+
+            async def fetch(key: tuple) -> None:
+                path, filters = self._lookups[key]
+                try:
+                    value = await client.fetch_num_found(path, filters)
+                except Exception as exc:
+                    # Every sent key has to settle, or execute() waits for it forever
+                    self.errors[key] = str(exc) or type(exc).__name__
+                    value = None
+                await finished.put((key, value))
+
+            def send(key: tuple) -> None:
+                self.sent += 1
+                tasks.append(asyncio.create_task(fetch(key)))
+
+            def settle(key: tuple, value: Optional[int]) -> list[tuple[tuple, Optional[int]]]:
+                self.values[key] = value
+                resolved = [(key, value)]
+                for total_key in totals_by_part.get(key, []):
+                    parts = totals[total_key]
+                    if total_key in self.values or total_key in pending_totals or not all(part in self.values for part in parts):
+                        continue
+                    counts = [self.values[part] for part in parts]
+                    if any(count is None for count in counts):
+                        # A sum that misses a part looks like a real, smaller total; ask for the total itself
+                        pending_totals.add(total_key)
+                        send(total_key)
+                        continue
+                    self._derived_totals += 1
+                    resolved.extend(settle(total_key, sum(counts)))
+                for ds_key in existence_by_evidence.get(key, []):
+                    if ds_key in self.values or ds_key in pending_existence:
+                        continue
+                    if value:
+                        self._inferred_datasources += 1
+                        resolved.extend(settle(ds_key, 1))
+                    elif all(other in self.values for other in existence[ds_key]):
+                        pending_existence.add(ds_key)
+                        send(ds_key)
+                return resolved
+
+            for key in to_send:
+                send(key)
+            for ds_key, evidence in existence.items():
+                datasource_id = dict(self._lookups[ds_key][1])["id"]
+                if datasource_id in self.known_datasource_ids:
+                    self._inferred_datasources += 1
+                    for resolved in settle(ds_key, 1):
+                        yield resolved
+                elif not evidence:
+                    pending_existence.add(ds_key)
+                    send(ds_key)
+
+            completed = 0
+            try:
+                while completed < len(tasks):
+                    key, value = await finished.get()
+                    completed += 1
+                    for resolved in settle(key, value):
+                        yield resolved
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        @property
+        def unique_lookups(self) -> int:
+            return len(self._lookups)
+
+        def failed(self, keys: Iterable[tuple]) -> bool:
+            """True when any of `keys` ended in an error, so its value is missing rather than zero."""
+            return any(key in self.errors for key in keys)
+
+        def summary(self) -> str:
+            saved = self.requested - self.sent
+            duplicates = self.requested - len(self._lookups)
+            return (
+                f"numFound planner: {self.requested} lookups requested, {self.sent} sent, {saved} saved "
+                f"({duplicates} duplicates, {self._derived_totals} totals derived from their parts, "
+                f"{self._inferred_datasources} data source lookups inferred), {len(self.errors)} failed"
+            )
+    return NumFoundPlanner, TOTAL_PRODUCTS_LABEL
+
+
+@app.cell
+def test_numfound_planner_settles_failed_lookups(
+    NumFoundPlanner,
+    PRODUCT_TYPE_LABELS,
+    TOTAL_PRODUCTS_LABEL,
+    asyncio,
+    threading,
+):
+    # A lookup that fails with something other than an HTTP error still settles, and a total
+    # with a failed part is asked for directly instead of being summed from the other parts.
+    _failing_type = next(iter(PRODUCT_TYPE_LABELS))
+
+    class _FlakyClient:
+        def __init__(self):
+            self.calls = []
+
+        async def fetch_num_found(self, path, filters):
+            self.calls.append(dict(filters))
+            if filters.get("type") == _failing_type:
+                raise ValueError("invalid literal for int() with base 10: 'n/a'")
+            return 1 if "type" in filters else 10
+
+    _planner = NumFoundPlanner()
+    _keys = _planner.add_product_counts({"relCollectedFromDatasourceId": "datasource-1"})
+    _client = _FlakyClient()
+    _settled = {}
+
+    async def _collect():
+        async for _key, _value in _planner.execute(_client):
+            _settled[_key] = _value
+
+    # A thread of its own, because the notebook may already be running an event loop
+    _worker = threading.Thread(target=lambda: asyncio.run(_collect()), daemon=True)
+    _worker.start()
+    _worker.join(timeout=10)
+    assert not _worker.is_alive(), "NumFoundPlanner.execute did not settle a failed lookup"
+    _failed_key = _keys[PRODUCT_TYPE_LABELS[_failing_type]]
+    assert _settled[_failed_key] is None and _failed_key in _planner.errors
+    assert _settled[_keys[TOTAL_PRODUCTS_LABEL]] == 10
+    assert sum("type" not in _call for _call in _client.calls) == 1
+    return
+
+
+@app.cell
+def test_failed_metrics_are_not_carried_forward(
+    NumFoundPlanner,
+    asyncio,
+    fresh_rows,
+    pd,
+    threading,
+):
+    # Step 5 stamps metrics_retrieved_at only on rows whose lookups all succeeded, so a row
+    # with a failed lookup is fetched again next run instead of being carried forward.
+    class _FlakyClient:
+        async def fetch_num_found(self, path, filters):
+            if path == "/v1/dataSources" and filters.get("relOrganizationId") == "org-b":
+                raise ValueError("invalid literal for int() with base 10: 'n/a'")
+            return 3
+
+    _planner = NumFoundPlanner()
+    _row_keys = {_org: _planner.add_metrics("organization", _org, labels=["Data sources", "Publications"]) for _org in ("org-a", "org-b")}
+
+    async def _drain():
+        async for _key, _value in _planner.execute(_FlakyClient()):
+            pass
+
+    _worker = threading.Thread(target=lambda: asyncio.run(_drain()), daemon=True)
+    _worker.start()
+    _worker.join(timeout=10)
+    assert not _worker.is_alive(), "NumFoundPlanner.execute did not settle a failed lookup"
+    _retrieved_at = pd.Timestamp.now().isoformat(timespec="seconds")
+    _stored = pd.DataFrame(
+        {
+            "baseline_hash": ["hash-a", "hash-b"],
+            "metrics_retrieved_at": [pd.NA if _planner.failed(_row_keys[_org].values()) else _retrieved_at for _org in ("org-a", "org-b")],
+        }
+    )
+    assert list(fresh_rows(_stored, "baseline_hash", "metrics_retrieved_at", pd.Timedelta(days=30)).index) == ["hash-a"]
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3e. OAuth token manager
+    All Graph API callers share one `TokenManager`. When the token expires only one caller talks to the token endpoint while the others wait for its result, a background timer renews the token before it enters `TOKEN_REFRESH_BUFFER` (retrying with backoff if that fails), and the token is kept in a user-only file under `~/.cache/dutch-sources/` so a quick re-run skips the OIDC round-trip (`--no-token-cache` disables that).
+    """)
+    return
+
+
+@app.cell
+def _(
+    API_USER_AGENT,
+    CLIENT_ID,
+    CLIENT_SECRET,
+    Optional,
+    Path,
+    TOKEN_REFRESH_BUFFER,
+    TOKEN_URL,
+    asyncio,
+    etl_flag,
+    hashlib,
+    json,
+    os,
+    requests,
+    run_metrics,
+    threading,
+    time,
+):
+    TOKEN_CACHE_PATH = Path.home() / ".cache" / "dutch-sources" / "openaire_token.json"
+    TOKEN_BACKGROUND_LEAD = 120  # seconds before the refresh buffer at which the background timer fires
+    TOKEN_BACKGROUND_RETRY = 15  # seconds before retrying a failed background refresh; doubles on every further failure
+
+    class TokenManager:
+        """Thread-safe, single-flight holder of the OpenAIRE client-credentials token."""
+
+        def __init__(self, cache_path: Optional[Path], refresh_buffer: float, background_lead: float):
+            self.cache_path = cache_path
+            self.refresh_buffer = refresh_buffer
+            self.background_lead = background_lead
+            self.refreshes = 0
+            self.background_refreshes = 0
+            self.background_failures = 0
+            self.waits = 0
+            self.loaded_from_cache = 0
+            self._token: Optional[str] = None
+            self._expires_at = 0.0
+            self._lock = threading.Lock()
+            self._in_flight: Optional[threading.Event] = None
+            self._timer: Optional[threading.Timer] = None
+            self._background_attempts = 0
+            # Tokens are only reused for the client they were issued to
+            self._client_hash = hashlib.sha256(f"{TOKEN_URL}|{CLIENT_ID}".encode("utf-8")).hexdigest()
+            self._load_persisted()
+
+        def _fresh_token(self) -> Optional[str]:
+            if self._token and time.time() < self._expires_at - self.refresh_buffer:
+                return self._token
+            return None
+
+        def get_token(self, force: bool = False) -> str:
+            """Return a valid token; concurrent callers share a single refresh request."""
+            while True:
+                with self._lock:
+                    token = None if force else self._fresh_token()
+                    if token:
+                        return token
+                    in_flight = self._in_flight
+                    if in_flight is None:
+                        self._in_flight = threading.Event()
+                    else:
+                        self.waits += 1
+                if in_flight is None:
+                    break
+                in_flight.wait()
+                force = False
+            try:
+                return self._refresh()
+            finally:
+                with self._lock:
+                    self._in_flight.set()
+                    self._in_flight = None
+
+        async def get_token_async(self) -> str:
+            """Coroutine wrapper: returns immediately while the token is fresh, otherwise refreshes off the event loop."""
+            with self._lock:
+                token = self._fresh_token()
+            if token:
+                return token
+            return await asyncio.to_thread(self.get_token)
+
+        def _refresh(self) -> str:
+            with run_metrics.timed("token_refresh"):
+                response = requests.post(
+                    TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    auth=(CLIENT_ID, CLIENT_SECRET),
+                    headers={"User-Agent": API_USER_AGENT},
+                    timeout=60,
+                )
+            run_metrics.count("token_refreshes_total", status=response.status_code)
+            response.raise_for_status()
+            payload = response.json()
+            token = payload.get("access_token")
+            if not token:
+                raise RuntimeError("OpenAIRE token response did not include an access_token.")
+            expires_at = time.time() + int(payload.get("expires_in", 3600))
+            with self._lock:
+                self._token = token
+                self._expires_at = expires_at
+                self.refreshes += 1
+            self._persist()
+            self._schedule_background_refresh()
+            return token
+
+        def _schedule_background_refresh(self) -> None:
+            delay = self._expires_at - self.refresh_buffer - self.background_lead - time.time()
+            if self._timer is not None:
+                self._timer.cancel()
+            if delay <= 0:
+                # Token lifetime is too short for an early refresh; callers refresh on demand
+                return
+            self._start_timer(delay)
+
+        def _start_timer(self, delay: float) -> None:
+            self._timer = threading.Timer(delay, self._background_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+        def _background_refresh(self) -> None:
+            refreshes_before = self.refreshes
+            try:
+                self.get_token(force=True)
+            except Exception as exc:
+                # Nothing catches an exception on the timer thread, so retry here while the token is still valid
+                self.background_failures += 1
+                self._background_attempts += 1
+                remaining = self._expires_at - self.refresh_buffer - time.time()
+                if remaining <= 0:
+                    print(f"Background token refresh failed; callers will refresh on demand: {exc}")
+                    return
+                retry_in = min(TOKEN_BACKGROUND_RETRY * 2 ** (self._background_attempts - 1), remaining)
+                print(f"Background token refresh failed; retrying in {retry_in:.0f}s: {exc}")
+                self._start_timer(retry_in)
+                return
+            self._background_attempts = 0
+            if self.refreshes > refreshes_before:
+                self.background_refreshes += 1
+
+        def _load_persisted(self) -> None:
+            if self.cache_path is None or not self.cache_path.exists():
+                return
+            try:
+                cached = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                return
+            if cached.get("client") != self._client_hash:
+                return
+            self._token = cached.get("access_token")
+            self._expires_at = float(cached.get("expires_at", 0.0))
+            if self._fresh_token():
+                self.loaded_from_cache += 1
+                self._schedule_background_refresh()
+
+        def _persist(self) -> None:
+            if self.cache_path is None:
+                return
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+            tmp_path = self.cache_path.with_suffix(".tmp")
+            # Create the file readable by the current user only before any secret is written to it
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                json.dump({"client": self._client_hash, "access_token": self._token, "expires_at": self._expires_at}, handle)
+            os.replace(tmp_path, self.cache_path)
+
+        def summary(self) -> str:
+            return (
+                f"Token manager: {self.refreshes} refreshes ({self.background_refreshes} in the background, "
+                f"{self.background_failures} failed background attempts), "
+                f"{self.waits} callers waited on an in-flight refresh, {self.loaded_from_cache} loaded from the token cache"
+            )
+
+    token_manager = TokenManager(
+        # A replay run never needs a token, so do not load one whose background refresh would go online
+        None if etl_flag("no-token-cache") or etl_flag("replay") else TOKEN_CACHE_PATH,
+        refresh_buffer=TOKEN_REFRESH_BUFFER,
+        background_lead=TOKEN_BACKGROUND_LEAD,
+    )
+    return (token_manager,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3f. Retries and circuit breakers
+    Graph API and OAI-PMH requests are idempotent GETs, so transient failures (connection errors, timeouts, 5xx) are retried with full-jitter exponential backoff, while 429/503 responses wait for the rate limiter's `Retry-After` pause. Connect and read timeouts are set separately. Every Graph API endpoint and every OAI host has a circuit breaker that opens after repeated failures and fails fast with `CircuitOpenError` until a trial request succeeds again, so a dead backend does not make each worker sit out its own timeout.
+    """)
+    return
+
+
+@app.cell
+def _(Awaitable, Callable, asyncio, httpx, requests, run_metrics, threading, time):
+    import random
+
+    GRAPH_API_TIMEOUT = (10, 60)  # (connect, read) seconds
+    OAI_PROBE_TIMEOUT = (10, 25)
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+
+    class CircuitOpenError(RuntimeError):
+        """Raised instead of sending a request while the backend's circuit is open."""
+
+    class CircuitBreaker:
+        """Consecutive-failure circuit breaker with a single half-open trial request."""
+
+        def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+            self.name = name
+            self.failure_threshold = failure_threshold
+            self.reset_timeout = reset_timeout
+            self.state = "closed"
+            self.times_opened = 0
+            self.rejected = 0
+            self._failures = 0
+            self._opened_at = 0.0
+            self._lock = threading.Lock()
+
+        def before_call(self) -> None:
+            with self._lock:
+                if self.state != "closed" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                    # Let one trial request through; a trial that never reports back gets replaced after another timeout
+                    self.state = "half_open"
+                    self._opened_at = time.monotonic()
+                    return
+                if self.state != "closed":
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Circuit for {self.name} is {self.state.replace('_', '-')}; failing fast")
+
+        def record_success(self) -> None:
+            with self._lock:
+                self.state = "closed"
+                self._failures = 0
+
+        def record_failure(self) -> None:
+            with self._lock:
+                self._failures += 1
+                if self.state == "half_open" or self._failures >= self.failure_threshold:
+                    if self.state != "open":
+                        self.times_opened += 1
+                    self.state = "open"
+                    self._opened_at = time.monotonic()
+
+    _breakers: dict[str, CircuitBreaker] = {}
+    _breakers_lock = threading.Lock()
+
+    def circuit_breaker_for(key: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+        """Return the shared breaker for a host or endpoint, creating it on first use."""
+        with _breakers_lock:
+            if key not in _breakers:
+                _breakers[key] = CircuitBreaker(key, failure_threshold, reset_timeout)
+            return _breakers[key]
+
+    def log_circuit_breakers() -> None:
+        """Print every breaker that opened or rejected requests during the run."""
+        with _breakers_lock:
+            tripped = [breaker for breaker in _breakers.values() if breaker.times_opened or breaker.rejected]
+        for breaker in tripped:
+            print(f"Circuit '{breaker.name}': opened {breaker.times_opened}x, {breaker.rejected} requests failed fast, now {breaker.state}")
+
+    class RetryPolicy:
+        """Retry idempotent requests with full-jitter exponential backoff behind a circuit breaker."""
+
+        def __init__(self, name: str, max_attempts: int, base_delay: float, max_delay: float):
+            self.name = name
+            self.max_attempts = max_attempts
+            self.base_delay = base_delay
+            self.max_delay = max_delay
+            self.retries = 0
+
+        def backoff(self, attempt: int) -> float:
+            return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+        def _outcome(self, response, breaker: CircuitBreaker, limiter) -> str:
+            """Record a response with the breaker/limiter and classify it as "done", "throttled" or "retry"."""
+            if limiter is not None and limiter.observe(response.status_code, response.headers.get("Retry-After")):
+                # Throttling means the backend is alive; the limiter already scheduled the pause
+                return "throttled"
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                breaker.record_failure()
+                return "retry"
+            breaker.record_success()
+            return "done"
+
+        def call(self, send: Callable[[], requests.Response], breaker: CircuitBreaker, limiter=None):
+            for attempt in range(self.max_attempts):
+                last_attempt = attempt == self.max_attempts - 1
+                breaker.before_call()
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    response = send()
+                except TRANSIENT_ERRORS:
+                    breaker.record_failure()
+                    if last_attempt:
+                        raise
+                    outcome = "retry"
+                else:
+                    outcome = self._outcome(response, breaker, limiter)
+                    if outcome == "done" or last_attempt:
+                        return response
+                self.retries += 1
+                run_metrics.count("retries_total", policy=self.name, reason=outcome)
+                if outcome == "retry":
+                    time.sleep(self.backoff(attempt))
+
+        async def call_async(self, send: Callable[[], Awaitable[httpx.Response]], breaker: CircuitBreaker, limiter=None):
+            for attempt in range(self.max_attempts):
+                last_attempt = attempt == self.max_attempts - 1
+                breaker.before_call()
+                if limiter is not None:
+                    await limiter.acquire_async()
+                try:
+                    response = await send()
+                except TRANSIENT_ERRORS:
+                    breaker.record_failure()
+                    if last_attempt:
+                        raise
+                    outcome = "retry"
+                else:
+                    outcome = self._outcome(response, breaker, limiter)
+                    if outcome == "done" or last_attempt:
+                        return response
+                self.retries += 1
+                run_metrics.count("retries_total", policy=self.name, reason=outcome)
+                if outcome == "retry":
+                    await asyncio.sleep(self.backoff(attempt))
+
+    graph_retry_policy = RetryPolicy("graph-api", max_attempts=6, base_delay=0.5, max_delay=30.0)
+    oai_retry_policy = RetryPolicy("oai-pmh", max_attempts=2, base_delay=1.0, max_delay=5.0)
+    return (
+        CircuitOpenError,
+        GRAPH_API_TIMEOUT,
+        OAI_PROBE_TIMEOUT,
+        circuit_breaker_for,
+        graph_retry_policy,
+        log_circuit_breakers,
+        oai_retry_policy,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3g. Run journal
+    Long collection steps append one JSON line per completed row to a journal next to their output. When a run is interrupted, the next run reads the journal back, restores the finished rows and only fetches the rest. The journal is removed once the final output has been written.
+    """)
+    return
+
+
+@app.cell
+def _(Any, Dict, Path, datetime, json, os):
+    class RunJournal:
+        """Append-only JSONL journal of completed rows, used to resume an interrupted step."""
+
+        def __init__(self, path: Path):
+            self.path = Path(path)
+            self._handle = None
+            self.appended = 0
+
+        def load(self) -> Dict[str, Dict[str, Any]]:
+            """Return the journaled values per row key; later entries win over earlier ones."""
+            entries: Dict[str, Dict[str, Any]] = {}
+            if not self.path.exists():
+                return entries
+            with self.path.open("r", encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a half-written last line; everything before it is intact
+                        continue
+                    entries[entry["key"]] = entry["values"]
+            return entries
+
+        def append(self, key: str, values: Dict[str, Any]) -> None:
+            """Record one completed row. Each line is flushed so it survives a crash of the process."""
+            if self._handle is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._handle = self.path.open("a", encoding="utf-8")
+                if self._handle.tell() and not self.path.read_bytes().endswith(b"\n"):
+                    # Terminate a torn line left by a crash so it does not swallow the next entry
+                    self._handle.write("\n")
+            entry = {"key": key, "completed_at": datetime.now().isoformat(timespec="seconds"), "values": values}
+            self._handle.write(json.dumps(entry, default=str) + "\n")
+            self._handle.flush()
+            self.appended = self.appended + 1
+
+        def close(self) -> None:
+            if self._handle is not None:
+                os.fsync(self._handle.fileno())
+                self._handle.close()
+                self._handle = None
+
+        def discard(self) -> None:
+            """Close and remove the journal once the step's output has been written."""
+            self.close()
+            self.path.unlink(missing_ok=True)
+
+        def __enter__(self) -> "RunJournal":
+            return self
+
+        def __exit__(self, *exc_info) -> None:
+            self.close()
+    return (RunJournal,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3h. Typed artifact storage
+    Stages hand their tables to each other as Parquet files in `data/`, written with an explicit schema per dataset so identifiers stay strings, counts stay nullable integers and flags stay booleans across runs. Excel copies are only written for the workbooks people or the dashboard open directly (`nl_orgs_openaire_datasources_with_endpoint_metrics.xlsx`, `nl_orgs_dashboard_data.xlsx`); pass `--excel` to export every artifact. Artifacts that only exist as a workbook from an older run are read from the `.xlsx` once and typed on the way in.
+    """)
+    return
+
+
+@app.cell
+def _(DATA_DIR, Dict, Optional, PRODUCT_TYPE_LABELS, Path, etl_flag, os, pd):
+    _count_fields = {"Total Research Products": "Int64", **{label: "Int64" for label in PRODUCT_TYPE_LABELS.values()}}
+    _datasource_fields = {
+        "OpenAIRE_ORG_ID": "string",
+        "OpenAIRE_DataSource_ID": "string",
+        "Name": "string",
+        "Type": "string",
+        "websiteUrl": "string",
+        "OAI-endpoint": "string",
+        "supports_NL-DIDL": "boolean",
+        "support_OAI-DC": "boolean",
+        "support_OAI-openaire": "boolean",
+        "supports_RIOXX": "boolean",
+        "support_OpenAIRE-CERIF": "boolean",
+        "openaireCompatibility": "string",
+        "Last_Indexed_Date": "datetime",
+        "dateOfValidation": "datetime",
+    }
+    _detected_fields = {
+        column: "boolean"
+        for column in [
+            "detected_support_nl_didl",
+            "detected_support_oai_dc",
+            "detected_support_oai_openaire",
+            "detected_support_rioxx",
+            "detected_support_oai_cerif_openaire",
+            "detected_support_openaire_data",
+        ]
+    }
+
+    # Column name -> dtype per dataset; "datetime" is stored as naive UTC timestamps
+    ARTIFACT_SCHEMAS: Dict[str, Dict[str, str]] = {
+        "nl_orgs_openaire": {
+            "name": "string",
+            "acronym_EN": "string",
+            "acronym_AGG": "string",
+            "grouping": "string",
+            "ROR": "string",
+            "ROR_LINK": "string",
+            "OpenAIRE_ORG_ID": "string",
+            "main_datasource_id": "string",
+            "secondary_datasource_id": "string",
+            "baseline_hash": "string",
+            "Data sources": "Int64",
+            **_count_fields,
+            "metrics_retrieved_at": "datetime",
+        },
+        "nl_orgs_openaire_datasources": _datasource_fields,
+        "numfound_snapshot": {
+            "OpenAIRE_DataSource_ID": "string",
+            "Name": "string",
+            **_count_fields,
+            "date_retrieved": "string",
+            "Last_Indexed_Date": "datetime",
+            "carried_forward": "boolean",
+        },
+        "nl_orgs_openaire_datasources_with_endpoint": _datasource_fields,
+        "nl_orgs_openaire_datasources_with_endpoint_metrics": {
+            **_datasource_fields,
+            **_detected_fields,
+            "oai_endpoint_canonical": "string",
+            "oai_base_url": "string",
+            "oai_status": "string",
+            "oai_error": "string",
+            "metadata_prefixes_detected": "string",
+            "oai_tested_at_utc": "datetime",
+            "oai_uptime_30d": "Float64",
+        },
+        "nl_orgs_oai_harvest_counts": {
+            "OpenAIRE_DataSource_ID": "string",
+            "Name": "string",
+            "oai_endpoint_canonical": "string",
+            "oai_status": "string",
+            "harvest_status": "string",
+            "harvest_error": "string",
+            "harvest_verb": "string",
+            "harvest_metadata_prefix": "string",
+            "harvest_from_date": "string",
+            "oai_records": "Int64",
+            "oai_deleted_records": "Int64",
+            "oai_last_datestamp": "string",
+            "oai_harvested_at_utc": "datetime",
+            "Total Research Products": "Int64",
+            "oai_records_vs_numfound": "Float64",
+        },
+        "nl_orgs_dashboard_data": {
+            "Organisation Name": "string",
+            "Organisation": "string",
+            "OpenAIRE_ORG_ID": "string",
+            "Datasource Name": "string",
+            "OpenAIRE_DataSource_ID": "string",
+            "OpenAIRE Compatibility": "string",
+            "Type": "string",
+            "oai_status": "string",
+            "OAI-endpoint": "string",
+            "metadata_prefixes_detected": "string",
+            **_count_fields,
+            **{column: "boolean" for column in _detected_fields if column != "detected_support_oai_dc"},
+            "has_endpoint": "boolean",
+            "Latest Snapshot Date": "string",
+            "Total Research Products by Affiliation": "Int64",
+        },
+    }
+    # Workbooks that are opened outside this notebook and therefore always exported
+    EXCEL_EXPORTS = {"nl_orgs_openaire_datasources_with_endpoint_metrics", "nl_orgs_dashboard_data"}
+
+    def artifact_path(name: str) -> Path:
+        return DATA_DIR / f"{name}.parquet"
+
+    def _as_boolean(value):
+        if isinstance(value, str):
+            text = value.strip().lower()
+            if text in {"true", "1", "yes"}:
+                return True
+            if text in {"false", "0", "no"}:
+                return False
+            return pd.NA
+        if value is None or pd.isna(value):
+            return pd.NA
+        return bool(value)
+
+    def apply_schema(df: pd.DataFrame, schema: str) -> pd.DataFrame:
+        """Cast `df` to the dataset schema; missing columns are added empty and extra columns are kept at the end."""
+        fields = ARTIFACT_SCHEMAS[schema]
+        typed = df.copy()
+        for column, dtype in fields.items():
+            values = typed[column] if column in typed.columns else pd.Series(pd.NA, index=typed.index, dtype="object")
+            if dtype == "Int64":
+                typed[column] = pd.to_numeric(values, errors="coerce").round().astype("Int64")
+            elif dtype == "Float64":
+                typed[column] = pd.to_numeric(values, errors="coerce").astype("Float64")
+            elif dtype == "boolean":
+                typed[column] = values.map(_as_boolean).astype("boolean")
+            elif dtype == "datetime":
+                typed[column] = pd.to_datetime(values, errors="coerce", utc=True, format="ISO8601").dt.tz_localize(None)
+            else:
+                typed[column] = values.astype("string")
+        extra_columns = [column for column in typed.columns if column not in fields]
+        return typed[[*fields, *extra_columns]]
+
+    def write_artifact(name: str, df: pd.DataFrame, schema: Optional[str] = None) -> pd.DataFrame:
+        """Write `df` as a typed Parquet artifact (plus an Excel export where needed) and return the typed frame."""
+        typed = apply_schema(df, schema or name)
+        path = artifact_path(name)
+        tmp_path = path.with_name(path.name + ".tmp")
+        typed.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        if name in EXCEL_EXPORTS or etl_flag("excel"):
+            typed.to_excel(DATA_DIR / f"{name}.xlsx", index=False)
+        return typed
+
+    def read_artifact(name: str, schema: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """Read a typed artifact, falling back to the workbook an older run left behind; None when neither exists."""
+        path = artifact_path(name)
+        if path.exists():
+            return pd.read_parquet(path)
+        legacy_path = DATA_DIR / f"{name}.xlsx"
+        if legacy_path.exists():
+            print(f"{path} not found; reading {legacy_path} instead")
+            return apply_schema(pd.read_excel(legacy_path), schema or name)
+        return None
+
+    def artifact_exists(name: str) -> bool:
+        return artifact_path(name).exists() or (DATA_DIR / f"{name}.xlsx").exists()
+
+    def fresh_rows(df: pd.DataFrame, key: str, stamp_column: str, ttl: pd.Timedelta) -> pd.DataFrame:
+        """Return the last row per `key` whose `stamp_column` is younger than `ttl`, indexed by `key`; unstamped rows are never fresh."""
+        latest = df.drop_duplicates(key, keep="last")
+        stamps = pd.to_datetime(latest[stamp_column], errors="coerce") if stamp_column in latest.columns else pd.Series(pd.NaT, index=latest.index)
+        return latest[stamps >= pd.Timestamp.now() - ttl].set_index(key)
+    return (
+        apply_schema,
+        artifact_exists,
+        artifact_path,
+        fresh_rows,
+        read_artifact,
+        write_artifact,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3i. numFound history store
+    Snapshots are kept as a Parquet dataset under `data/numfound_history/`, one `date_retrieved=YYYY-MM-DD` partition per snapshot date. Appending merges rows into their date partition keyed on `(OpenAIRE_DataSource_ID, date_retrieved)`, so re-running a day is harmless, and `read(last_n=...)` only opens the newest partitions instead of the whole history. DuckDB can query the same directory with `read_parquet('data/numfound_history/*/*.parquet', hive_partitioning = true)`.
+    """)
+    return
+
+
+@app.cell
+def _(DATA_DIR, Optional, Path, apply_schema, os, pd):
+    class NumFoundHistory:
+        """numFound snapshots stored as a hive-partitioned Parquet dataset, one partition per snapshot date."""
+
+        key_columns = ["OpenAIRE_DataSource_ID", "date_retrieved"]
+
+        def __init__(self, root: Path):
+            self.root = Path(root)
+
+        def partition_path(self, date: str) -> Path:
+            return self.root / f"date_retrieved={date}" / "part-0.parquet"
+
+        def read_date(self, date: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+            """Rows of one snapshot date."""
+            file_columns = None if columns is None else [column for column in columns if column != "date_retrieved"]
+            frame = pd.read_parquet(self.partition_path(date), columns=file_columns)
+            frame["date_retrieved"] = pd.Series(date, index=frame.index, dtype="string")
+            return frame
+
+        def dates(self) -> list[str]:
+            """Snapshot dates present in the store, oldest first; only directory names are inspected."""
+            if not self.root.exists():
+                return []
+            return sorted(
+                path.name.split("=", 1)[1]
+                for path in self.root.glob("date_retrieved=*")
+                if (path / "part-0.parquet").exists()
+            )
+
+        def append(self, snapshot_df: pd.DataFrame) -> int:
+            """Merge snapshot rows into their date partitions and return how many rows were new.
+
+            A row that is already stored for the same data source and date is replaced, so appending
+            the same snapshot twice leaves the store unchanged.
+            """
+            typed = apply_schema(snapshot_df, "numfound_snapshot").dropna(subset=self.key_columns)
+            added = 0
+            for date, rows in typed.groupby("date_retrieved", sort=True):
+                date = str(date)
+                path = self.partition_path(date)
+                existing = self.read_date(date) if path.exists() else None
+                combined = rows if existing is None else pd.concat([existing, rows], ignore_index=True)
+                combined = combined.drop_duplicates(subset=self.key_columns, keep="last")
+                added = added + len(combined) - (0 if existing is None else len(existing))
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(path.name + ".tmp")
+                combined.drop(columns=["date_retrieved"]).to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, path)
+            return added
+
+        def read(self, last_n: Optional[int] = None, columns: Optional[list[str]] = None) -> pd.DataFrame:
+            """Rows of the newest `last_n` snapshots (all snapshots when None), reading only those partitions."""
+            dates = self.dates()
+            if last_n is not None:
+                dates = dates[-last_n:] if last_n > 0 else []
+            frames = [self.read_date(date, columns) for date in dates]
+            if not frames:
+                empty = apply_schema(pd.DataFrame(), "numfound_snapshot")
+                return empty if columns is None else empty[columns]
+            return pd.concat(frames, ignore_index=True)
+
+    numfound_history = NumFoundHistory(DATA_DIR / "numfound_history")
+    return (numfound_history,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3j. Shared data context for the report steps
+    Steps 10–13, 17 and 18 read their inputs through `etl_data` instead of opening the artifacts themselves. Each artifact is parsed once, counts are returned as `float64` (missing counts as `NaN`, ready for sums and matplotlib), snapshot dates as timestamps, and derived frames such as the latest and previous snapshot or the organisation ↔ data source link table are memoised. Everything is keyed on the modification time and size of the files it came from, so a frame is rebuilt as soon as an earlier step rewrites its source.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Any,
+    Callable,
+    DATA_DIR,
+    Dict,
+    Optional,
+    PRODUCT_TYPE_LABELS,
+    Path,
+    artifact_path,
+    numfound_history,
+    pd,
+    read_artifact,
+):
+    class EtlDataContext:
+        """Memoised, typed access to the pipeline artifacts, invalidated when the underlying files change."""
+
+        count_columns = ["Total Research Products", *PRODUCT_TYPE_LABELS.values()]
+
+        def __init__(self):
+            self._memo: Dict[str, tuple[tuple, Any]] = {}
+            self.loads = 0
+            self.hits = 0
+
+        @staticmethod
+        def _stamp(paths: list[Path]) -> tuple:
+            stamps = []
+            for path in paths:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    stamps.append((str(path), None, None))
+                    continue
+                stamps.append((str(path), stat.st_mtime_ns, stat.st_size))
+            return tuple(stamps)
+
+        def _memoised(self, key: str, paths: list[Path], build: Callable[[], Any]) -> Any:
+            stamp = self._stamp(paths)
+            cached = self._memo.get(key)
+            if cached is not None and cached[0] == stamp:
+                self.hits = self.hits + 1
+                return cached[1]
+            value = build()
+            self.loads = self.loads + 1
+            self._memo[key] = (stamp, value)
+            return value
+
+        @staticmethod
+        def _artifact_paths(name: str) -> list[Path]:
+            return [artifact_path(name), DATA_DIR / f"{name}.xlsx"]
+
+        def _with_float_counts(self, df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+            if df is None:
+                return None
+            present = [column for column in self.count_columns if column in df.columns]
+            return df.astype({column: "float64" for column in present})
+
+        def _artifact(self, name: str) -> Optional[pd.DataFrame]:
+            return self._memoised(name, self._artifact_paths(name), lambda: self._with_float_counts(read_artifact(name)))
+
+        @staticmethod
+        def _copy(df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+            # Callers are free to modify what they get back without touching the memoised frame
+            return None if df is None else df.copy()
+
+        def orgs(self) -> Optional[pd.DataFrame]:
+            return self._copy(self._artifact("nl_orgs_openaire"))
+
+        def datasources(self) -> Optional[pd.DataFrame]:
+            return self._copy(self._artifact("nl_orgs_openaire_datasources"))
+
+        def endpoint_metrics(self) -> Optional[pd.DataFrame]:
+            return self._copy(self._artifact("nl_orgs_openaire_datasources_with_endpoint_metrics"))
+
+        def org_datasource_links(self) -> pd.DataFrame:
+            """One row per (data source, organisation) pair, with the data source name."""
+
+            def build() -> pd.DataFrame:
+                datasources = self._artifact("nl_orgs_openaire_datasources")
+                if datasources is None:
+                    return pd.DataFrame(columns=["OpenAIRE_DataSource_ID", "OpenAIRE_ORG_ID", "Name"])
+                links = datasources[["OpenAIRE_DataSource_ID", "OpenAIRE_ORG_ID", "Name"]]
+                return links.dropna(subset=["OpenAIRE_DataSource_ID"]).drop_duplicates(subset=["OpenAIRE_DataSource_ID", "OpenAIRE_ORG_ID"])
+            return self._copy(self._memoised("org_datasource_links", self._artifact_paths("nl_orgs_openaire_datasources"), build))
+
+        def snapshot(self, offset: int = 0) -> pd.DataFrame:
+            """The numFound snapshot `offset` dates before the newest one, with the data source Type attached."""
+            dates = numfound_history.dates()
+            if offset >= len(dates):
+                return pd.DataFrame(columns=["OpenAIRE_DataSource_ID", "Name", "Type", *self.count_columns, "date_retrieved"])
+            date = dates[-1 - offset]
+
+            def build() -> pd.DataFrame:
+                frame = self._with_float_counts(numfound_history.read_date(date))
+                frame["date_retrieved"] = pd.to_datetime(frame["date_retrieved"])
+                datasources = self._artifact("nl_orgs_openaire_datasources")
+                if datasources is not None:
+                    types = datasources[["OpenAIRE_DataSource_ID", "Type"]].drop_duplicates(subset=["OpenAIRE_DataSource_ID"])
+                    frame = frame.merge(types, on="OpenAIRE_DataSource_ID", how="left")
+                else:
+                    frame["Type"] = pd.NA
+                return frame
+            paths = [numfound_history.partition_path(date), *self._artifact_paths("nl_orgs_openaire_datasources")]
+            return self._copy(self._memoised(f"snapshot:{date}", paths, build))
+
+        def latest_snapshot(self) -> pd.DataFrame:
+            return self.snapshot(0)
+
+        def previous_snapshot(self) -> pd.DataFrame:
+            return self.snapshot(1)
+
+        def summary(self) -> str:
+            return f"Data context: {self.loads} frames built, {self.hits} served from memory"
+
+    etl_data = EtlDataContext()
+    return (etl_data,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3k. Run instrumentation
+    `run_metrics` collects counters and latency histograms from the Graph API helpers (sync and async), the token manager, the retry policies and the OAI-PMH probes. After every bulk step, and again when the process exits, it writes a JSON run report to `data/run_reports/` (one file per run, so runs can be compared) and the Prometheus textfile-collector file `data/etl_metrics.prom`.
+    """)
+    return
+
+
+@app.cell
+def _(Any, DATA_DIR, Dict, Optional, datetime, json, os, threading, time):
+    import atexit
+    from contextlib import contextmanager
+    from datetime import timezone
+
+    RUN_REPORT_DIR = DATA_DIR / "run_reports"
+    PROMETHEUS_TEXTFILE = DATA_DIR / "etl_metrics.prom"
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    class RunMetrics:
+        """Thread-safe counters, gauges and latency histograms for one ETL run.
+
+        Series are identified by a metric name plus a small set of labels (an API path,
+        a probe status); never label by host or identifier, or the Prometheus file grows
+        with every datasource.
+        """
+
+        def __init__(self, report_dir, textfile, buckets=LATENCY_BUCKETS):
+            self.report_dir = report_dir
+            self.textfile = textfile
+            self.buckets = buckets
+            self.started_at = datetime.now(timezone.utc).replace(microsecond=0)
+            self._started = time.perf_counter()
+            self._lock = threading.Lock()
+            self._counters: Dict[tuple, float] = {}
+            self._gauges: Dict[tuple, float] = {}
+            self._samples: Dict[tuple, list[float]] = {}
+
+        @staticmethod
+        def _series(name: str, labels: Dict[str, Any]) -> tuple:
+            return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+        def count(self, name: str, value: float = 1, **labels) -> None:
+            key = self._series(name, labels)
+            with self._lock:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+        def gauge(self, name: str, value: float, **labels) -> None:
+            with self._lock:
+                self._gauges[self._series(name, labels)] = value
+
+        def observe(self, name: str, seconds: float, **labels) -> None:
+            key = self._series(name, labels)
+            with self._lock:
+                self._samples.setdefault(key, []).append(seconds)
+
+        @contextmanager
+        def timed(self, name: str, **labels):
+            """Observe the wall time of the block (awaits included) under `<name>_seconds`."""
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+        def _snapshot(self):
+            with self._lock:
+                return dict(self._counters), dict(self._gauges), {key: list(values) for key, values in self._samples.items()}
+
+        @staticmethod
+        def _quantile(ordered: list[float], fraction: float) -> float:
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+        def report(self) -> Dict[str, Any]:
+            counters, gauges, samples = self._snapshot()
+            histograms = []
+            for (name, labels), values in sorted(samples.items()):
+                ordered = sorted(values)
+                histograms.append(
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": len(ordered),
+                        "sum": round(sum(ordered), 6),
+                        "p50": round(self._quantile(ordered, 0.50), 6),
+                        "p95": round(self._quantile(ordered, 0.95), 6),
+                        "p99": round(self._quantile(ordered, 0.99), 6),
+                        "max": round(ordered[-1], 6),
+                    }
+                )
+            return {
+                "started_at": self.started_at.isoformat(),
+                "written_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+                "duration_seconds": round(time.perf_counter() - self._started, 3),
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(gauges.items())],
+                "histograms": histograms,
+            }
+
+        @staticmethod
+        def _escape_label(value) -> str:
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        @staticmethod
+        def _prometheus_series(name: str, labels, extra: Optional[Dict[str, str]] = None) -> str:
+            pairs = [*labels, *(extra or {}).items()]
+            if not pairs:
+                return f"etl_{name}"
+            rendered = ",".join(f'{key}="{RunMetrics._escape_label(value)}"' for key, value in pairs)
+            return f"etl_{name}{{{rendered}}}"
+
+        def prometheus_text(self) -> str:
+            counters, gauges, samples = self._snapshot()
+            lines = [
+                "# TYPE etl_run_start_timestamp_seconds gauge",
+                f"etl_run_start_timestamp_seconds {self.started_at.timestamp():.0f}",
+                "# TYPE etl_run_duration_seconds gauge",
+                f"etl_run_duration_seconds {time.perf_counter() - self._started:.3f}",
+            ]
+            typed: set[str] = set()
+            for kind, series in (("counter", counters), ("gauge", gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE etl_{name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{self._prometheus_series(name, labels)} {value:g}")
+            for (name, labels), values in sorted(samples.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE etl_{name} histogram")
+                    typed.add(name)
+                for bound in self.buckets:
+                    below = sum(value <= bound for value in values)
+                    lines.append(f"{self._prometheus_series(name + '_bucket', labels, {'le': f'{bound:g}'})} {below}")
+                lines.append(f"{self._prometheus_series(name + '_bucket', labels, {'le': '+Inf'})} {len(values)}")
+                lines.append(f"{self._prometheus_series(name + '_sum', labels)} {sum(values):.6f}")
+                lines.append(f"{self._prometheus_series(name + '_count', labels)} {len(values)}")
+            return "\n".join(lines) + "\n"
+
+        def write(self) -> None:
+            """Write the JSON run report and the Prometheus textfile, each replaced atomically."""
+            self.report_dir.mkdir(parents=True, exist_ok=True)
+            report_path = self.report_dir / f"etl_run_{self.started_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+            outputs = {report_path: json.dumps(self.report(), indent=2), self.textfile: self.prometheus_text()}
+            for path, text in outputs.items():
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.write_text(text, encoding="utf-8")
+                os.replace(tmp_path, path)
+
+    run_metrics = RunMetrics(RUN_REPORT_DIR, PROMETHEUS_TEXTFILE)
+    atexit.register(run_metrics.write)
+    return atexit, run_metrics
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3l. Record and replay cassettes
+    With `--record` (or `ETL_RECORD=1`) every Graph API and OAI-PMH request the run makes is stored with its final response in a gzip-compressed JSON-lines cassette, `data/etl_cassette.jsonl.gz` (`ETL_CASSETTE` picks another file). With `--replay` (or `ETL_REPLAY=1`) the same requests are answered from the cassette, with no network access, token or rate limiting, so a profiling run is repeatable and takes seconds. The response cache is bypassed in both modes so every request reaches the cassette. Only the request URL and parameters, the response status, a few response headers and the body are stored. Authorization headers and token requests are never recorded. A request missing from the cassette fails like a connection error and is counted in the summary. Replay against the same starting data folder you recorded from, because the incremental steps skip requests based on local state.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Any,
+    Awaitable,
+    Callable,
+    DATA_DIR,
+    Dict,
+    Optional,
+    Path,
+    asyncio,
+    atexit,
+    datetime,
+    etl_flag,
+    httpx,
+    json,
+    os,
+    requests,
+    threading,
+):
+    import base64
+    import gzip
+    from http import HTTPStatus
+
+    CASSETTE_PATH = Path(os.getenv("ETL_CASSETTE", DATA_DIR / "etl_cassette.jsonl.gz"))
+    CASSETTE_HEADERS = ("content-type", "etag", "last-modified", "retry-after")
+
+    class Cassette:
+        """Gzip JSON-lines store of request/response pairs: written in record mode, served in replay mode.
+
+        Entries are keyed by URL plus normalised query parameters. Only the outcome the
+        pipeline saw is stored (the final response after retries, the transport error,
+        or a cancellation when a raced request lost), never the request headers, so no
+        bearer token ends up in the file.
+        """
+
+        def __init__(self, path: Path, mode: Optional[str]):
+            self.path = path
+            self.mode = mode
+            self.recorded = 0
+            self.replayed = 0
+            self.misses = 0
+            self._lock = threading.Lock()
+            self._entries: Dict[str, Dict[str, Any]] = {}
+            self._handle = None
+            if mode == "replay":
+                self._load()
+            elif mode == "record":
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._handle = gzip.open(path, "wt", encoding="utf-8")
+                self._handle.write(json.dumps({"cassette": 1, "recorded_at": datetime.now().astimezone().isoformat(timespec="seconds")}) + "\n")
+                atexit.register(self.close)
+
+        @property
+        def active(self) -> bool:
+            return self.mode is not None
+
+        @property
+        def replaying(self) -> bool:
+            return self.mode == "replay"
+
+        @staticmethod
+        def make_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+            normalised = sorted((str(name), str(value).strip()) for name, value in (params or {}).items() if value is not None)
+            return json.dumps([url, normalised], separators=(",", ":"))
+
+        def _load(self) -> None:
+            if not self.path.exists():
+                raise FileNotFoundError(f"No cassette at {self.path}; record one first with --record.")
+            with gzip.open(self.path, "rt", encoding="utf-8") as handle:
+                try:
+                    for line in handle:
+                        entry = json.loads(line)
+                        if "key" in entry and not (entry.get("error") == "Cancelled" and entry["key"] in self._entries):
+                            self._entries[entry["key"]] = entry
+                except (EOFError, ValueError):
+                    # An interrupted recording ends mid-stream; everything before that point is usable
+                    pass
+
+        def _store(self, entry: Dict[str, Any], provisional: bool = False) -> None:
+            line = json.dumps(entry, separators=(",", ":")) + "\n"
+            with self._lock:
+                written = self._entries.get(entry["key"])
+                if self._handle is None or (written is not None and (provisional or not written["provisional"])):
+                    return
+                # Only the key is kept in memory; repeated requests are written once, and a real
+                # outcome is still written after a provisional cancellation marker
+                self._entries[entry["key"]] = {"provisional": provisional}
+                self._handle.write(line)
+                self.recorded += 1
+
+        def _record_response(self, key: str, status: int, headers, body: bytes) -> None:
+            if self.mode != "record":
+                return
+            entry = {"key": key, "status": status, "headers": {name: headers[name] for name in CASSETTE_HEADERS if name in headers}}
+            try:
+                entry["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                entry["body_b64"] = base64.b64encode(body).decode("ascii")
+            self._store(entry)
+
+        def _record_error(self, key: str, exc: BaseException) -> None:
+            if self.mode != "record":
+                return
+            if isinstance(exc, asyncio.CancelledError):
+                self._store({"key": key, "error": "Cancelled", "message": "cancelled while recording"}, provisional=True)
+            else:
+                self._store({"key": key, "error": type(exc).__name__, "message": str(exc)})
+
+        def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+            entry = self._entries.get(key)
+            with self._lock:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.replayed += 1
+            return entry
+
+        @staticmethod
+        def _body(entry: Dict[str, Any]) -> bytes:
+            if "body_b64" in entry:
+                return base64.b64decode(entry["body_b64"])
+            return entry.get("body", "").encode("utf-8")
+
+        @staticmethod
+        def _failure(entry: Optional[Dict[str, Any]], url: str) -> tuple[bool, str]:
+            """(is_timeout, message) for a recorded transport error or a cassette miss."""
+            if entry is None:
+                return False, f"Not in cassette {CASSETTE_PATH}: {url}"
+            return "Timeout" in entry["error"], f"{entry['error']} (replayed): {entry['message']}"
+
+        def call(self, url: str, params: Optional[Dict[str, Any]], send: Callable[[], requests.Response]) -> requests.Response:
+            """Return `send()` and record its outcome, or in replay mode the recorded response as a `requests.Response`."""
+            key = self.make_key(url, params)
+            if not self.replaying:
+                try:
+                    response = send()
+                except requests.RequestException as exc:
+                    self._record_error(key, exc)
+                    raise
+                self._record_response(key, response.status_code, response.headers, response.content)
+                return response
+
+            entry = self._lookup(key)
+            if entry is None or "error" in entry:
+                timed_out, message = self._failure(entry, url)
+                raise (requests.Timeout if timed_out else requests.ConnectionError)(message)
+            response = requests.Response()
+            response.status_code = entry["status"]
+            response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+            response._content = self._body(entry)
+            response.url = requests.Request("GET", url, params=params).prepare().url
+            try:
+                response.reason = HTTPStatus(entry["status"]).phrase
+            except ValueError:
+                response.reason = ""
+            return response
+
+        async def call_async(self, url: str, params: Optional[Dict[str, Any]], send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+            """Coroutine version of `call` for `httpx` requests."""
+            key = self.make_key(url, params)
+            if not self.replaying:
+                try:
+                    response = await send()
+                except (httpx.TransportError, asyncio.CancelledError) as exc:
+                    self._record_error(key, exc)
+                    raise
+                self._record_response(key, response.status_code, response.headers, response.content)
+                return response
+
+            entry = self._lookup(key)
+            request = httpx.Request("GET", url, params=params)
+            if entry is None or "error" in entry:
+                timed_out, message = self._failure(entry, url)
+                raise (httpx.ReadTimeout if timed_out else httpx.ConnectError)(message, request=request)
+            return httpx.Response(entry["status"], headers=entry["headers"], content=self._body(entry), request=request)
+
+        def flush(self) -> None:
+            """Make everything recorded so far readable, so a crashed run still leaves a usable cassette."""
+            with self._lock:
+                if self._handle is not None:
+                    self._handle.flush()
+
+        def close(self) -> None:
+            with self._lock:
+                if self._handle is not None:
+                    self._handle.close()
+                    self._handle = None
+
+        def __len__(self) -> int:
+            return len(self._entries)
+
+        def summary(self) -> str:
+            if self.replaying:
+                return f"Cassette {self.path}: {self.replayed} requests replayed, {self.misses} not in the cassette"
+            return f"Cassette {self.path}: {self.recorded} requests recorded"
+
+    if etl_flag("record") and etl_flag("replay"):
+        raise ValueError("--record and --replay cannot be combined.")
+    cassette = Cassette(CASSETTE_PATH, "record" if etl_flag("record") else "replay" if etl_flag("replay") else None)
+    if cassette.replaying:
+        print(f"Replay mode: serving {len(cassette)} recorded requests from {CASSETTE_PATH}; no network requests are made.")
+    elif cassette.active:
+        print(f"Record mode: writing every Graph API and OAI-PMH request to {CASSETTE_PATH}.")
+    return (cassette,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3m. Asynchronous OAI-PMH probe engine
+    Step 16 sends one `ListMetadataFormats` request per data source endpoint, and many of those hosts are slow or unreachable. `OaiProbeEngine` runs all probes as coroutines on one pooled `httpx` client. A global cap limits the requests in flight and a per-host cap keeps several endpoints on one repository platform from hammering it. The http and https variants of an endpoint are raced, the first valid answer wins and the other request is cancelled. A batch of probes therefore takes about as long as its slowest responsive host, instead of the sum of every timeout.
+
+    Response bodies are streamed through an incremental XML parser. Reading stops as soon as the `ListMetadataFormats` list or an OAI-PMH error is complete, or after 1 MiB. Responses whose content type is not XML, or whose root element is not `OAI-PMH`, are rejected without reading the rest. A misconfigured endpoint that serves a large HTML page or a record dump therefore costs little memory and time.
+    """)
+    return
+
+
+@app.cell
+def _(
+    API_USER_AGENT,
+    Any,
+    Awaitable,
+    Callable,
+    OAI_PROBE_TIMEOUT,
+    Optional,
+    asyncio,
+    cassette,
+    circuit_breaker_for,
+    httpx,
+    oai_retry_policy,
+    rate_limiter_for_host,
+    run_metrics,
+):
+    import ast
+    import xml.etree.ElementTree as ET
+    from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit
+
+    OAI_PROBE_MAX_IN_FLIGHT = 64  # concurrent OAI-PMH requests across all hosts
+    OAI_PROBE_PER_HOST = 2  # concurrent requests to any single host
+    OAI_PROBE_MAX_BYTES = 1024 * 1024  # stop reading a response that has not answered within this many bytes
+    OAI_NS = '{http://www.openarchives.org/OAI/2.0/}'
+    # Hop-by-hop details of the streamed response that do not apply to the decoded body kept in memory
+    STREAM_ONLY_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+    # OAI-PMH request arguments that curated endpoints sometimes carry; they are not part of the base URL
+    OAI_REQUEST_ARGUMENTS = {'verb', 'metadataprefix', 'set', 'from', 'until', 'resumptiontoken', 'identifier'}
+
+    def clean_endpoint(value):
+        """Unwrap list-like or quoted spreadsheet values and default a missing scheme to https; None when empty."""
+        if not isinstance(value, str):
+            return None
+        text = value.strip()
+        if not text:
+            return None
+        if text.startswith('[') and text.endswith(']'):
+            try:
+                parsed = ast.literal_eval(text)
+                if isinstance(parsed, (list, tuple)) and parsed:
+                    text = '' if parsed[0] is None else str(parsed[0])
+                elif isinstance(parsed, str):
+                    text = parsed
+                else:
+                    text = ''
+            except Exception:
+                text = text.strip('[]')
+        text = text.strip().strip('"\'[]')
+        if not text:
+            return None
+        if text.startswith('//'):
+            text = f'https:{text}'
+        elif not text.startswith(('http://', 'https://')):
+            text = f'https://{text}'
+        return text
+
+    def canonical_endpoint(value) -> str | None:
+        """Scheme-less canonical form of an OAI-PMH base URL, so spelling variants of one endpoint are probed once.
+
+        Lower-cases the host and drops default ports, OAI-PMH request arguments (`?verb=...`),
+        fragments and trailing slashes. Without a scheme, `normalise_endpoint` races https and http.
+        """
+        text = clean_endpoint(value)
+        if text is None:
+            return None
+        parsed = urlsplit(text)
+        try:
+            host, port = (parsed.hostname or ''), parsed.port
+        except ValueError:
+            return None
+        if not host:
+            return None
+        if ':' in host:
+            host = f'[{host}]'
+        netloc = host if port in (None, 80, 443) else f'{host}:{port}'
+        if parsed.username or parsed.password:
+            netloc = f"{parsed.netloc.rsplit('@', 1)[0]}@{netloc}"
+        query = [(name, argument) for name, argument in parse_qsl(parsed.query, keep_blank_values=True) if name.lower() not in OAI_REQUEST_ARGUMENTS]
+        canonical = f"{netloc}{parsed.path.rstrip('/')}"
+        return f'{canonical}?{urlencode(query)}' if query else canonical
+
+
+    def normalise_endpoint(url: str) -> list[str]:
+        """Candidate URLs for an endpoint: as given, plus the https variant of http URLs or both schemes when none is given."""
+        if not isinstance(url, str):
+            return []
+        raw = url.strip()
+        if not raw:
+            return []
+        candidates = []
+        parsed = urlparse(raw)
+        if parsed.scheme:
+            candidates.append(raw)
+            if parsed.scheme == 'http':
+                candidates.append(raw.replace('http://', 'https://', 1))
+        else:
+            candidates.append(f'https://{raw}')
+            candidates.append(f'http://{raw}')
+        seen: list[str] = []
+        for cand in candidates:
+            if cand not in seen:
+                seen.append(cand)
+        return seen
+
+    def build_oai_url(base: str, verb: str='ListMetadataFormats', arguments: Optional[dict[str, str]]=None) -> str:
+        query = urlencode({'verb': verb, **(arguments or {})})
+        if base.endswith('?') or base.endswith('&'):
+            return f'{base}{query}'
+        return f'{base}&{query}' if '?' in base else f'{base}?{query}'
+
+    def accepts_content_type(content_type: str) -> bool:
+        """False for media types that cannot hold an OAI-PMH answer; a missing or generic type gets the benefit of the doubt."""
+        media_type = content_type.split(';')[0].strip().lower()
+        return not media_type or 'xml' in media_type or media_type in {'text/plain', 'application/octet-stream'}
+
+    class MetadataFormatsParser:
+        """Incremental `ListMetadataFormats` parser; `feed` returns True once the answer is complete."""
+
+        def __init__(self):
+            self._parser = ET.XMLPullParser(events=('start', 'end'))
+            self._root_seen = False
+            self.prefixes: list[str] = []
+            self.errors: list[str] = []
+            self.failure: str | None = None
+            self.done = False
+
+        def feed(self, chunk: bytes) -> bool:
+            if self.done:
+                return True
+            try:
+                self._parser.feed(chunk)
+                for event, element in self._parser.read_events():
+                    self._handle(event, element)
+                    if self.done:
+                        break
+            except ET.ParseError as exc:
+                self.failure = f'XML parse error: {exc}'
+                self.done = True
+            return self.done
+
+        def close(self) -> None:
+            """Signal the end of the body; a document that stops mid-element is a parse error."""
+            if self.done:
+                return
+            try:
+                self._parser.close()
+                for event, element in self._parser.read_events():
+                    self._handle(event, element)
+            except ET.ParseError as exc:
+                self.failure = f'XML parse error: {exc}'
+
+        def _handle(self, event: str, element) -> None:
+            if event == 'start':
+                if not self._root_seen:
+                    self._root_seen = True
+                    if element.tag != f'{OAI_NS}OAI-PMH':
+                        self.failure = f'Not an OAI-PMH response (root element <{element.tag}>)'
+                        self.done = True
+                return
+            if element.tag == f'{OAI_NS}metadataPrefix':
+                prefix = (element.text or '').strip().lower()
+                if prefix:
+                    self.prefixes.append(prefix)
+            elif element.tag == f'{OAI_NS}metadataFormat':
+                element.clear()
+            elif element.tag == f'{OAI_NS}error':
+                self.errors.append(f"{element.get('code', 'error')}: {(element.text or '').strip()}")
+                self.done = True
+            elif element.tag == f'{OAI_NS}ListMetadataFormats':
+                self.done = True
+
+        def result(self, truncated: bool = False) -> tuple[list[str], str | None]:
+            if self.failure:
+                return ([], self.failure)
+            if self.errors:
+                return ([], '; '.join(self.errors))
+            if truncated and not self.done:
+                return ([], f'No complete ListMetadataFormats answer in the first {OAI_PROBE_MAX_BYTES:,} bytes')
+            if self.prefixes:
+                return (self.prefixes, None)
+            return ([], 'No metadataPrefix elements returned')
+
+    def parse_metadata_formats(xml_bytes: bytes, truncated: bool = False) -> tuple[list[str], str | None]:
+        """Parse a (possibly early-terminated) `ListMetadataFormats` body into its prefixes or an error message."""
+        parser = MetadataFormatsParser()
+        if not parser.feed(xml_bytes) and not truncated:
+            parser.close()
+        return parser.result(truncated)
+
+    async def read_metadata_formats_body(response: httpx.Response) -> bytes:
+        """Read a streamed body only until the answer is complete or `OAI_PROBE_MAX_BYTES` is reached."""
+        parser = MetadataFormatsParser()
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            chunk = chunk[:OAI_PROBE_MAX_BYTES - len(body)]
+            body += chunk
+            if parser.feed(chunk) or len(body) >= OAI_PROBE_MAX_BYTES:
+                break
+        return bytes(body)
+
+    class OaiProbeEngine:
+        """Pooled asyncio prober for OAI-PMH `ListMetadataFormats`.
+
+        Use it as ``async with OaiProbeEngine() as engine:`` around a batch of probes; the
+        connection pool, the global in-flight cap and the per-host caps live for the block.
+        """
+
+        def __init__(self, max_in_flight: int = OAI_PROBE_MAX_IN_FLIGHT, per_host: int = OAI_PROBE_PER_HOST):
+            self.max_in_flight = max_in_flight
+            self.per_host = per_host
+            self._client: Optional[httpx.AsyncClient] = None
+            self._slots: Optional[asyncio.Semaphore] = None
+            self._host_slots: dict[str, asyncio.Semaphore] = {}
+
+        async def __aenter__(self) -> "OaiProbeEngine":
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': API_USER_AGENT},
+                limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight),
+                timeout=httpx.Timeout(OAI_PROBE_TIMEOUT[1], connect=OAI_PROBE_TIMEOUT[0]),
+                follow_redirects=True,
+            )
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            return self
+
+        async def __aexit__(self, *exc_info) -> None:
+            await self._client.aclose()
+            self._client = None
+
+        async def fetch(
+            self,
+            url: str,
+            headers: Optional[dict[str, str]] = None,
+            read_body: Callable[[httpx.Response], Awaitable[bytes]] = read_metadata_formats_body,
+        ) -> httpx.Response:
+            """GET an OAI-PMH URL behind the host's rate limiter, circuit breaker and concurrency cap.
+
+            `read_body` decides how much of a successful XML response is read; by default only
+            the `ListMetadataFormats` answer.
+            """
+            host = urlparse(url).netloc
+            host_slots = self._host_slots.setdefault(host, asyncio.Semaphore(self.per_host))
+
+            async def send() -> httpx.Response:
+                async with self._slots, host_slots:
+                    async with self._client.stream('GET', url, headers=headers) as streamed:
+                        # Error statuses and non-XML answers are decided on the headers alone
+                        readable = streamed.is_success and accepts_content_type(streamed.headers.get('content-type', ''))
+                        body = await read_body(streamed) if readable else b''
+                kept_headers = [(name, value) for name, value in streamed.headers.items() if name.lower() not in STREAM_ONLY_HEADERS]
+                return httpx.Response(streamed.status_code, headers=kept_headers, content=body, request=streamed.request)
+
+            return await cassette.call_async(
+                url,
+                None,
+                lambda: oai_retry_policy.call_async(
+                    send,
+                    breaker=circuit_breaker_for(f'oai:{host}', failure_threshold=3),
+                    limiter=rate_limiter_for_host(host),
+                ),
+            )
+
+        async def _probe_candidate(self, candidate: str, headers: Optional[dict[str, str]] = None) -> dict[str, Any]:
+            outcome = {'candidate': candidate, 'prefixes': [], 'errors': [], 'etag': None, 'last_modified': None, 'not_modified': False}
+            try:
+                response = await self.fetch(build_oai_url(candidate), headers)
+                run_metrics.count('oai_response_bytes_total', len(response.content))
+                if response.status_code == 304:
+                    outcome['not_modified'] = True
+                    return outcome
+                response.raise_for_status()
+            except Exception as exc:
+                # httpx appends a documentation link on a second line of status errors
+                outcome['errors'] = [f"{candidate}: {(str(exc) or type(exc).__name__).splitlines()[0]}"]
+                return outcome
+            content_type = response.headers.get('content-type', '')
+            if not accepts_content_type(content_type):
+                outcome['errors'] = [f'{candidate}: not an XML response ({content_type})']
+                return outcome
+            prefixes, error = parse_metadata_formats(response.content, truncated=len(response.content) >= OAI_PROBE_MAX_BYTES)
+            outcome.update(
+                prefixes=prefixes,
+                errors=[f'{candidate}: {error}'] if error else [],
+                etag=response.headers.get('etag'),
+                last_modified=response.headers.get('last-modified'),
+            )
+            return outcome
+
+        async def probe(self, endpoint: str, previous: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+            """Probe an endpoint and return the outcome: metadata prefixes or errors, the answering candidate and its validators.
+
+            With a `previous` outcome that carried an ETag or Last-Modified, its candidate URL is asked
+            first with a conditional request; `not_modified` is set when the server answers 304.
+            Otherwise, or when that request fails, the candidate URLs are raced and the first one with
+            metadata prefixes wins.
+            """
+            conditional = {}
+            if previous and previous.get('candidate'):
+                if previous.get('etag'):
+                    conditional['If-None-Match'] = previous['etag']
+                if previous.get('last_modified'):
+                    conditional['If-Modified-Since'] = previous['last_modified']
+            if conditional:
+                outcome = await self._probe_candidate(previous['candidate'], conditional)
+                if outcome['not_modified'] or outcome['prefixes']:
+                    return outcome
+            tasks = [asyncio.create_task(self._probe_candidate(candidate)) for candidate in normalise_endpoint(endpoint)]
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    outcome = await finished
+                    if outcome['prefixes']:
+                        return outcome
+            finally:
+                for task in tasks:
+                    task.cancel()
+            # Every candidate has finished by now; report their errors in candidate order
+            return {
+                'candidate': None,
+                'prefixes': [],
+                'errors': [error for task in tasks for error in task.result()['errors']],
+                'etag': None,
+                'last_modified': None,
+                'not_modified': False,
+            }
+    return (
+        ET,
+        OAI_NS,
+        OaiProbeEngine,
+        accepts_content_type,
+        build_oai_url,
+        canonical_endpoint,
+        clean_endpoint,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3n. OAI probe result store
+    `data/oai_probe_store.sqlite` keeps the latest probe result per canonical endpoint, with the answering URL, its ETag/Last-Modified and when it was tested. Step 16 skips endpoints that answered `ok` within the freshness window (24 hours; set `ETL_OAI_PROBE_FRESH_HOURS` to change it). Endpoints with validators are asked with a conditional request first, and a `304 Not Modified` reuses the stored result. Failed endpoints are probed again on every run. Every probe outcome is also appended to a history table, so `oai_probe_store.uptime(days=30)` reports per-endpoint uptime without extra requests. `--refresh` re-probes everything from scratch. The store is not used in record or replay mode, so those runs always reach the cassette.
+    """)
+    return
+
 
-    def fetch_num_found(path: str, params: Dict[str, Any]) -> Optional[int]:
-        """Return the total number of matching records for the supplied endpoint."""
-        payload = call_graph_api(path, params)
-        header = payload.get("header", {})
-        num_found = header.get("numFound")
-        return int(num_found) if num_found is not None else None
+@app.cell
+def _(Any, DATA_DIR, Dict, Optional, cassette, etl_flag, json, os, pd, sqlite3, threading, time):
+    OAI_PROBE_STORE_PATH = DATA_DIR / "oai_probe_store.sqlite"
+    OAI_PROBE_FRESH_SECONDS = float(os.getenv("ETL_OAI_PROBE_FRESH_HOURS", 24)) * 3600
+
+    class OaiProbeStore:
+        """SQLite store of the latest OAI-PMH probe result per canonical endpoint, plus every probe outcome as history."""
+
+        def __init__(self, path, fresh_for: float, bypass: bool = False, read_only: bool = False):
+            self.fresh_for = fresh_for
+            self.bypass = bypass
+            self.read_only = read_only
+            self._lock = threading.Lock()
+            self._con = sqlite3.connect(path, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS latest (
+                    endpoint TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    prefixes TEXT,
+                    candidate TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    tested_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    endpoint TEXT NOT NULL,
+                    tested_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    prefixes TEXT,
+                    not_modified INTEGER NOT NULL,
+                    seconds REAL
+                );
+                CREATE INDEX IF NOT EXISTS history_endpoint_tested_at ON history (endpoint, tested_at);
+                """
+            )
+            self._con.commit()
+
+        def latest(self) -> Dict[str, Dict[str, Any]]:
+            """The stored result of every endpoint, keyed by canonical endpoint; empty in bypass mode."""
+            if self.bypass:
+                return {}
+            with self._lock:
+                cursor = self._con.execute("SELECT endpoint, status, error, prefixes, candidate, etag, last_modified, tested_at FROM latest")
+                columns = [description[0] for description in cursor.description]
+                rows = cursor.fetchall()
+            return {row[0]: dict(zip(columns, row)) for row in rows}
+
+        def is_fresh(self, entry: Optional[Dict[str, Any]], now: Optional[float] = None) -> bool:
+            if entry is None or entry["status"] != "ok":
+                return False
+            return (now or time.time()) - entry["tested_at"] < self.fresh_for
+
+        def record(self, endpoint: str, status: str, error: Optional[str], prefixes: list[str], outcome: Dict[str, Any], seconds: float) -> float:
+            """Store a probe outcome as the endpoint's latest result and in the history; returns the test time."""
+            tested_at = time.time()
+            if self.read_only:
+                return tested_at
+            prefix_json = json.dumps(prefixes) if prefixes else None
+            with self._lock:
+                self._con.execute(
+                    "INSERT OR REPLACE INTO latest (endpoint, status, error, prefixes, candidate, etag, last_modified, tested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (endpoint, status, error, prefix_json, outcome.get("candidate"), outcome.get("etag"), outcome.get("last_modified"), tested_at),
+                )
+                self._con.execute(
+                    "INSERT INTO history (endpoint, tested_at, status, error, prefixes, not_modified, seconds) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (endpoint, tested_at, status, error, prefix_json, int(outcome.get("not_modified", False)), seconds),
+                )
+            return tested_at
+
+        def commit(self) -> None:
+            with self._lock:
+                self._con.commit()
+
+        def uptime(self, days: float = 30) -> pd.DataFrame:
+            """Per-endpoint probe count, ok count, uptime fraction and last ok time over the last `days` days of history."""
+            with self._lock:
+                frame = pd.read_sql_query(
+                    """
+                    SELECT endpoint,
+                           COUNT(*) AS probes,
+                           SUM(status = 'ok') AS ok_probes,
+                           AVG(status = 'ok') AS uptime,
+                           MAX(CASE WHEN status = 'ok' THEN tested_at END) AS last_ok_at
+                    FROM history
+                    WHERE tested_at >= ?
+                    GROUP BY endpoint
+                    """,
+                    self._con,
+                    params=(time.time() - days * 86400,),
+                )
+            frame["last_ok_at"] = pd.to_datetime(frame["last_ok_at"], unit="s", utc=True)
+            return frame
+
+    oai_probe_store = OaiProbeStore(
+        OAI_PROBE_STORE_PATH,
+        fresh_for=OAI_PROBE_FRESH_SECONDS,
+        bypass=etl_flag("refresh") or cassette.active,
+        read_only=cassette.replaying,
+    )
+    return (oai_probe_store,)
 
-    def build_filters(scenario_key: str, entity_id: str) -> Dict[str, Dict[str, Any]]:
-        builder = FILTER_BUILDERS[scenario_key]
-        return {name: dict(filters) for name, filters in builder(entity_id).items()}
 
-    def collect_metrics(scenario_key: str, entity_id: Optional[str]) -> Dict[str, Optional[int]]:
-        if not entity_id:
-            return deepcopy(EMPTY_METRICS)
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ### 3o. OAI-PMH record harvester
+    Step 16a harvests `ListIdentifiers`, or `ListRecords` with `--harvest-records`, from every endpoint that passed the step 16 probe, so the number of records an endpoint really exposes can be compared with its Graph API numFound. `stream_oai_list` follows the `resumptionToken`s one page at a time and yields each page's headers as soon as it has been parsed. A page is parsed incrementally and capped at 32 MiB, so memory use depends on the page size an endpoint chooses, not on the size of the repository.
 
-        filters = build_filters(scenario_key, entity_id)
-        results: Dict[str, Optional[int]] = {}
+    Headers, and records when requested, are written to `data/oai_harvest/` as zstd-compressed Parquet in parts of at most 10,000 rows, one `endpoint_key=<key>/harvest=<timestamp>` partition per endpoint and harvest run. An SQLite index in the same folder keeps one row per record identifier, with its datestamp and deleted flag, plus the state of each endpoint's last harvest. The next harvest only asks for records changed since the day of the last complete harvest (`from=`); a full harvest also drops identifiers the endpoint no longer lists. `--refresh` harvests everything again. The folder is only created by a harvesting run. Record and replay runs always harvest in full, and replay writes to a scratch folder that is removed at the end of the step.
+    """)
+    return
 
-        results["Funding / Projects"] = fetch_num_found("/v1/projects", filters["projects"])
-        results["Data sources"] = fetch_num_found("/v1/dataSources", filters["dataSources"])
 
-        for rp_type, label in PRODUCT_TYPE_LABELS.items():
-            rp_params = dict(filters["researchProducts"], type=rp_type)
-            results[label] = fetch_num_found("/v2/researchProducts", rp_params)
+@app.cell
+def _(
+    Any,
+    AsyncIterator,
+    DATA_DIR,
+    Dict,
+    ET,
+    OAI_NS,
+    Optional,
+    Path,
+    accepts_content_type,
+    build_oai_url,
+    cassette,
+    etl_flag,
+    hashlib,
+    os,
+    pd,
+    run_metrics,
+    sqlite3,
+    threading,
+    time,
+):
+    import re
+    import tempfile
+
+    OAI_HARVEST_MAX_PAGE_BYTES = 32 * 1024 * 1024  # refuse a single list page larger than this
+    OAI_HARVEST_PARSE_CHUNK = 64 * 1024  # bytes fed to the XML parser at a time
+    OAI_HARVEST_BATCH_ROWS = 10_000  # headers per Parquet part file
+    OAI_HARVEST_BATCH_BYTES = 64 * 1024 * 1024  # or fewer, once ListRecords metadata adds up to this much
+
+    class OaiHarvestError(Exception):
+        """A list request failed, or returned an OAI-PMH error other than `noRecordsMatch`."""
+
+    class OaiListParser:
+        """Incremental parser for one `ListIdentifiers` or `ListRecords` page.
+
+        `feed` returns the headers completed by a chunk as dicts with identifier, datestamp,
+        set_spec and deleted, plus the serialised metadata for `ListRecords`. Every header or
+        record is dropped from the tree once read, so only the unread part of a page is held.
+        """
+
+        def __init__(self, verb: str):
+            self.verb = verb
+            self._parser = ET.XMLPullParser(events=("start", "end"))
+            self._root_seen = False
+            self._list = None
+            self.response_date: Optional[str] = None
+            self.resumption_token: Optional[str] = None
+            self.complete_list_size: Optional[int] = None
+            self.errors: list[str] = []
+            self.no_records = False
+            self.failure: Optional[str] = None
+
+        def feed(self, chunk: bytes) -> list[dict[str, Any]]:
+            items: list[dict[str, Any]] = []
+            if self.failure is None:
+                try:
+                    self._parser.feed(chunk)
+                    self._read_events(items)
+                except ET.ParseError as exc:
+                    self.failure = f"XML parse error: {exc}"
+            return items
+
+        def close(self) -> list[dict[str, Any]]:
+            """Signal the end of the page; a page that stops mid-element is a parse error."""
+            items: list[dict[str, Any]] = []
+            if self.failure is None:
+                try:
+                    self._parser.close()
+                    self._read_events(items)
+                except ET.ParseError as exc:
+                    self.failure = f"XML parse error: {exc}"
+            return items
+
+        @staticmethod
+        def _header(header) -> dict[str, Any]:
+            set_specs = [spec.text.strip() for spec in header.findall(f"{OAI_NS}setSpec") if spec.text and spec.text.strip()]
+            return {
+                "identifier": (header.findtext(f"{OAI_NS}identifier") or "").strip(),
+                "datestamp": (header.findtext(f"{OAI_NS}datestamp") or "").strip() or None,
+                "set_spec": ";".join(set_specs) or None,
+                "deleted": header.get("status") == "deleted",
+            }
 
-        return results
-    return call_graph_api, collect_metrics, fetch_num_found
+        def _read_events(self, items: list[dict[str, Any]]) -> None:
+            for event, element in self._parser.read_events():
+                if self.failure is not None:
+                    return
+                if event == "start":
+                    if not self._root_seen:
+                        self._root_seen = True
+                        if element.tag != f"{OAI_NS}OAI-PMH":
+                            self.failure = f"Not an OAI-PMH response (root element <{element.tag}>)"
+                    elif element.tag == f"{OAI_NS}{self.verb}":
+                        self._list = element
+                    continue
+                if element.tag == f"{OAI_NS}header" and self.verb == "ListIdentifiers":
+                    item = self._header(element)
+                elif element.tag == f"{OAI_NS}record":
+                    header = element.find(f"{OAI_NS}header")
+                    metadata = element.find(f"{OAI_NS}metadata")
+                    item = None if header is None else self._header(header)
+                    if item is not None:
+                        item["metadata"] = ET.tostring(metadata[0], encoding="unicode") if metadata is not None and len(metadata) else None
+                elif element.tag == f"{OAI_NS}responseDate":
+                    self.response_date = (element.text or "").strip() or None
+                    continue
+                elif element.tag == f"{OAI_NS}resumptionToken":
+                    self.resumption_token = (element.text or "").strip() or None
+                    size = (element.get("completeListSize") or "").strip()
+                    self.complete_list_size = int(size) if size.isdigit() else None
+                    continue
+                elif element.tag == f"{OAI_NS}error":
+                    code = element.get("code", "error")
+                    if code == "noRecordsMatch":
+                        self.no_records = True
+                    else:
+                        self.errors.append(f"{code}: {(element.text or '').strip()}")
+                    continue
+                else:
+                    continue
+                if item is not None and item["identifier"]:
+                    items.append(item)
+                if self._list is not None:
+                    self._list.clear()
+
+    async def read_oai_page_body(response) -> bytes:
+        """Read a list page up to `OAI_HARVEST_MAX_PAGE_BYTES`; a longer page is cut off there."""
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body += chunk[:OAI_HARVEST_MAX_PAGE_BYTES - len(body)]
+            if len(body) >= OAI_HARVEST_MAX_PAGE_BYTES:
+                break
+        return bytes(body)
+
+    async def stream_oai_list(engine, base_url: str, verb: str, arguments: dict[str, str]) -> AsyncIterator[tuple[OaiListParser, list[dict[str, Any]]]]:
+        """Yield every page of an OAI-PMH list request as (parser, headers), following resumptionTokens to the end.
+
+        The parser carries the page's responseDate, resumptionToken and completeListSize.
+        `noRecordsMatch` yields one empty page; transport errors, other OAI-PMH errors and
+        malformed pages raise `OaiHarvestError`.
+        """
+        page_arguments = dict(arguments)
+        previous_token = None
+        while True:
+            url = build_oai_url(base_url, verb, page_arguments)
+            try:
+                response = await engine.fetch(url, read_body=read_oai_page_body)
+                response.raise_for_status()
+            except Exception as exc:
+                raise OaiHarvestError(f"{url}: {(str(exc) or type(exc).__name__).splitlines()[0]}") from exc
+            run_metrics.count("oai_harvest_bytes_total", len(response.content))
+            content_type = response.headers.get("content-type", "")
+            if not accepts_content_type(content_type):
+                raise OaiHarvestError(f"{url}: not an XML response ({content_type})")
+            if len(response.content) >= OAI_HARVEST_MAX_PAGE_BYTES:
+                raise OaiHarvestError(f"{url}: page larger than {OAI_HARVEST_MAX_PAGE_BYTES:,} bytes")
+            page = OaiListParser(verb)
+            items: list[dict[str, Any]] = []
+            for offset in range(0, len(response.content), OAI_HARVEST_PARSE_CHUNK):
+                items.extend(page.feed(response.content[offset:offset + OAI_HARVEST_PARSE_CHUNK]))
+            items.extend(page.close())
+            if page.failure or page.errors:
+                raise OaiHarvestError(f"{url}: {page.failure or '; '.join(page.errors)}")
+            yield page, items
+            token = page.resumption_token
+            if token is None:
+                return
+            if token == previous_token:
+                raise OaiHarvestError(f"{url}: the endpoint repeated resumptionToken {token!r}")
+            previous_token = token
+            page_arguments = {"resumptionToken": token}
+
+    class OaiHarvestStore:
+        """Harvested OAI-PMH headers as a hive-partitioned Parquet dataset, with an SQLite index of the current identifiers."""
+
+        def __init__(self, root: Path, bypass: bool = False):
+            self.root = Path(root)
+            self.bypass = bypass
+            self._scratch: Optional[tempfile.TemporaryDirectory] = None
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._lock = threading.Lock()
+            self._con = sqlite3.connect(self.root / "index.sqlite", check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS records (
+                    endpoint TEXT NOT NULL,
+                    identifier TEXT NOT NULL,
+                    datestamp TEXT,
+                    deleted INTEGER NOT NULL,
+                    harvest TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, identifier)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS harvests (
+                    endpoint TEXT PRIMARY KEY,
+                    base_url TEXT,
+                    verb TEXT,
+                    metadata_prefix TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    from_date TEXT,
+                    next_from TEXT,
+                    pages INTEGER,
+                    headers INTEGER,
+                    complete_list_size INTEGER,
+                    harvested_at REAL NOT NULL
+                );
+                """
+            )
+            self._con.commit()
+
+        @classmethod
+        def scratch(cls) -> "OaiHarvestStore":
+            """A full-harvest store in a temporary folder that `close` removes again."""
+            folder = tempfile.TemporaryDirectory(prefix="oai-harvest-replay-")
+            store = cls(Path(folder.name), bypass=True)
+            store._scratch = folder
+            return store
+
+        def close(self) -> None:
+            with self._lock:
+                self._con.close()
+            if self._scratch is not None:
+                self._scratch.cleanup()
+
+        @staticmethod
+        def endpoint_key(endpoint: str) -> str:
+            """Directory-safe partition value for a canonical endpoint: a readable slug plus a short hash."""
+            slug = re.sub(r"[^A-Za-z0-9.-]+", "_", endpoint).strip("_")[:60]
+            return f"{slug}-{hashlib.sha256(endpoint.encode('utf-8')).hexdigest()[:8]}"
+
+        def partition_dir(self, endpoint: str, harvest_id: str) -> Path:
+            return self.root / f"endpoint_key={self.endpoint_key(endpoint)}" / f"harvest={harvest_id}"
+
+        def from_date(self, endpoint: str, verb: str, metadata_prefix: str) -> Optional[str]:
+            """The `from=` date of an incremental harvest, or None when the endpoint needs a full harvest.
+
+            That is the day the last complete harvest with the same verb and metadata prefix started;
+            `from` is inclusive, so records changed on that day are asked for again.
+            """
+            if self.bypass:
+                return None
+            with self._lock:
+                row = self._con.execute("SELECT verb, metadata_prefix, next_from FROM harvests WHERE endpoint = ?", (endpoint,)).fetchone()
+            if row is None or row[0] != verb or row[1] != metadata_prefix:
+                return None
+            return row[2]
+
+        def write_part(self, endpoint: str, harvest_id: str, part: int, items: list[dict[str, Any]]) -> None:
+            """Write one batch of headers as a Parquet part file and upsert it into the identifier index."""
+            frame = pd.DataFrame(items)
+            frame.insert(0, "oai_endpoint", endpoint)
+            frame = frame.astype({column: "string" for column in frame.columns if column != "deleted"})
+            path = self.partition_dir(endpoint, harvest_id) / f"part-{part:05d}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + ".tmp")
+            frame.to_parquet(tmp_path, index=False, compression="zstd")
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._con.executemany(
+                    """
+                    INSERT INTO records (endpoint, identifier, datestamp, deleted, harvest) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (endpoint, identifier) DO UPDATE SET
+                        harvest = excluded.harvest,
+                        deleted = CASE WHEN excluded.datestamp >= COALESCE(records.datestamp, '') THEN excluded.deleted ELSE records.deleted END,
+                        datestamp = NULLIF(MAX(COALESCE(excluded.datestamp, ''), COALESCE(records.datestamp, '')), '')
+                    """,
+                    [(endpoint, item["identifier"], item["datestamp"], int(item["deleted"]), harvest_id) for item in items],
+                )
+                self._con.commit()
+
+        def finish(self, endpoint: str, harvest_id: str, summary: Dict[str, Any], next_from: Optional[str]) -> None:
+            """Record the outcome of a harvest; only a complete harvest moves the `from=` date on.
+
+            A complete full harvest also removes the identifiers it did not list, which covers
+            endpoints that drop records without reporting them as deleted.
+            """
+            complete = summary["status"] == "complete"
+            with self._lock:
+                if complete and summary["from_date"] is None:
+                    self._con.execute("DELETE FROM records WHERE endpoint = ? AND harvest <> ?", (endpoint, harvest_id))
+                self._con.execute(
+                    """
+                    INSERT INTO harvests (endpoint, base_url, verb, metadata_prefix, status, error, from_date, next_from, pages, headers, complete_list_size, harvested_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (endpoint) DO UPDATE SET
+                        base_url = excluded.base_url,
+                        status = excluded.status,
+                        error = excluded.error,
+                        from_date = excluded.from_date,
+                        pages = excluded.pages,
+                        headers = excluded.headers,
+                        complete_list_size = excluded.complete_list_size,
+                        harvested_at = excluded.harvested_at,
+                        verb = CASE WHEN excluded.status = 'complete' THEN excluded.verb ELSE harvests.verb END,
+                        metadata_prefix = CASE WHEN excluded.status = 'complete' THEN excluded.metadata_prefix ELSE harvests.metadata_prefix END,
+                        next_from = CASE WHEN excluded.status = 'complete' THEN excluded.next_from ELSE harvests.next_from END
+                    """,
+                    (
+                        endpoint,
+                        summary["base_url"],
+                        summary["verb"],
+                        summary["metadata_prefix"],
+                        summary["status"],
+                        summary["error"],
+                        summary["from_date"],
+                        next_from if complete else None,
+                        summary["pages"],
+                        summary["headers"],
+                        summary["complete_list_size"],
+                        time.time(),
+                    ),
+                )
+                self._con.commit()
+
+        def counts(self) -> pd.DataFrame:
+            """Per-endpoint state of the last harvest with the current and deleted record counts from the index."""
+            with self._lock:
+                frame = pd.read_sql_query(
+                    """
+                    SELECT h.endpoint,
+                           h.status AS harvest_status,
+                           h.error AS harvest_error,
+                           h.verb AS harvest_verb,
+                           h.metadata_prefix AS harvest_metadata_prefix,
+                           h.from_date AS harvest_from_date,
+                           COALESCE(r.records, 0) AS oai_records,
+                           COALESCE(r.deleted_records, 0) AS oai_deleted_records,
+                           r.last_datestamp AS oai_last_datestamp,
+                           h.harvested_at AS oai_harvested_at_utc
+                    FROM harvests h
+                    LEFT JOIN (
+                        SELECT endpoint, SUM(1 - deleted) AS records, SUM(deleted) AS deleted_records, MAX(datestamp) AS last_datestamp
+                        FROM records
+                        GROUP BY endpoint
+                    ) r ON r.endpoint = h.endpoint
+                    """,
+                    self._con,
+                )
+            frame["oai_harvested_at_utc"] = pd.to_datetime(frame["oai_harvested_at_utc"], unit="s", utc=True)
+            return frame
+
+    async def harvest_endpoint(engine, store: OaiHarvestStore, endpoint: str, base_url: str, metadata_prefix: str, verb: str = "ListIdentifiers") -> Dict[str, Any]:
+        """Harvest one endpoint into `store`, incrementally when a previous complete harvest allows it, and return a summary.
+
+        Headers are buffered into parts of `OAI_HARVEST_BATCH_ROWS` rows (or `OAI_HARVEST_BATCH_BYTES`
+        of metadata), so at most one part and one page are held at a time.
+        """
+        from_date = store.from_date(endpoint, verb, metadata_prefix)
+        arguments = {"metadataPrefix": metadata_prefix, **({"from": from_date} if from_date else {})}
+        harvest_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        summary = {
+            "endpoint": endpoint,
+            "base_url": base_url,
+            "verb": verb,
+            "metadata_prefix": metadata_prefix,
+            "status": "complete",
+            "error": None,
+            "from_date": from_date,
+            "pages": 0,
+            "headers": 0,
+            "complete_list_size": None,
+        }
+        # The server's clock decides the next `from=`; our own start day is the fallback
+        next_from = time.strftime("%Y-%m-%d", time.gmtime())
+        batch: list[dict[str, Any]] = []
+        batch_bytes = 0
+        parts = 0
+
+        def write_batch() -> None:
+            nonlocal batch, batch_bytes, parts
+            if batch:
+                store.write_part(endpoint, harvest_id, parts, batch)
+                summary["headers"] += len(batch)
+                parts += 1
+            batch, batch_bytes = [], 0
+
+        started = time.perf_counter()
+        try:
+            async for page, items in stream_oai_list(engine, base_url, verb, arguments):
+                if summary["pages"] == 0 and page.response_date:
+                    next_from = page.response_date[:10]
+                summary["pages"] += 1
+                if summary["complete_list_size"] is None:
+                    summary["complete_list_size"] = page.complete_list_size
+                for item in items:
+                    batch.append(item)
+                    batch_bytes += len(item.get("metadata") or "")
+                    if len(batch) >= OAI_HARVEST_BATCH_ROWS or batch_bytes >= OAI_HARVEST_BATCH_BYTES:
+                        write_batch()
+        except OaiHarvestError as exc:
+            summary.update(status="error", error=str(exc))
+        # Headers of an interrupted harvest are kept; the index upsert makes the retry harmless
+        write_batch()
+        store.finish(endpoint, harvest_id, summary, next_from)
+        run_metrics.observe("oai_harvest_seconds", time.perf_counter() - started, status=summary["status"])
+        run_metrics.count("oai_harvests_total", status=summary["status"])
+        run_metrics.count("oai_harvest_pages_total", summary["pages"])
+        run_metrics.count("oai_harvest_headers_total", summary["headers"])
+        return summary
+
+    OAI_HARVEST_ROOT = DATA_DIR / "oai_harvest"
+
+    def open_oai_harvest_store(create: bool) -> Optional[OaiHarvestStore]:
+        """The harvest store of this run, or None when nothing is harvested and nothing was stored before.
+
+        Only a harvesting run (`create`) creates `data/oai_harvest/`. A replayed harvest goes to a
+        scratch store instead, so it does not move the real store's `from=` dates on.
+        """
+        if create and cassette.replaying:
+            return OaiHarvestStore.scratch()
+        if create:
+            return OaiHarvestStore(OAI_HARVEST_ROOT, bypass=etl_flag("refresh") or cassette.active)
+        if (OAI_HARVEST_ROOT / "index.sqlite").exists():
+            return OaiHarvestStore(OAI_HARVEST_ROOT)
+        return None
+    return harvest_endpoint, open_oai_harvest_store
 
 
 @app.cell
-def _(Optional, call_graph_api, normalise_ror_link, requests):
+def _(
+    Any,
+    AsyncGraphClient,
+    CircuitOpenError,
+    Dict,
+    Optional,
+    call_graph_api,
+    normalise_ror_link,
+    requests,
+):
     from functools import lru_cache
 
+    # Extract the OpenAIRE organization ID from an /v1/organizations response
+    def _first_result_id(payload: Dict[str, Any]) -> Optional[str]:
+        results = payload.get("results") or []
+        for item in results:
+            openorg_id = item.get("id")
+            if openorg_id:
+                return openorg_id
+        return None
+
     # Cache OpenAIRE ID lookups to avoid redundant API calls
 
     @lru_cache(maxsize=None)
@@ -493,17 +3431,10 @@ def _(Optional, call_graph_api, normalise_ror_link, requests):
         # Query the OpenAIRE Graph API for the organization with the given ROR URL
         try:
             payload = call_graph_api("/v1/organizations", {"pid": ror_url})
-        except requests.RequestException as exc:
+        except (requests.RequestException, CircuitOpenError) as exc:
             print(f"Failed to fetch OpenAIRE ID for {ror_url}: {exc}")
             return None
-
-        # Extract the OpenAIRE organization ID from the response
-        results = payload.get("results") or []
-        for item in results:
-            openorg_id = item.get("id")
-            if openorg_id:
-                return openorg_id
-        return None
+        return _first_result_id(payload)
 
     # Look up the OpenAIRE organization identifier using a ROR ID or URL.
 
@@ -517,7 +3448,18 @@ def _(Optional, call_graph_api, normalise_ror_link, requests):
             return None
         # Look up the OpenAIRE organization ID using the normalized ROR URL
         return _fetch_openorg_id(ror_url)
-    return (fetch_openorg_id_for_ror,)
+
+    async def fetch_openorg_id_for_ror_async(client: AsyncGraphClient, ror_value: Optional[str]) -> Optional[str]:
+        """Coroutine version of `fetch_openorg_id_for_ror` that runs on an `AsyncGraphClient`.
+
+        Errors are raised rather than returned as None, so the caller can tell a failed lookup from an organization without a match.
+        """
+        ror_url = normalise_ror_link(ror_value) if ror_value else ""
+        if not ror_url:
+            return None
+        payload = await client.call_graph_api("/v1/organizations", {"pid": ror_url})
+        return _first_result_id(payload)
+    return fetch_openorg_id_for_ror, fetch_openorg_id_for_ror_async
 
 
 @app.cell(hide_code=True)
@@ -543,81 +3485,154 @@ def _(mo):
 def _(mo):
     mo.md(r"""
     ## 5. Collect metrics for all universities
-    Loop through every organisation, ensure an OpenAIRE identifier is available, and add this information to new columns. and write to file nl_orgs_openaire.xlsx
+    Loop through every organisation, ensure an OpenAIRE identifier is available, and add this information to new columns. and write to the nl_orgs_openaire artifact
+
+    Runs are incremental: each baseline row carries a `baseline_hash`, and rows whose hash is already in the `nl_orgs_openaire.parquet` artifact with a `metrics_retrieved_at` younger than 30 days are carried forward unchanged. Only new, edited or stale organisations are fetched; `--refresh` fetches all of them. Rows whose ID or metric lookups failed are saved without a `metrics_retrieved_at`, so the next run fetches them again.
     """)
     return
 
 
 @app.cell
-def _(
+async def _(
     Any,
+    AsyncGraphClient,
+    CircuitOpenError,
     DATA_DIR,
-    ThreadPoolExecutor,
-    as_completed,
-    collect_metrics,
-    fetch_openorg_id_for_ror,
+    NumFoundPlanner,
+    Optional,
+    RunJournal,
+    asyncio,
+    etl_flag,
+    fetch_openorg_id_for_ror_async,
+    fresh_rows,
+    httpx,
+    log_graph_api_usage,
     pd,
+    read_artifact,
     tqdm,
     universities_df,
+    write_artifact,
 ):
     # 5. Enrich the NL organizations table with OpenAIRE IDs and metrics
     metric_columns = ['Data sources', 'Total Research Products', 'Publications', 'Research data', 'Research software', 'Other research products']
-    output_path = DATA_DIR / 'nl_orgs_openaire.xlsx'
-    checkpoint_path = DATA_DIR / 'nl_orgs_openaire.tmp.xlsx'
-    save_every = 5
-    max_workers = 6
-    if output_path.exists():
-        enriched_df = pd.read_excel(output_path)
-        for column in metric_columns:
-            if column not in enriched_df.columns:
-                enriched_df[column] = pd.NA
-        print(f'Loaded existing enriched dataset from {output_path}')
-    else:
-        enriched_df = universities_df.copy()  # save every N rows
-        for column in metric_columns:  # number of concurrent workers
-            if column not in enriched_df.columns:
-                enriched_df[column] = pd.NA
-
-        def enrich_row(idx: int) -> tuple[int, dict[str, Any]]:
+    output_name = 'nl_orgs_openaire'
+    journal_path = DATA_DIR / 'nl_orgs_openaire.journal.jsonl'
+    journal_columns = ['OpenAIRE_ORG_ID', *metric_columns, 'metrics_retrieved_at']
+    enrichment_ttl = pd.Timedelta(days=30)  # rows older than this are fetched again even when the baseline is unchanged
+    retrieved_at = pd.Timestamp.now().isoformat(timespec='seconds')
+    enriched_df = universities_df.copy()
+    for column in journal_columns:
+        if column not in enriched_df.columns:
+            enriched_df[column] = pd.NA
+    stored_df = read_artifact(output_name)
+    carried_index = set()
+    if stored_df is not None and 'baseline_hash' in stored_df.columns and not etl_flag('refresh'):
+        # Carry forward rows whose normalised baseline entry is unchanged and whose metrics are still fresh
+        stored_by_hash = fresh_rows(stored_df, 'baseline_hash', 'metrics_retrieved_at', enrichment_ttl)
+        for idx in enriched_df.index:
+            row_hash = enriched_df.at[idx, 'baseline_hash']
+            if row_hash not in stored_by_hash.index:
+                continue
+            stored_row = stored_by_hash.loc[row_hash]
+            for column in journal_columns:
+                enriched_df.at[idx, column] = stored_row.get(column, pd.NA)
+            carried_index.add(idx)
+    elif stored_df is not None:
+        print(f'Stored {output_name} has no baseline hashes; refreshing every organization')
+    refresh_index = [idx for idx in enriched_df.index if idx not in carried_index]
+    print(f'Carrying forward {len(carried_index)} organizations; fetching {len(refresh_index)} new, changed or stale ones')
+    if refresh_index:
+
+        async def resolve_org_id(client: AsyncGraphClient, idx: int) -> tuple[int, Optional[str], bool, bool]:
             row = enriched_df.loc[idx]
             identifier = row.get('OpenAIRE_ORG_ID')
-            added_id = False
-            if not identifier:
-                identifier = fetch_openorg_id_for_ror(row.get('ROR_LINK') or row.get('ROR'))
-                if identifier:
-                    added_id = True
-            metrics = collect_metrics('organization', identifier)
-            result = {'OpenAIRE_ORG_ID': identifier}
-            if identifier and metrics:
-                total_products = sum((metrics.get(label) or 0 for label in metric_columns[2:]))
-                for column in metric_columns:
-                    result[column] = total_products if column == 'Total Research Products' else metrics.get(column)
-            else:
-                for column in metric_columns:
-                    result[column] = pd.NA
-            result['added_id'] = added_id
-            return (idx, result)
-        progress = tqdm(enriched_df.index, desc='Enriching OpenAIRE IDs & metrics', unit='org')
+            if identifier:
+                return (idx, identifier, False, False)
+            try:
+                identifier = await fetch_openorg_id_for_ror_async(client, row.get('ROR_LINK') or row.get('ROR'))
+            except (httpx.HTTPError, CircuitOpenError) as exc:
+                print(f"Failed to fetch OpenAIRE ID for {row.get('name')}: {exc}")
+                return (idx, None, False, True)
+            return (idx, identifier, bool(identifier), False)
+
+        def journal_values(idx: int) -> dict[str, Any]:
+            return {column: None if pd.isna(enriched_df.at[idx, column]) else enriched_df.at[idx, column] for column in journal_columns}
+        progress = tqdm(refresh_index, desc='Enriching OpenAIRE IDs & metrics', unit='org')
         enriched_count = 0
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(enrich_row, idx): idx for idx in enriched_df.index}
-            for processed, future in enumerate(as_completed(futures), start=1):
-                idx, result = future.result()
-                enriched_df.at[idx, 'OpenAIRE_ORG_ID'] = result['OpenAIRE_ORG_ID']
-                for column in metric_columns:
-                    enriched_df.at[idx, column] = result[column]
-                if result.get('added_id'):
+        processed = 0
+        failed_orgs = 0
+        journal = RunJournal(journal_path)
+        journaled = journal.load()
+        pending_index = []
+        for idx in refresh_index:
+            journaled_values = journaled.get(enriched_df.at[idx, 'baseline_hash'])
+            if journaled_values is None:
+                pending_index.append(idx)
+                continue
+            for column in journal_columns:
+                enriched_df.at[idx, column] = pd.NA if journaled_values.get(column) is None else journaled_values[column]
+            processed = processed + 1
+            progress.update(1)
+        if processed:
+            print(f'Resumed {processed} organizations from {journal_path}')
+        async with AsyncGraphClient() as graph_client:
+            # Resolve missing OpenORG identifiers first; the metric lookups are planned on top of them
+            resolved_ids = await asyncio.gather(*(resolve_org_id(graph_client, idx) for idx in pending_index))
+            planner = NumFoundPlanner()
+            row_keys: dict[int, dict[str, tuple]] = {}
+            waiting: dict[tuple, list[int]] = {}
+            for idx, identifier, added_id, lookup_failed in resolved_ids:
+                enriched_df.at[idx, 'OpenAIRE_ORG_ID'] = identifier
+                if added_id:
                     enriched_count = enriched_count + 1
-                progress.update(1)
-                if processed % save_every == 0:
-                    enriched_df.to_excel(checkpoint_path, index=False)
-                    progress.set_postfix(saved_rows=processed)
+                if lookup_failed:
+                    # Left unstamped and out of the journal, so the next run asks again instead of carrying "no ID" forward
+                    failed_orgs = failed_orgs + 1
+                    progress.update(1)
+                    continue
+                if not identifier:
+                    for column in metric_columns:
+                        enriched_df.at[idx, column] = pd.NA
+                    enriched_df.at[idx, 'metrics_retrieved_at'] = retrieved_at
+                    journal.append(enriched_df.at[idx, 'baseline_hash'], journal_values(idx))
+                    processed = processed + 1
+                    progress.update(1)
+                    continue
+                row_keys[idx] = planner.add_metrics('organization', identifier, labels=metric_columns)
+                for plan_key in row_keys[idx].values():
+                    waiting.setdefault(plan_key, []).append(idx)
+            remaining = {idx: len(keys) for idx, keys in row_keys.items()}
+            async for plan_key, _value in planner.execute(graph_client):
+                for idx in waiting.pop(plan_key, []):
+                    remaining[idx] -= 1
+                    if remaining[idx]:
+                        continue
+                    for column, column_key in row_keys[idx].items():
+                        enriched_df.at[idx, column] = planner.values[column_key]
+                    if planner.failed(row_keys[idx].values()):
+                        failed_orgs = failed_orgs + 1
+                        progress.update(1)
+                        continue
+                    enriched_df.at[idx, 'metrics_retrieved_at'] = retrieved_at
+                    journal.append(enriched_df.at[idx, 'baseline_hash'], journal_values(idx))
+                    processed = processed + 1
+                    progress.update(1)
         progress.close()
-        enriched_df.to_excel(output_path, index=False)
+        journal.close()
+        print(planner.summary())
+        log_graph_api_usage()
         print(f'Added OpenAIRE IDs for {enriched_count} organizations')
-        print(f'Saved enriched data to {output_path}')
-        if checkpoint_path.exists():
-            print(f'Checkpoint saved to {checkpoint_path}')
+        if failed_orgs:
+            print(f'{failed_orgs} organizations had failed lookups; they are saved without metrics_retrieved_at and fetched again next run')
+    stored_is_current = not refresh_index and stored_df is not None and len(stored_df) == len(enriched_df) and set(stored_df['baseline_hash']) == set(enriched_df['baseline_hash'])
+    if not stored_is_current:
+        enriched_df = write_artifact(output_name, enriched_df)
+        print(f'Saved enriched data to {output_name}')
+        if refresh_index:
+            journal.discard()
+    else:
+        enriched_df = stored_df
+        print(f'{output_name} is up to date')
     enriched_df.head()
     missing_ids = enriched_df[enriched_df['OpenAIRE_ORG_ID'].isna() | (enriched_df['OpenAIRE_ORG_ID'] == '')]
     if not missing_ids.empty:
@@ -637,11 +3652,9 @@ def _(mo):
 
 
 @app.cell
-def _(IMG_DIR, enriched_df, pd, plt):
+def _(IMG_DIR, enriched_df, plt):
     numeric_columns = ['Total Research Products', 'Publications', 'Research data', 'Research software', 'Other research products']
-    for column_1 in numeric_columns:
-        enriched_df[column_1] = pd.to_numeric(enriched_df[column_1], errors='coerce')
-    plot_df = enriched_df.sort_values('Total Research Products', ascending=True)
+    plot_df = enriched_df.astype({column: 'float64' for column in numeric_columns}).sort_values('Total Research Products', ascending=True)
     fig, ax = plt.subplots(figsize=(12, 20))
     has_missing_id = plot_df['OpenAIRE_ORG_ID'].isna()
     bars = ax.barh(range(len(plot_df)), plot_df['Total Research Products'])
@@ -667,28 +3680,39 @@ def _(mo):
     mo.md(r"""
     ## 7. Fetch data source metadata
     Retrieve every OpenAIRE data source linked to the enriched organisations and cache the registry details.
+
+    The artifact is only written when every page came back. If any page fails, the previous `nl_orgs_openaire_datasources.parquet` is kept with its original timestamp, so the next run tries again; without an earlier artifact the step stops.
     """)
     return
 
 
 @app.cell
-def _(
+async def _(
     Any,
-    DATA_DIR,
+    AsyncGraphClient,
+    AsyncIterator,
+    CircuitOpenError,
     Dict,
     Optional,
-    ThreadPoolExecutor,
-    as_completed,
-    call_graph_api,
+    artifact_path,
+    asyncio,
     enriched_df,
+    etl_flag,
+    httpx,
+    log_graph_api_usage,
     pd,
+    read_artifact,
+    time,
     tqdm,
+    write_artifact,
 ):
     # 7. Fetch and store OpenAIRE data source metadata for NL organizations
     datasource_columns = ['OpenAIRE_ORG_ID', 'OpenAIRE_DataSource_ID', 'Name', 'Type', 'websiteUrl', 'OAI-endpoint', 'supports_NL-DIDL', 'support_OAI-DC', 'support_OAI-openaire', 'supports_RIOXX', 'support_OpenAIRE-CERIF', 'openaireCompatibility', 'Last_Indexed_Date', 'dateOfValidation']
-    datasources_path = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    if datasources_path.exists():
-        datasources_df = pd.read_excel(datasources_path)
+    datasources_path = artifact_path('nl_orgs_openaire_datasources')
+    datasource_metadata_ttl = 20 * 3600  # seconds; refetched daily so step 8 sees new Last_Indexed_Date values
+    metadata_is_fresh = datasources_path.exists() and time.time() - datasources_path.stat().st_mtime < datasource_metadata_ttl
+    if metadata_is_fresh and (not etl_flag('refresh')):
+        datasources_df = read_artifact('nl_orgs_openaire_datasources')
         print(f'Loaded existing datasource metadata from {datasources_path}')
     else:
 
@@ -697,33 +3721,63 @@ def _(
             ds_type = (item.get('type') or {}).get('value')
             return {'OpenAIRE_ORG_ID': org_id, 'OpenAIRE_DataSource_ID': item.get('id'), 'Name': name, 'Type': ds_type, 'websiteUrl': item.get('websiteUrl'), 'OAI-endpoint': None, 'supports_NL-DIDL': None, 'support_OAI-DC': None, 'support_OAI-openaire': None, 'supports_RIOXX': None, 'support_OpenAIRE-CERIF': None, 'openaireCompatibility': item.get('openaireCompatibility'), 'Last_Indexed_Date': item.get('lastIndexedDate') or item.get('lastIndexDate'), 'dateOfValidation': item.get('dateOfValidation')}
 
-        def fetch_datasources_for_org(org_entry: dict[str, Any]) -> list[dict[str, Any]]:
+        async def iter_datasources_for_org(client: AsyncGraphClient, org_entry: dict[str, Any], page_size: int=100) -> AsyncIterator[dict[str, Any]]:
+            """Stream the data source records of one organisation.
+
+            Page 1 reveals numFound; the remaining pages are then requested concurrently
+            and their records are yielded in the order the pages arrive.
+            """
             org_id = org_entry.get('OpenAIRE_ORG_ID')
-            if not org_id:
-                return []
-            records: list[dict[str, Any]] = []
-            page = 1
-            page_size = 100
-            while True:
-                payload = call_graph_api('/v1/dataSources', {'relOrganizationId': org_id, 'page': page, 'pageSize': page_size})
-                results = payload.get('results') or []
-                for item in results:
-                    records.append(_parse_datasource_record(org_id, item))
-                header = payload.get('header') or {}
-                num_found = header.get('numFound', 0)
-                if page * page_size >= num_found or not results:
-                    break
-                page = page + 1
-            return records
+            if pd.isna(org_id) or not org_id:
+                return
+
+            async def fetch_page(page: int) -> tuple[int, Optional[Dict[str, Any]]]:
+                try:
+                    return (page, await client.call_graph_api('/v1/dataSources', {'relOrganizationId': org_id, 'page': page, 'pageSize': page_size}))
+                except (httpx.HTTPError, CircuitOpenError) as exc:
+                    print(f'Failed to fetch data sources for {org_id} (page {page}): {exc}')
+                    failed_pages.append((org_id, page))
+                    return (page, None)
+            _, first_payload = await fetch_page(1)
+            if first_payload is None:
+                return
+            for item in first_payload.get('results') or []:
+                yield _parse_datasource_record(org_id, item)
+            num_found = int((first_payload.get('header') or {}).get('numFound') or 0)
+            last_page = -(-num_found // page_size)
+            if last_page <= 1:
+                return
+            page_tasks = [asyncio.create_task(fetch_page(page)) for page in range(2, last_page + 1)]
+            try:
+                for page_task in asyncio.as_completed(page_tasks):
+                    _, payload = await page_task
+                    for item in (payload or {}).get('results') or []:
+                        yield _parse_datasource_record(org_id, item)
+            finally:
+                for page_task in page_tasks:
+                    page_task.cancel()
         datasource_records: list[dict[str, Any]] = []
+        failed_pages: list[tuple[str, int]] = []
         org_entries = enriched_df.to_dict('records')
-        with ThreadPoolExecutor(max_workers=6) as executor_1:
-            futures_1 = {executor_1.submit(fetch_datasources_for_org, entry): entry for entry in org_entries}
-            for future_1 in tqdm(as_completed(futures_1), total=len(org_entries), desc='Fetching data sources', unit='org'):
-                datasource_records.extend(future_1.result())
-        datasources_df = pd.DataFrame(datasource_records, columns=datasource_columns)
-        datasources_df.to_excel(datasources_path, index=False)
-        print(f'Saved {len(datasources_df)} data source rows to {datasources_path}')
+
+        async def collect_datasources(client: AsyncGraphClient, org_entry: dict[str, Any]) -> None:
+            async for record in iter_datasources_for_org(client, org_entry):
+                datasource_records.append(record)
+        async with AsyncGraphClient() as graph_client_1:
+            tasks_1 = [asyncio.create_task(collect_datasources(graph_client_1, entry)) for entry in org_entries]
+            for task_1 in tqdm(asyncio.as_completed(tasks_1), total=len(org_entries), desc='Fetching data sources', unit='org'):
+                await task_1
+        log_graph_api_usage()
+        if failed_pages:
+            # A partial list would replace the complete one and then pass as fresh for the next 20 hours
+            failed_summary = ', '.join((f'{org_id} (page {page})' for org_id, page in sorted(failed_pages)))
+            datasources_df = read_artifact('nl_orgs_openaire_datasources')
+            if datasources_df is None:
+                raise RuntimeError(f'Data source pages failed and no earlier nl_orgs_openaire_datasources artifact exists: {failed_summary}')
+            print(f'Data source pages failed, keeping the previous {datasources_path}: {failed_summary}')
+        else:
+            datasources_df = write_artifact('nl_orgs_openaire_datasources', pd.DataFrame(datasource_records, columns=datasource_columns))
+            print(f'Saved {len(datasources_df)} data source rows to {datasources_path}')
     datasources_df.head()
     return (datasources_df,)
 
@@ -733,55 +3787,85 @@ def _(mo):
     mo.md(r"""
     ## 8. Capture data source content volumes
     Collect fresh numFound counts per data source (total and by product type) and store the snapshot with today's date.
+
+    Counts only move when OpenAIRE re-indexes a data source. Data sources whose `Last_Indexed_Date` matches their latest history row reuse those counts and are marked `carried_forward`; only re-indexed or new data sources are queried. Pass `--full-snapshot` to query every data source.
     """)
     return
 
 
 @app.cell
-def _(
+async def _(
     Any,
-    DATA_DIR,
+    AsyncGraphClient,
+    NumFoundPlanner,
+    Optional,
     PRODUCT_TYPE_LABELS,
-    ThreadPoolExecutor,
-    as_completed,
+    artifact_exists,
     datasources_df,
     datetime,
-    fetch_num_found,
+    etl_flag,
+    log_graph_api_usage,
+    numfound_history,
     pd,
+    read_artifact,
     tqdm,
+    write_artifact,
 ):
     # 8. Collect and store numFound snapshots for data sources
     snapshot_date = datetime.utcnow().date().isoformat()
-    snapshot_path = DATA_DIR / f'nl_orgs_openaire_datasources_numFound_{snapshot_date}.xlsx'
-    if snapshot_path.exists():
-        datasource_metrics_df = pd.read_excel(snapshot_path)
-        print(f'Loaded existing numFound snapshot for {snapshot_date} from {snapshot_path}')
+    snapshot_name = f'nl_orgs_openaire_datasources_numFound_{snapshot_date}'
+    count_columns = ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]
+    snapshot_columns = ['OpenAIRE_DataSource_ID', 'Name', *count_columns, 'date_retrieved', 'Last_Indexed_Date', 'carried_forward']
+    if artifact_exists(snapshot_name):
+        datasource_metrics_df = read_artifact(snapshot_name, schema='numfound_snapshot')
+        print(f'Loaded existing numFound snapshot for {snapshot_date} from {snapshot_name}')
     elif datasources_df.empty:
         print('No data sources available; skipping numFound snapshot.')
-        datasource_metrics_df = pd.DataFrame(columns=['OpenAIRE_DataSource_ID', 'Name', 'Total Research Products', *PRODUCT_TYPE_LABELS.values(), 'date_retrieved'])
+        datasource_metrics_df = pd.DataFrame(columns=snapshot_columns)
     else:
 
-        def collect_datasource_counts(row: pd.Series) -> dict[str, Any]:
-            datasource_id = getattr(row, 'OpenAIRE_DataSource_ID', None)
-            if not datasource_id:
-                return {}
-            metrics: dict[str, Any] = {'OpenAIRE_DataSource_ID': datasource_id, 'Name': getattr(row, 'Name', None), 'date_retrieved': snapshot_date}
-            total_params = {'relCollectedFromDatasourceId': datasource_id}
-            metrics['Total Research Products'] = fetch_num_found('/v2/researchProducts', total_params)
-            for rp_type, label in PRODUCT_TYPE_LABELS.items():
-                rp_params = {'relCollectedFromDatasourceId': datasource_id, 'type': rp_type}
-                metrics[label] = fetch_num_found('/v2/researchProducts', rp_params)
-            return metrics
+        def indexed_date(value: Any) -> Optional[pd.Timestamp]:
+            parsed = pd.to_datetime(value, errors='coerce', utc=True)
+            return None if pd.isna(parsed) else parsed
+        # Counts only change when OpenAIRE re-indexes a data source, so the previous history row
+        # is reused for every data source whose Last_Indexed_Date has not moved since then.
+        # Every snapshot lists all data sources (carried rows included), so the newest one suffices.
+        previous_counts: dict[str, dict[str, Any]] = {}
+        if not etl_flag('full-snapshot'):
+            history_rows = numfound_history.read(last_n=1)
+            history_rows = history_rows.dropna(subset=['Last_Indexed_Date', *count_columns])
+            history_rows = history_rows.sort_values('date_retrieved').drop_duplicates('OpenAIRE_DataSource_ID', keep='last')
+            previous_counts = history_rows.set_index('OpenAIRE_DataSource_ID').to_dict('index')
+        planner_1 = NumFoundPlanner()
         datasource_metrics: list[dict[str, Any]] = []
-        with ThreadPoolExecutor(max_workers=6) as executor_2:
-            futures_2 = {executor_2.submit(collect_datasource_counts, row): row for row in datasources_df.itertuples(index=False)}
-            for future_2 in tqdm(as_completed(futures_2), total=len(futures_2), desc='Collecting numFound', unit='datasource'):
-                result_1 = future_2.result()
-                if result_1:
-                    datasource_metrics.append(result_1)
-        datasource_metrics_df = pd.DataFrame(datasource_metrics, columns=['OpenAIRE_DataSource_ID', 'Name', 'Total Research Products', *PRODUCT_TYPE_LABELS.values(), 'date_retrieved'])
-        datasource_metrics_df.to_excel(snapshot_path, index=False)
-        print(f'Saved snapshot with {len(datasource_metrics_df)} data sources to {snapshot_path}')
+        datasource_keys: list[Optional[dict[str, tuple]]] = []
+        for datasource_row in datasources_df.itertuples(index=False):
+            datasource_id = getattr(datasource_row, 'OpenAIRE_DataSource_ID', None)
+            if pd.isna(datasource_id) or not datasource_id:
+                continue
+            last_indexed = getattr(datasource_row, 'Last_Indexed_Date', None)
+            metrics = {'OpenAIRE_DataSource_ID': datasource_id, 'Name': getattr(datasource_row, 'Name', None), 'date_retrieved': snapshot_date, 'Last_Indexed_Date': last_indexed, 'carried_forward': False}
+            previous = previous_counts.get(datasource_id)
+            if previous is not None and indexed_date(last_indexed) is not None and indexed_date(previous['Last_Indexed_Date']) == indexed_date(last_indexed):
+                metrics.update({column: previous[column] for column in count_columns})
+                metrics['carried_forward'] = True
+                datasource_keys.append(None)
+            else:
+                datasource_keys.append(planner_1.add_product_counts({'relCollectedFromDatasourceId': datasource_id}))
+            datasource_metrics.append(metrics)
+        carried_count = sum((keys is None for keys in datasource_keys))
+        print(f'Reusing counts for {carried_count} data sources that were not re-indexed; querying {len(datasource_keys) - carried_count}')
+        async with AsyncGraphClient() as graph_client_2:
+            with tqdm(total=planner_1.unique_lookups, desc='Collecting numFound', unit='lookup') as progress_1:
+                async for _plan_key, _value in planner_1.execute(graph_client_2):
+                    progress_1.update(1)
+        for metrics, keys in zip(datasource_metrics, datasource_keys):
+            if keys is not None:
+                metrics.update({label: planner_1.values.get(key) for label, key in keys.items()})
+        print(planner_1.summary())
+        log_graph_api_usage()
+        datasource_metrics_df = write_artifact(snapshot_name, pd.DataFrame(datasource_metrics, columns=snapshot_columns), schema='numfound_snapshot')
+        print(f'Saved snapshot with {len(datasource_metrics_df)} data sources to {snapshot_name}')
     datasource_metrics_df.head()
     return (datasource_metrics_df,)
 
@@ -806,40 +3890,29 @@ def _(mo):
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
-    ## 9. Append snapshot to history file
-    Keep a cumulative log so repeated snapshots form a time series.
+    ## 9. Append snapshot to history store
+    Keep a cumulative log so repeated snapshots form a time series. Each snapshot date is its own partition in `data/numfound_history/`, so appending never rewrites earlier snapshots.
     """)
     return
 
 
 @app.cell
-def _(DATA_DIR, PRODUCT_TYPE_LABELS, datasource_metrics_df, pd):
+def _(datasource_metrics_df, numfound_history, read_artifact):
     # 9. Append snapshot to historical log
-    history_path = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    history_columns = ['OpenAIRE_DataSource_ID', 'Name', 'Total Research Products', *PRODUCT_TYPE_LABELS.values(), 'date_retrieved']
-    if history_path.exists():
-        historical_df = pd.read_excel(history_path)
-        print(f'Loaded historical log from {history_path}')
-    else:
-        historical_df = pd.DataFrame(columns=history_columns)
-        print('No historical log found; a new one will be created if data is appended.')
+    if not numfound_history.dates():
+        # One-off import of the single-file history written by earlier versions of this notebook
+        legacy_history_df = read_artifact('nl_orgs_openaire_datasources_numFound_history', schema='numfound_snapshot')
+        if legacy_history_df is not None:
+            imported = numfound_history.append(legacy_history_df)
+            print(f'Imported {imported} legacy history rows into {numfound_history.root}')
     if datasource_metrics_df.empty:
         print('No snapshot data to append.')
     else:
-        snapshot_date_value = None
-        if 'date_retrieved' in datasource_metrics_df.columns and (not datasource_metrics_df['date_retrieved'].isna().all()):
-            snapshot_date_value = str(datasource_metrics_df['date_retrieved'].iloc[0])
-        already_recorded = snapshot_date_value is not None and (not historical_df.empty) and ('date_retrieved' in historical_df.columns) and (snapshot_date_value in historical_df['date_retrieved'].astype(str).values)
-        if already_recorded:
-            print(f'Snapshot for {snapshot_date_value} already recorded; skipping append.')
+        appended = numfound_history.append(datasource_metrics_df)
+        if appended:
+            print(f'Appended {appended} rows; history now holds {len(numfound_history.dates())} snapshots in {numfound_history.root}')
         else:
-            combined_df = pd.concat([historical_df, datasource_metrics_df], ignore_index=True) if not historical_df.empty else datasource_metrics_df.copy()
-            for column_2 in ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]:
-                if column_2 in combined_df.columns:
-                    combined_df[column_2] = pd.to_numeric(combined_df[column_2], errors='coerce')
-            combined_df.to_excel(history_path, index=False)
-            historical_df = combined_df
-            print(f'History now contains {len(historical_df)} rows at {history_path}')
+            print('Snapshot already recorded; history unchanged.')
     return
 
 
@@ -853,65 +3926,43 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, IMG_DIR, PRODUCT_TYPE_LABELS, datasources_df, pd, plt):
-    history_path_1 = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    datasources_path_1 = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    if not history_path_1.exists():
-        print(f'History file {history_path_1} not found.')
+def _(IMG_DIR, etl_data, plt):
+    latest_df = etl_data.latest_snapshot()
+    if latest_df.empty:
+        print('No rows for the latest snapshot date.')
     else:
-        history_df = pd.read_excel(history_path_1)
-        numeric_columns_1 = ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]
-        for column_3 in numeric_columns_1:
-            if column_3 in history_df.columns:
-                history_df[column_3] = pd.to_numeric(history_df[column_3], errors='coerce')
-        history_df['date_retrieved'] = pd.to_datetime(history_df['date_retrieved'], errors='coerce')
-        latest_date = history_df['date_retrieved'].max()
-        latest_df = history_df[history_df['date_retrieved'] == latest_date].copy()
+        latest_date = latest_df['date_retrieved'].max()
+        zero_mask = latest_df['Total Research Products'].fillna(0) <= 0
+        zero_total_df = latest_df[zero_mask].copy()
+        if not zero_total_df.empty:
+            print('Datasources with zero total research products (excluded from chart):')
+            for _, row in zero_total_df.iterrows():
+                print(f" - {row.get('Name', 'Unknown')} ({row.get('OpenAIRE_DataSource_ID')})")
+        latest_df = latest_df.loc[~zero_mask].copy()
         if latest_df.empty:
-            print('No rows for the latest snapshot date.')
+            print('All datasources reported zero totals; skipping chart.')
         else:
-            if 'Type' not in latest_df.columns or latest_df['Type'].isna().all():
-                if 'datasources_df' in globals():
-                    type_lookup = datasources_df[['OpenAIRE_DataSource_ID', 'Type']].copy()
-                elif datasources_path_1.exists():
-                    type_lookup = pd.read_excel(datasources_path_1)[['OpenAIRE_DataSource_ID', 'Type']].copy()
-                else:
-                    type_lookup = pd.DataFrame(columns=['OpenAIRE_DataSource_ID', 'Type'])
-                latest_df = latest_df.merge(type_lookup, on='OpenAIRE_DataSource_ID', how='left', suffixes=(None, '_ds'))
-                if 'Type_ds' in latest_df.columns:
-                    latest_df['Type'] = latest_df['Type'].fillna(latest_df['Type_ds'])
-                    latest_df = latest_df.drop(columns=['Type_ds'])
-            zero_mask = latest_df['Total Research Products'].fillna(0) <= 0
-            zero_total_df = latest_df[zero_mask].copy()
-            if not zero_total_df.empty:
-                print('Datasources with zero total research products (excluded from chart):')
-                for _, row in zero_total_df.iterrows():
-                    print(f" - {row.get('Name', 'Unknown')} ({row.get('OpenAIRE_DataSource_ID')})")
-            latest_df = latest_df.loc[~zero_mask].copy()
-            if latest_df.empty:
-                print('All datasources reported zero totals; skipping chart.')
-            else:
-                latest_df = latest_df.sort_values('Total Research Products', ascending=False)
-                max_label_length = 40
-                display_names = latest_df['Name'].fillna('Unknown').astype(str).apply(lambda text: text if len(text) <= max_label_length else text[:max_label_length - 1] + '…')
-                type_series = latest_df['Type'].fillna('Unknown')
-                unique_types = type_series.unique()
-                cmap = plt.cm.get_cmap('tab20', max(len(unique_types), 1))
-                color_map = {t: cmap(i) for i, t in enumerate(unique_types)}
-                colors = type_series.map(color_map)
-                fig_1, ax_1 = plt.subplots(figsize=(12, 10))
-                ax_1.barh(display_names, latest_df['Total Research Products'], color=colors)
-                ax_1.set_title(f'Total research products per data source (snapshot {latest_date.date()})')
-                ax_1.set_xlabel('Total research products')
-                ax_1.set_ylabel('Data source')
-                ax_1.invert_yaxis()
-                handles = [plt.Rectangle((0, 0), 1, 1, color=color_map[t]) for t in unique_types]
-                ax_1.legend(handles, unique_types, title='Data source type', loc='upper center', bbox_to_anchor=(0.5, -0.12), ncol=3)
-                fig_1.tight_layout()
-                chart_path = IMG_DIR / 'datasource_totals_latest.png'
-                fig_1.savefig(chart_path, dpi=200, bbox_inches='tight')
-                print(f'Saved latest data source totals chart to {chart_path}')
-                plt.show()
+            latest_df = latest_df.sort_values('Total Research Products', ascending=False)
+            max_label_length = 40
+            display_names = latest_df['Name'].fillna('Unknown').astype(str).apply(lambda text: text if len(text) <= max_label_length else text[:max_label_length - 1] + '…')
+            type_series = latest_df['Type'].fillna('Unknown')
+            unique_types = type_series.unique()
+            cmap = plt.cm.get_cmap('tab20', max(len(unique_types), 1))
+            color_map = {t: cmap(i) for i, t in enumerate(unique_types)}
+            colors = type_series.map(color_map)
+            fig_1, ax_1 = plt.subplots(figsize=(12, 10))
+            ax_1.barh(display_names, latest_df['Total Research Products'], color=colors)
+            ax_1.set_title(f'Total research products per data source (snapshot {latest_date.date()})')
+            ax_1.set_xlabel('Total research products')
+            ax_1.set_ylabel('Data source')
+            ax_1.invert_yaxis()
+            handles = [plt.Rectangle((0, 0), 1, 1, color=color_map[t]) for t in unique_types]
+            ax_1.legend(handles, unique_types, title='Data source type', loc='upper center', bbox_to_anchor=(0.5, -0.12), ncol=3)
+            fig_1.tight_layout()
+            chart_path = IMG_DIR / 'datasource_totals_latest.png'
+            fig_1.savefig(chart_path, dpi=200, bbox_inches='tight')
+            print(f'Saved latest data source totals chart to {chart_path}')
+            plt.show()
     return
 
 
@@ -925,77 +3976,48 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, IMG_DIR, PRODUCT_TYPE_LABELS, datasources_df, pd, plt):
-    history_path_2 = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    datasources_path_2 = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    if not history_path_2.exists():
-        print(f'History file {history_path_2} not found.')
+def _(IMG_DIR, etl_data, plt):
+    latest_df_1 = etl_data.latest_snapshot()
+    previous_df = etl_data.previous_snapshot()
+    if previous_df.empty:
+        print('Not enough snapshots to compare (need at least two dates).')
     else:
-        history_df_1 = pd.read_excel(history_path_2)
-        numeric_columns_2 = ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]
-        for column_4 in numeric_columns_2:
-            if column_4 in history_df_1.columns:
-                history_df_1[column_4] = pd.to_numeric(history_df_1[column_4], errors='coerce')
-        history_df_1['date_retrieved'] = pd.to_datetime(history_df_1['date_retrieved'], errors='coerce')
-        unique_dates = sorted(history_df_1['date_retrieved'].dropna().unique())
-        if len(unique_dates) < 2:
-            print('Not enough snapshots to compare (need at least two dates).')
+        latest_date_1 = latest_df_1['date_retrieved'].max()
+        previous_date = previous_df['date_retrieved'].max()
+        combined = latest_df_1[['OpenAIRE_DataSource_ID', 'Name', 'Type', 'Total Research Products']].rename(columns={'Total Research Products': 'Total Research Products_latest'})
+        combined = combined.merge(previous_df[['OpenAIRE_DataSource_ID', 'Total Research Products']].rename(columns={'Total Research Products': 'Total Research Products_previous'}), on='OpenAIRE_DataSource_ID', how='outer')
+        combined['Name'] = combined['Name'].fillna('Unknown')
+        combined['Type'] = combined['Type'].fillna('Unknown')
+        combined = combined.fillna({'Total Research Products_latest': 0, 'Total Research Products_previous': 0})
+        zero_mask_1 = combined['Total Research Products_latest'].fillna(0) <= 0
+        zero_total_df_1 = combined[zero_mask_1].copy()
+        if not zero_total_df_1.empty:
+            print('Datasources with zero total research products (excluded from comparison chart):')
+            for _, row_1 in zero_total_df_1.iterrows():
+                print(f" - {row_1.get('Name', 'Unknown')} ({row_1.get('OpenAIRE_DataSource_ID')})")
+        combined = combined.loc[~zero_mask_1].copy()
+        if combined.empty:
+            print('No datasources with non-zero totals available for comparison chart.')
         else:
-            latest_date_1 = unique_dates[-1]
-            previous_date = unique_dates[-2]
-            latest_df_1 = history_df_1[history_df_1['date_retrieved'] == latest_date_1].copy()
-            previous_df = history_df_1[history_df_1['date_retrieved'] == previous_date].copy()
-            if 'datasources_df' in globals():
-                type_lookup_1 = datasources_df[['OpenAIRE_DataSource_ID', 'Type']].copy()
-            elif datasources_path_2.exists():
-                type_lookup_1 = pd.read_excel(datasources_path_2)[['OpenAIRE_DataSource_ID', 'Type']].copy()
-            else:
-                type_lookup_1 = pd.DataFrame(columns=['OpenAIRE_DataSource_ID', 'Type'])
-
-            def attach_type(df: pd.DataFrame) -> pd.DataFrame:
-                if 'Type' in df.columns and df['Type'].notna().any():
-                    return df
-                merged = df.merge(type_lookup_1, on='OpenAIRE_DataSource_ID', how='left', suffixes=(None, '_ds'))
-                if 'Type_ds' in merged.columns:
-                    merged['Type'] = merged['Type'].fillna(merged['Type_ds'])
-                    merged = merged.drop(columns=['Type_ds'])
-                return merged
-            latest_df_1 = attach_type(latest_df_1)
-            previous_df = attach_type(previous_df)
-            combined = latest_df_1[['OpenAIRE_DataSource_ID', 'Name', 'Type', 'Total Research Products']].rename(columns={'Total Research Products': 'Total Research Products_latest'})
-            combined = combined.merge(previous_df[['OpenAIRE_DataSource_ID', 'Total Research Products']].rename(columns={'Total Research Products': 'Total Research Products_previous'}), on='OpenAIRE_DataSource_ID', how='outer')
-            combined['Name'] = combined['Name'].fillna('Unknown')
-            combined['Type'] = combined['Type'].fillna('Unknown')
-            combined = combined.fillna({'Total Research Products_latest': 0, 'Total Research Products_previous': 0})
-            zero_mask_1 = combined['Total Research Products_latest'].fillna(0) <= 0
-            zero_total_df_1 = combined[zero_mask_1].copy()
-            if not zero_total_df_1.empty:
-                print('Datasources with zero total research products (excluded from comparison chart):')
-                for _, row_1 in zero_total_df_1.iterrows():
-                    print(f" - {row_1.get('Name', 'Unknown')} ({row_1.get('OpenAIRE_DataSource_ID')})")
-            combined = combined.loc[~zero_mask_1].copy()
-            if combined.empty:
-                print('No datasources with non-zero totals available for comparison chart.')
-            else:
-                combined = combined.sort_values('Total Research Products_latest', ascending=False)
-                max_label_length_1 = 40
-                display_names_1 = combined['Name'].astype(str).apply(lambda text: text if len(text) <= max_label_length_1 else text[:max_label_length_1 - 1] + '…')
-                fig_2, ax_2 = plt.subplots(figsize=(12, 30))
-                y_positions = range(len(combined))
-                bar_height = 0.35
-                ax_2.barh([y + bar_height / 2 for y in y_positions], combined['Total Research Products_latest'], height=bar_height, color='#1a9850', label=f'Latest ({latest_date_1.date()})')
-                ax_2.barh([y - bar_height / 2 for y in y_positions], combined['Total Research Products_previous'], height=bar_height, color='#b8e186', label=f'Previous ({previous_date.date()})')
-                ax_2.set_yticks(list(y_positions))
-                ax_2.set_yticklabels(display_names_1)
-                ax_2.set_xlabel('Total research products')
-                ax_2.set_title('Latest vs previous total research products per data source')
-                ax_2.legend(loc='upper center', bbox_to_anchor=(0.5, -0.08), ncol=2)
-                ax_2.invert_yaxis()
-                fig_2.tight_layout()
-                compare_path = IMG_DIR / 'datasource_totals_compare.png'
-                fig_2.savefig(compare_path, dpi=200, bbox_inches='tight')
-                print(f'Saved comparison chart to {compare_path}')
-                plt.show()
+            combined = combined.sort_values('Total Research Products_latest', ascending=False)
+            max_label_length_1 = 40
+            display_names_1 = combined['Name'].astype(str).apply(lambda text: text if len(text) <= max_label_length_1 else text[:max_label_length_1 - 1] + '…')
+            fig_2, ax_2 = plt.subplots(figsize=(12, 30))
+            y_positions = range(len(combined))
+            bar_height = 0.35
+            ax_2.barh([y + bar_height / 2 for y in y_positions], combined['Total Research Products_latest'], height=bar_height, color='#1a9850', label=f'Latest ({latest_date_1.date()})')
+            ax_2.barh([y - bar_height / 2 for y in y_positions], combined['Total Research Products_previous'], height=bar_height, color='#b8e186', label=f'Previous ({previous_date.date()})')
+            ax_2.set_yticks(list(y_positions))
+            ax_2.set_yticklabels(display_names_1)
+            ax_2.set_xlabel('Total research products')
+            ax_2.set_title('Latest vs previous total research products per data source')
+            ax_2.legend(loc='upper center', bbox_to_anchor=(0.5, -0.08), ncol=2)
+            ax_2.invert_yaxis()
+            fig_2.tight_layout()
+            compare_path = IMG_DIR / 'datasource_totals_compare.png'
+            fig_2.savefig(compare_path, dpi=200, bbox_inches='tight')
+            print(f'Saved comparison chart to {compare_path}')
+            plt.show()
     return
 
 
@@ -1009,59 +4031,46 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, IMG_DIR, PRODUCT_TYPE_LABELS, pd, plt):
-    history_path_3 = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    datasources_path_3 = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    orgs_path = DATA_DIR / 'nl_orgs_openaire.xlsx'
-    if not (history_path_3.exists() and datasources_path_3.exists() and orgs_path.exists()):
-        print('One or more required files are missing. Please run Steps 3, 7, and 8 before this comparison.')
+def _(IMG_DIR, etl_data, plt):
+    datasource_latest = etl_data.latest_snapshot()
+    link_df = etl_data.org_datasource_links()
+    orgs_df = etl_data.orgs()
+    if orgs_df is None or link_df.empty:
+        print('One or more required artifacts are missing. Please run Steps 3, 7, and 8 before this comparison.')
+    elif datasource_latest.empty:
+        print('No datasource snapshot found for comparison.')
     else:
-        history_df_2 = pd.read_excel(history_path_3)
-        datasources_df_1 = pd.read_excel(datasources_path_3)
-        orgs_df = pd.read_excel(orgs_path)
-        numeric_columns_3 = ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]
-        for column_5 in numeric_columns_3:
-            if column_5 in history_df_2.columns:
-                history_df_2[column_5] = pd.to_numeric(history_df_2[column_5], errors='coerce')
-            if column_5 in orgs_df.columns:
-                orgs_df[column_5] = pd.to_numeric(orgs_df[column_5], errors='coerce')
-        history_df_2['date_retrieved'] = pd.to_datetime(history_df_2['date_retrieved'], errors='coerce')
-        latest_date_2 = history_df_2['date_retrieved'].max()
-        datasource_latest = history_df_2[history_df_2['date_retrieved'] == latest_date_2].copy()
-        if datasource_latest.empty:
-            print('No datasource snapshot found for comparison.')
+        latest_date_2 = datasource_latest['date_retrieved'].max()
+        datasource_latest['Total Research Products'] = datasource_latest['Total Research Products'].fillna(0)
+        mapped = link_df.merge(datasource_latest[['OpenAIRE_DataSource_ID', 'Total Research Products']], on='OpenAIRE_DataSource_ID', how='left')
+        mapped['Total Research Products'] = mapped['Total Research Products'].fillna(0)
+        datasource_by_org = mapped.groupby('OpenAIRE_ORG_ID')['Total Research Products'].sum()
+        org_totals = orgs_df[['name', 'OpenAIRE_ORG_ID', 'Total Research Products']].copy()
+        org_totals['Total Research Products'] = org_totals['Total Research Products'].fillna(0)
+        org_totals['Datasource totals'] = org_totals['OpenAIRE_ORG_ID'].map(datasource_by_org).fillna(0)
+        if org_totals.empty:
+            print('Organisation totals not available for comparison.')
         else:
-            datasource_latest['Total Research Products'] = datasource_latest['Total Research Products'].fillna(0)
-            link_df = datasources_df_1[['OpenAIRE_DataSource_ID', 'OpenAIRE_ORG_ID']].copy()
-            mapped = link_df.merge(datasource_latest[['OpenAIRE_DataSource_ID', 'Total Research Products']], on='OpenAIRE_DataSource_ID', how='left')
-            mapped['Total Research Products'] = mapped['Total Research Products'].fillna(0)
-            datasource_by_org = mapped.groupby('OpenAIRE_ORG_ID')['Total Research Products'].sum()
-            org_totals = orgs_df[['name', 'OpenAIRE_ORG_ID', 'Total Research Products']].copy()
-            org_totals['Total Research Products'] = org_totals['Total Research Products'].fillna(0)
-            org_totals['Datasource totals'] = org_totals['OpenAIRE_ORG_ID'].map(datasource_by_org).fillna(0)
-            if org_totals.empty:
-                print('Organisation totals not available for comparison.')
-            else:
-                org_totals = org_totals.sort_values('Total Research Products', ascending=False)
-                max_label_length_2 = 40
-                display_names_2 = org_totals['name'].astype(str).apply(lambda text: text if len(text) <= max_label_length_2 else text[:max_label_length_2 - 1] + '…')
-                indices = range(len(org_totals))
-                bar_height_1 = 0.4
-                fig_3, ax_3 = plt.subplots(figsize=(12, 20))
-                ax_3.barh([i + bar_height_1 / 2 for i in indices], org_totals['Total Research Products'], height=bar_height_1, color='#1f77b4', label='Organisation total')
-                ax_3.barh([i - bar_height_1 / 2 for i in indices], org_totals['Datasource totals'], height=bar_height_1, color='#2ca02c', label='Combined datasource totals')
-                ax_3.set_yticks(list(indices))
-                ax_3.set_yticklabels(display_names_2)
-                ax_3.set_xlabel('Total research products')
-                ax_3.set_ylabel('Organisation')
-                ax_3.set_title(f'Organisation vs. datasource totals (snapshot {latest_date_2.date()})')
-                ax_3.legend(loc='upper center', bbox_to_anchor=(0.5, -0.08), ncol=2)
-                ax_3.invert_yaxis()
-                fig_3.tight_layout()
-                org_vs_ds_path = IMG_DIR / 'org_vs_datasources.png'
-                fig_3.savefig(org_vs_ds_path, dpi=200, bbox_inches='tight')
-                print(f'Saved organisation vs datasource comparison chart to {org_vs_ds_path}')
-                plt.show()
+            org_totals = org_totals.sort_values('Total Research Products', ascending=False)
+            max_label_length_2 = 40
+            display_names_2 = org_totals['name'].astype(str).apply(lambda text: text if len(text) <= max_label_length_2 else text[:max_label_length_2 - 1] + '…')
+            indices = range(len(org_totals))
+            bar_height_1 = 0.4
+            fig_3, ax_3 = plt.subplots(figsize=(12, 20))
+            ax_3.barh([i + bar_height_1 / 2 for i in indices], org_totals['Total Research Products'], height=bar_height_1, color='#1f77b4', label='Organisation total')
+            ax_3.barh([i - bar_height_1 / 2 for i in indices], org_totals['Datasource totals'], height=bar_height_1, color='#2ca02c', label='Combined datasource totals')
+            ax_3.set_yticks(list(indices))
+            ax_3.set_yticklabels(display_names_2)
+            ax_3.set_xlabel('Total research products')
+            ax_3.set_ylabel('Organisation')
+            ax_3.set_title(f'Organisation vs. datasource totals (snapshot {latest_date_2.date()})')
+            ax_3.legend(loc='upper center', bbox_to_anchor=(0.5, -0.08), ncol=2)
+            ax_3.invert_yaxis()
+            fig_3.tight_layout()
+            org_vs_ds_path = IMG_DIR / 'org_vs_datasources.png'
+            fig_3.savefig(org_vs_ds_path, dpi=200, bbox_inches='tight')
+            print(f'Saved organisation vs datasource comparison chart to {org_vs_ds_path}')
+            plt.show()
     return
 
 
@@ -1075,74 +4084,63 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, IMG_DIR, PRODUCT_TYPE_LABELS, pd, plt):
-    history_path_4 = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    datasources_path_4 = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    orgs_path_1 = DATA_DIR / 'nl_orgs_openaire.xlsx'
-    if not (history_path_4.exists() and datasources_path_4.exists() and orgs_path_1.exists()):
-        print('One or more required files are missing. Run Steps 3, 7, and 8 first.')
+def _(IMG_DIR, etl_data, plt):
+    datasource_latest_1 = etl_data.latest_snapshot()
+    ds_links = etl_data.org_datasource_links()
+    orgs_df_1 = etl_data.orgs()
+    if orgs_df_1 is None or ds_links.empty:
+        print('One or more required artifacts are missing. Run Steps 3, 7, and 8 first.')
+    elif datasource_latest_1.empty:
+        print('No datasource snapshot found for breakdown chart.')
     else:
-        history_df_3 = pd.read_excel(history_path_4)
-        datasources_df_2 = pd.read_excel(datasources_path_4)
-        orgs_df_1 = pd.read_excel(orgs_path_1)
-        numeric_columns_4 = ['Total Research Products', *PRODUCT_TYPE_LABELS.values()]
-        for column_6 in numeric_columns_4:
-            if column_6 in history_df_3.columns:
-                history_df_3[column_6] = pd.to_numeric(history_df_3[column_6], errors='coerce')
-            if column_6 in orgs_df_1.columns:
-                orgs_df_1[column_6] = pd.to_numeric(orgs_df_1[column_6], errors='coerce')
-        history_df_3['date_retrieved'] = pd.to_datetime(history_df_3['date_retrieved'], errors='coerce')
-        latest_date_3 = history_df_3['date_retrieved'].max()
-        datasource_latest_1 = history_df_3[history_df_3['date_retrieved'] == latest_date_3].copy()
-        if datasource_latest_1.empty:
-            print('No datasource snapshot found for breakdown chart.')
-        else:
-            datasource_latest_1['Total Research Products'] = datasource_latest_1['Total Research Products'].fillna(0)
-            ds_with_org = datasources_df_2[['OpenAIRE_DataSource_ID', 'OpenAIRE_ORG_ID', 'Name']].merge(datasource_latest_1[['OpenAIRE_DataSource_ID', 'Total Research Products']], on='OpenAIRE_DataSource_ID', how='left')
-            ds_with_org['Total Research Products'] = ds_with_org['Total Research Products'].fillna(0)
-            orgs_df_1['Total Research Products'] = orgs_df_1['Total Research Products'].fillna(0)
-            records = []
-            zero_datasources: list[str] = []
-            for _, org_row in orgs_df_1.sort_values('Total Research Products', ascending=False).iterrows():
-                org_name = org_row.get('name', 'Unknown organisation')
-                org_id = org_row.get('OpenAIRE_ORG_ID')
-                org_value = float(org_row.get('Total Research Products') or 0)
-                records.append({'label': org_name, 'value': org_value, 'color': '#1f77b4'})
-                org_ds = ds_with_org[ds_with_org['OpenAIRE_ORG_ID'] == org_id]
-                if org_ds.empty:
+        latest_date_3 = datasource_latest_1['date_retrieved'].max()
+        datasource_latest_1['Total Research Products'] = datasource_latest_1['Total Research Products'].fillna(0)
+        ds_with_org = ds_links.merge(datasource_latest_1[['OpenAIRE_DataSource_ID', 'Total Research Products']], on='OpenAIRE_DataSource_ID', how='left')
+        ds_with_org['Total Research Products'] = ds_with_org['Total Research Products'].fillna(0)
+        ds_with_org['Name'] = ds_with_org['Name'].fillna(ds_with_org['OpenAIRE_DataSource_ID'])
+        orgs_df_1['Total Research Products'] = orgs_df_1['Total Research Products'].fillna(0)
+        records = []
+        zero_datasources: list[str] = []
+        for _, org_row in orgs_df_1.sort_values('Total Research Products', ascending=False).iterrows():
+            org_name = org_row.get('name', 'Unknown organisation')
+            org_id = org_row.get('OpenAIRE_ORG_ID')
+            org_value = float(org_row.get('Total Research Products') or 0)
+            records.append({'label': org_name, 'value': org_value, 'color': '#1f77b4'})
+            org_ds = ds_with_org[ds_with_org['OpenAIRE_ORG_ID'] == org_id]
+            if org_ds.empty:
+                continue
+            for _, ds_row in org_ds.sort_values('Total Research Products', ascending=False).iterrows():
+                ds_value = float(ds_row.get('Total Research Products') or 0)
+                ds_name = ds_row.get('Name')
+                if ds_value <= 0:
+                    zero_datasources.append(f'{ds_name} (org: {org_name})')
                     continue
-                for _, ds_row in org_ds.sort_values('Total Research Products', ascending=False).iterrows():
-                    ds_value = float(ds_row.get('Total Research Products') or 0)
-                    ds_name = ds_row.get('Name') or ds_row.get('OpenAIRE_DataSource_ID')
-                    if ds_value <= 0:
-                        zero_datasources.append(f'{ds_name} (org: {org_name})')
-                        continue
-                    label_1 = f'  ↳ {ds_name}'
-                    records.append({'label': label_1, 'value': ds_value, 'color': '#2ca02c'})
-            if zero_datasources:
-                print('Datasources with zero totals (excluded):')
-                for entry in zero_datasources:
-                    print(f' - {entry}')
-            if not records:
-                print('No datapoints available for the breakdown chart.')
-            else:
-                values = [rec['value'] for rec in records]
-                labels = [rec['label'] for rec in records]
-                colors_1 = [rec['color'] for rec in records]
-                fig_height = max(6, 0.4 * len(records))
-                fig_4, ax_4 = plt.subplots(figsize=(14, fig_height))
-                ax_4.barh(range(len(records)), values, color=colors_1)
-                ax_4.set_yticks(range(len(records)))
-                ax_4.set_yticklabels(labels)
-                ax_4.set_xlabel('Total research products')
-                ax_4.set_ylabel('Organisation / Datasource')
-                ax_4.set_title(f'Organisation vs. individual datasource totals (snapshot {latest_date_3.date()})')
-                ax_4.invert_yaxis()
-                fig_4.tight_layout()
-                breakdown_path = IMG_DIR / 'org_vs_datasource_breakdown.png'
-                fig_4.savefig(breakdown_path, dpi=200, bbox_inches='tight')
-                print(f'Saved organisation/datasource breakdown chart to {breakdown_path}')
-                plt.show()
+                label_1 = f'  ↳ {ds_name}'
+                records.append({'label': label_1, 'value': ds_value, 'color': '#2ca02c'})
+        if zero_datasources:
+            print('Datasources with zero totals (excluded):')
+            for entry in zero_datasources:
+                print(f' - {entry}')
+        if not records:
+            print('No datapoints available for the breakdown chart.')
+        else:
+            values = [rec['value'] for rec in records]
+            labels = [rec['label'] for rec in records]
+            colors_1 = [rec['color'] for rec in records]
+            fig_height = max(6, 0.4 * len(records))
+            fig_4, ax_4 = plt.subplots(figsize=(14, fig_height))
+            ax_4.barh(range(len(records)), values, color=colors_1)
+            ax_4.set_yticks(range(len(records)))
+            ax_4.set_yticklabels(labels)
+            ax_4.set_xlabel('Total research products')
+            ax_4.set_ylabel('Organisation / Datasource')
+            ax_4.set_title(f'Organisation vs. individual datasource totals (snapshot {latest_date_3.date()})')
+            ax_4.invert_yaxis()
+            fig_4.tight_layout()
+            breakdown_path = IMG_DIR / 'org_vs_datasource_breakdown.png'
+            fig_4.savefig(breakdown_path, dpi=200, bbox_inches='tight')
+            print(f'Saved organisation/datasource breakdown chart to {breakdown_path}')
+            plt.show()
     return
 
 
@@ -1156,17 +4154,20 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, requests):
+def _(DATA_DIR, cassette, requests):
     CURATED_OAI_URL = (
         "https://docs.google.com/spreadsheets/d/e/"
         "2PACX-1vQwM24DIUWmqbjxaAy62w9w8gNpOMSg5sxmFro-OexCeMzIlyUJh5iVVsVxyrcLkQ/pub?output=xlsx"
     )
     curated_path = DATA_DIR / "curated_oai_endpoints.xlsx"
 
-    response = requests.get(CURATED_OAI_URL, timeout=30)
-    response.raise_for_status()
-    curated_path.write_bytes(response.content)
-    print(f"Saved curated OAI endpoints to {curated_path}")
+    if cassette.replaying and curated_path.exists():
+        print(f"Replay mode: using the existing {curated_path}")
+    else:
+        response = requests.get(CURATED_OAI_URL, timeout=30)
+        response.raise_for_status()
+        curated_path.write_bytes(response.content)
+        print(f"Saved curated OAI endpoints to {curated_path}")
     return
 
 
@@ -1180,46 +4181,19 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, pd):
-    import ast
+def _(DATA_DIR, clean_endpoint, pd, read_artifact, write_artifact):
     curated_path_1 = DATA_DIR / 'curated_oai_endpoints.xlsx'
-    datasources_path_5 = DATA_DIR / 'nl_orgs_openaire_datasources.xlsx'
-    output_path_1 = DATA_DIR / 'nl_orgs_openaire_datasources_with_endpoint.xlsx'
+    output_name_1 = 'nl_orgs_openaire_datasources_with_endpoint'
     if not curated_path_1.exists():
         raise FileNotFoundError(f'Missing curated endpoint workbook: {curated_path_1}. Run step 14 first.')
-    if not datasources_path_5.exists():
-        raise FileNotFoundError(f'Missing datasource export: {datasources_path_5}. Run step 7 first.')
-    datasources_df_3 = pd.read_excel(datasources_path_5)
+    datasources_df_3 = read_artifact('nl_orgs_openaire_datasources')
+    if datasources_df_3 is None:
+        raise FileNotFoundError('Missing datasource artifact nl_orgs_openaire_datasources. Run step 7 first.')
     curated_df = pd.read_excel(curated_path_1)
 
     def normalize_id(value):
         return str(value).strip() if pd.notna(value) else None
 
-    def clean_endpoint(value):
-        if not isinstance(value, str):
-            return None
-        text = value.strip()
-        if not text:
-            return None
-        if text.startswith('[') and text.endswith(']'):
-            try:
-                parsed = ast.literal_eval(text)
-                if isinstance(parsed, (list, tuple)) and parsed:
-                    text = '' if parsed[0] is None else str(parsed[0])
-                elif isinstance(parsed, str):
-                    text = parsed
-                else:
-                    text = ''
-            except Exception:
-                text = text.strip('[]')
-        text = text.strip().strip('"\'[]')
-        if not text:
-            return None
-        if text.startswith('//'):
-            text = f'https:{text}'
-        elif not text.startswith(('http://', 'https://')):
-            text = f'https://{text}'
-        return text
     id_col = 'OpenAIRE_DataSource_ID'
     if id_col not in curated_df.columns:
         raise ValueError('Curated workbook missing OpenAIRE_DataSource_ID column')
@@ -1247,8 +4221,8 @@ def _(DATA_DIR, pd):
         print('  No endpoints were updated.')
     else:
         print(debug_examples.to_string(index=False))
-    datasources_df_3.to_excel(output_path_1, index=False)
-    print(f'Updated {updated_mask.sum()} datasource endpoints using curated sheet; saved to {output_path_1}')
+    write_artifact(output_name_1, datasources_df_3)
+    print(f'Updated {updated_mask.sum()} datasource endpoints using curated sheet; saved to {output_name_1}')
     return
 
 
@@ -1262,23 +4236,28 @@ def _(mo):
 
 
 @app.cell
-def _(
-    API_USER_AGENT,
+async def _(
     Any,
-    DATA_DIR,
-    ThreadPoolExecutor,
-    as_completed,
+    OaiProbeEngine,
+    Optional,
+    asyncio,
+    canonical_endpoint,
+    cassette,
+    json,
+    log_circuit_breakers,
+    log_rate_limits,
+    oai_probe_store,
     pd,
-    requests,
+    read_artifact,
+    run_metrics,
+    time,
     tqdm,
+    write_artifact,
 ):
-    import xml.etree.ElementTree as ET
-    from urllib.parse import urlparse
-    datasources_with_endpoint_path = DATA_DIR / 'nl_orgs_openaire_datasources_with_endpoint.xlsx'
-    metrics_output_path = DATA_DIR / 'nl_orgs_openaire_datasources_with_endpoint_metrics.xlsx'
-    if not datasources_with_endpoint_path.exists():
-        raise FileNotFoundError(f'Missing endpoint-enriched datasources file: {datasources_with_endpoint_path}. Run step 15 first.')
-    metrics_df = pd.read_excel(datasources_with_endpoint_path)
+    metrics_output_name = 'nl_orgs_openaire_datasources_with_endpoint_metrics'
+    metrics_df = read_artifact('nl_orgs_openaire_datasources_with_endpoint')
+    if metrics_df is None:
+        raise FileNotFoundError('Missing endpoint-enriched datasources artifact nl_orgs_openaire_datasources_with_endpoint. Run step 15 first.')
     if 'OpenAIRE_DataSource_ID' not in metrics_df.columns:
         raise ValueError('Input file missing OpenAIRE_DataSource_ID column.')
     detection_columns = {'detected_support_nl_didl': {'nl_didl'}, 'detected_support_oai_dc': {'oai_dc'}, 'detected_support_oai_openaire': {'oai_openaire'}, 'detected_support_rioxx': {'rioxx', 'rioxxv2'}, 'detected_support_oai_cerif_openaire': {'cerif_openaire', 'oai_cerif_openaire'}, 'detected_support_openaire_data': {'oai_datacite', 'datacite', 'oai_openaire_data', 'openaire_data'}}
@@ -1288,90 +4267,168 @@ def _(
     metrics_df['oai_error'] = pd.NA
     metrics_df['metadata_prefixes_detected'] = pd.NA
     metrics_df['oai_tested_at_utc'] = pd.NA
+    metrics_df['oai_base_url'] = pd.NA
+    # Rows whose endpoints differ only in scheme, trailing slash, default port or `?verb=` share one probe
+    metrics_df['oai_endpoint_canonical'] = metrics_df['OAI-endpoint'].map(canonical_endpoint).astype('object')
+    endpoint_rows = {endpoint: list(rows) for endpoint, rows in metrics_df.groupby('oai_endpoint_canonical', dropna=True, sort=False).groups.items()}
 
-    def normalise_endpoint(url: str) -> list[str]:
-        if not isinstance(url, str):
-            return []
-        raw = url.strip()
-        if not raw:
-            return []
-        candidates = []
-        parsed = urlparse(raw)
-        if parsed.scheme:
-            candidates.append(raw)
-            if parsed.scheme == 'http':
-                candidates.append(raw.replace('http://', 'https://', 1))
-        else:
-            candidates.append(f'https://{raw}')
-            candidates.append(f'http://{raw}')
-        seen: list[str] = []
-        for cand in candidates:
-            if cand not in seen:
-                seen.append(cand)
-        return seen
-
-    def build_oai_url(base: str, verb: str='ListMetadataFormats') -> str:
-        if base.endswith('?') or base.endswith('&'):
-            return f'{base}verb={verb}'
-        return f'{base}&verb={verb}' if '?' in base else f'{base}?verb={verb}'
+    stored_results = oai_probe_store.latest()
 
-    def parse_metadata_formats(xml_bytes: bytes) -> tuple[list[str], str | None]:
-        try:
-            root = ET.fromstring(xml_bytes)
-        except ET.ParseError as exc:
-            return ([], f'XML parse error: {exc}')
-        ns = {'oai': 'http://www.openarchives.org/OAI/2.0/'}
-        prefixes = [(el.text or '').strip().lower() for el in root.findall('.//oai:metadataPrefix', namespaces=ns) if (el.text or '').strip()]
-        if prefixes:
-            return (prefixes, None)
-        errors = root.findall('.//oai:error', namespaces=ns)
-        if errors:
-            messages = [f"{err.get('code', 'error')}: {(err.text or '').strip()}" for err in errors]
-            return ([], '; '.join(messages))
-        return ([], 'No metadataPrefix elements returned')
-
-    def test_endpoint(endpoint: str) -> dict[str, Any]:
-        result = {'oai_status': 'missing_endpoint' if not endpoint else 'error', 'oai_error': None, 'metadata_prefixes_detected': None}
-        prefix_flags = {column: False for column in detection_columns.keys()}
-        if not endpoint:
-            result.update(prefix_flags)
-            return result
-        prefixes: list[str] = []
-        errors: list[str] = []
-        for candidate in normalise_endpoint(endpoint):
-            url = build_oai_url(candidate)
-            try:
-                resp = requests.get(url, timeout=25, headers={'User-Agent': API_USER_AGENT})
-                resp.raise_for_status()
-            except Exception as exc:
-                errors.append(f'{candidate}: {exc}')
-                continue
-            prefixes, error = parse_metadata_formats(resp.content)
-            if prefixes:
-                result['oai_status'] = 'ok'
-                errors = []
-                break
-            if error:
-                errors.append(f'{candidate}: {error}')
-        if prefixes:
-            detected_str = ', '.join(sorted(set(prefixes)))
-            result['metadata_prefixes_detected'] = detected_str
-            for column, required in detection_columns.items():
-                prefix_flags[column] = any((prefix in required for prefix in prefixes))
-        else:
-            result['oai_error'] = '; '.join(errors) if errors else 'Unknown error'
-        result.update(prefix_flags)
+    def build_result(status: str, prefixes: list[str], error: Optional[str], base_url: Optional[str] = None) -> dict[str, Any]:
+        result = {'oai_status': status, 'oai_error': error, 'metadata_prefixes_detected': ', '.join(sorted(set(prefixes))) if prefixes else None, 'oai_base_url': base_url}
+        for column, required in detection_columns.items():
+            result[column] = any((prefix in required for prefix in prefixes))
         return result
-    with ThreadPoolExecutor(max_workers=6) as executor_3:
-        futures_3 = {executor_3.submit(test_endpoint, row.get('OAI-endpoint')): idx for idx, row in metrics_df.iterrows()}
-        for future_3 in tqdm(as_completed(futures_3), total=len(futures_3), desc='Testing OAI endpoints', unit='datasource'):
-            idx_2 = futures_3[future_3]
-            outcome = future_3.result()
-            for key, value in outcome.items():
+
+    def assign_result(rows, result: dict[str, Any], tested_at: float) -> None:
+        tested_at_utc = pd.Timestamp(tested_at, unit='s', tz='UTC').isoformat()
+        for idx_2 in rows:
+            for key, value in result.items():
                 metrics_df.at[idx_2, key] = value
-            metrics_df.at[idx_2, 'oai_tested_at_utc'] = pd.Timestamp.utcnow().isoformat()
-    metrics_df.to_excel(metrics_output_path, index=False)
-    print(f'Saved OAI endpoint diagnostics for {len(metrics_df)} datasources to {metrics_output_path}')
+            metrics_df.at[idx_2, 'oai_tested_at_utc'] = tested_at_utc
+
+    async def test_endpoint(engine: OaiProbeEngine, endpoint: str) -> tuple[str, dict[str, Any], float, bool]:
+        previous = stored_results.get(endpoint)
+        probe_started = time.perf_counter()
+        outcome = await engine.probe(endpoint, previous)
+        seconds = time.perf_counter() - probe_started
+        if outcome['not_modified']:
+            # A 304 confirms the stored answer, validators included
+            status, error = previous['status'], previous['error']
+            outcome.update(prefixes=json.loads(previous['prefixes'] or '[]'), etag=previous['etag'], last_modified=previous['last_modified'])
+        elif outcome['prefixes']:
+            status, error = 'ok', None
+        else:
+            status, error = 'error', '; '.join(outcome['errors']) or 'Unknown error'
+        run_metrics.observe('oai_probe_seconds', seconds, status=status)
+        run_metrics.count('oai_probes_total', status=status)
+        if outcome['not_modified']:
+            run_metrics.count('oai_not_modified_total')
+        tested_at = oai_probe_store.record(endpoint, status, error, outcome['prefixes'], outcome, seconds)
+        return (endpoint, build_result(status, outcome['prefixes'], error, outcome['candidate']), tested_at, outcome['not_modified'])
+    missing_endpoint = metrics_df['oai_endpoint_canonical'].isna()
+    assign_result(metrics_df.index[missing_endpoint], build_result('missing_endpoint', [], None), time.time())
+    fresh_endpoints = {endpoint for endpoint in endpoint_rows if oai_probe_store.is_fresh(stored_results.get(endpoint))}
+    for endpoint in fresh_endpoints:
+        stored = stored_results[endpoint]
+        assign_result(endpoint_rows[endpoint], build_result(stored['status'], json.loads(stored['prefixes'] or '[]'), stored['error'], stored['candidate']), stored['tested_at'])
+    endpoints_to_probe = [endpoint for endpoint in endpoint_rows if endpoint not in fresh_endpoints]
+    print(
+        f'{len(endpoint_rows)} distinct endpoints for {int((~missing_endpoint).sum())} datasources ({int(missing_endpoint.sum())} without an endpoint); '
+        f'{len(fresh_endpoints)} answered within the last {oai_probe_store.fresh_for / 3600:g}h, probing {len(endpoints_to_probe)}'
+    )
+    probes_started = time.perf_counter()
+    not_modified_count = 0
+    async with OaiProbeEngine() as probe_engine:
+        probe_tasks = [test_endpoint(probe_engine, endpoint) for endpoint in endpoints_to_probe]
+        for finished_probe in tqdm(asyncio.as_completed(probe_tasks), total=len(probe_tasks), desc='Testing OAI endpoints', unit='endpoint'):
+            endpoint, outcome, tested_at, not_modified = await finished_probe
+            assign_result(endpoint_rows[endpoint], outcome, tested_at)
+            not_modified_count = not_modified_count + not_modified
+    oai_probe_store.commit()
+    print(f'Probed {len(probe_tasks)} endpoints in {time.perf_counter() - probes_started:.1f}s ({not_modified_count} answered 304 Not Modified)')
+    endpoint_uptime = oai_probe_store.uptime(days=30).set_index('endpoint')['uptime']
+    metrics_df['oai_uptime_30d'] = metrics_df['oai_endpoint_canonical'].map(endpoint_uptime)
+    log_rate_limits()
+    log_circuit_breakers()
+    run_metrics.write()
+    if cassette.active:
+        print(cassette.summary())
+        cassette.flush()
+    write_artifact(metrics_output_name, metrics_df)
+    print(f'Saved OAI endpoint diagnostics for {len(metrics_df)} datasources to {metrics_output_name}')
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## 16a. Harvest OAI-PMH records and compare with numFound
+    Harvest the record headers of every endpoint that passed step 16, incrementally after the first run, and compare how many records each endpoint exposes with the data source's total research products in the latest numFound snapshot. Harvesting only runs with `--harvest`; `--harvest-records` harvests full `ListRecords` instead of headers. Without `--harvest` the comparison is rebuilt from the harvests already stored in `data/oai_harvest/`.
+    """)
+    return
+
+
+@app.cell
+async def _(
+    OaiProbeEngine,
+    Optional,
+    asyncio,
+    cassette,
+    etl_data,
+    etl_flag,
+    harvest_endpoint,
+    log_circuit_breakers,
+    log_rate_limits,
+    open_oai_harvest_store,
+    pd,
+    run_metrics,
+    time,
+    tqdm,
+    write_artifact,
+):
+    harvest_output_name = 'nl_orgs_oai_harvest_counts'
+    harvest_sources_df = etl_data.endpoint_metrics()
+    if harvest_sources_df is None:
+        raise FileNotFoundError('Missing OAI diagnostics artifact nl_orgs_openaire_datasources_with_endpoint_metrics. Run step 16 first.')
+    if 'oai_base_url' not in harvest_sources_df.columns:
+        print('The endpoint metrics predate the oai_base_url column; run step 16 again to harvest its endpoints.')
+        harvest_sources_df['oai_base_url'] = pd.NA
+    harvest_verb = 'ListRecords' if etl_flag('harvest-records') else 'ListIdentifiers'
+
+    def harvest_prefix(prefixes) -> Optional[str]:
+        """oai_dc, which every OAI-PMH endpoint must support, or else the first advertised prefix."""
+        detected = [prefix.strip() for prefix in prefixes.split(',') if prefix.strip()] if isinstance(prefixes, str) else []
+        return 'oai_dc' if 'oai_dc' in detected else (detected[0] if detected else None)
+    harvest_targets: dict[str, tuple[str, str]] = {}
+    harvestable = harvest_sources_df[(harvest_sources_df['oai_status'] == 'ok') & harvest_sources_df['oai_base_url'].notna()]
+    for _endpoint, _base_url, _prefixes in zip(harvestable['oai_endpoint_canonical'], harvestable['oai_base_url'], harvestable['metadata_prefixes_detected']):
+        _prefix = harvest_prefix(_prefixes)
+        if _prefix and _endpoint not in harvest_targets:
+            harvest_targets[_endpoint] = (_base_url, _prefix)
+    oai_harvest_store = open_oai_harvest_store(create=etl_flag('harvest'))
+    if etl_flag('harvest'):
+        print(f'Harvesting {harvest_verb} from {len(harvest_targets)} endpoints into {oai_harvest_store.root}')
+        harvests_started = time.perf_counter()
+        harvest_summaries = []
+        async with OaiProbeEngine() as harvest_engine:
+            harvest_tasks = [harvest_endpoint(harvest_engine, oai_harvest_store, endpoint, base_url, prefix, harvest_verb) for endpoint, (base_url, prefix) in harvest_targets.items()]
+            for finished_harvest in tqdm(asyncio.as_completed(harvest_tasks), total=len(harvest_tasks), desc='Harvesting OAI endpoints', unit='endpoint'):
+                harvest_summaries.append(await finished_harvest)
+        incremental_count = sum((summary['from_date'] is not None for summary in harvest_summaries))
+        failed_count = sum((summary['status'] != 'complete' for summary in harvest_summaries))
+        header_count = sum((summary['headers'] for summary in harvest_summaries))
+        print(
+            f'Harvested {len(harvest_summaries)} endpoints in {time.perf_counter() - harvests_started:.1f}s '
+            f'({incremental_count} incremental, {failed_count} failed); wrote {header_count:,} headers'
+        )
+        log_rate_limits()
+        log_circuit_breakers()
+        run_metrics.write()
+        if cassette.active:
+            print(cassette.summary())
+            cassette.flush()
+    elif oai_harvest_store is None:
+        print(f'OAI harvest skipped; pass --harvest to harvest {len(harvest_targets)} endpoints. No harvests are stored yet.')
+    else:
+        print(f'OAI harvest skipped; pass --harvest to harvest {len(harvest_targets)} endpoints. Comparing the harvests stored in {oai_harvest_store.root}.')
+    if oai_harvest_store is None:
+        harvest_counts = pd.DataFrame(columns=['oai_endpoint_canonical', 'oai_records'])
+    else:
+        harvest_counts = oai_harvest_store.counts().rename(columns={'endpoint': 'oai_endpoint_canonical'})
+        oai_harvest_store.close()
+    graph_totals = etl_data.latest_snapshot()[['OpenAIRE_DataSource_ID', 'Total Research Products']]
+    harvest_df = harvest_sources_df[['OpenAIRE_DataSource_ID', 'Name', 'oai_endpoint_canonical', 'oai_status']]
+    harvest_df = harvest_df.merge(harvest_counts, on='oai_endpoint_canonical', how='left').merge(graph_totals, on='OpenAIRE_DataSource_ID', how='left')
+    # Data sources that share an endpoint are each compared with all of its records
+    harvest_df['oai_records_vs_numfound'] = harvest_df['oai_records'] / harvest_df['Total Research Products'].where(harvest_df['Total Research Products'] > 0)
+    harvest_df = write_artifact(harvest_output_name, harvest_df)
+    compared = harvest_df.dropna(subset=['oai_records_vs_numfound'])
+    print(f'Saved OAI record counts for {harvest_df["oai_records"].notna().sum()} of {len(harvest_df)} datasources to {harvest_output_name}')
+    if not compared.empty:
+        print(f'Median OAI records / numFound over {len(compared)} datasources: {compared["oai_records_vs_numfound"].median():.2f}')
+        widest = compared.assign(gap=(compared['oai_records_vs_numfound'] - 1).abs()).nlargest(10, 'gap')
+        print(widest[['Name', 'oai_records', 'Total Research Products', 'oai_records_vs_numfound']].to_string(index=False))
     return
 
 
@@ -1385,11 +4442,10 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, IMG_DIR, display, pd, plt):
-    metrics_path = DATA_DIR / 'nl_orgs_openaire_datasources_with_endpoint_metrics.xlsx'
-    if not metrics_path.exists():
-        raise FileNotFoundError(f'Missing OAI diagnostics: {metrics_path}. Run step 16 first.')
-    metrics_df_1 = pd.read_excel(metrics_path)
+def _(IMG_DIR, display, etl_data, pd, plt):
+    metrics_df_1 = etl_data.endpoint_metrics()
+    if metrics_df_1 is None:
+        raise FileNotFoundError('Missing OAI diagnostics artifact nl_orgs_openaire_datasources_with_endpoint_metrics. Run step 16 first.')
 
     def is_blank(series: pd.Series) -> pd.Series:
         text = series.astype(str).str.strip().str.lower()
@@ -1412,11 +4468,11 @@ def _(DATA_DIR, IMG_DIR, display, pd, plt):
     cris_mask = type_series_1.str.contains('cris', case=False, na=False)
     literature_mask = type_series_1.str.contains('literature|institutional', case=False, na=False)
     data_mask = type_series_1.str.contains('data repository', case=False, na=False)
-    cris_cerif = (cris_mask & metrics_df_1.get('detected_support_oai_cerif_openaire', False).astype(bool)).sum()
-    literature_openaire = (literature_mask & metrics_df_1.get('detected_support_oai_openaire', False).astype(bool)).sum()
-    data_openaire = (data_mask & metrics_df_1.get('detected_support_openaire_data', False).astype(bool)).sum()
-    nl_didl = metrics_df_1.get('detected_support_nl_didl', False).astype(bool).sum()
-    rioxx = metrics_df_1.get('detected_support_rioxx', False).astype(bool).sum()
+    cris_cerif = (cris_mask & metrics_df_1['detected_support_oai_cerif_openaire'].fillna(False).astype(bool)).sum()
+    literature_openaire = (literature_mask & metrics_df_1['detected_support_oai_openaire'].fillna(False).astype(bool)).sum()
+    data_openaire = (data_mask & metrics_df_1['detected_support_openaire_data'].fillna(False).astype(bool)).sum()
+    nl_didl = metrics_df_1['detected_support_nl_didl'].fillna(False).astype(bool).sum()
+    rioxx = metrics_df_1['detected_support_rioxx'].fillna(False).astype(bool).sum()
     summary = pd.DataFrame({'metric': ['Endpoints available', 'OAI test passed', 'OAI test failed', 'Indexed by OpenAIRE', 'CRIS endpoints w/ CERIF', 'Literature endpoints w/ OpenAIRE', 'Data endpoints w/ OpenAIRE data', 'Endpoints w/ NL DIDL', 'Endpoints w/ RIOXX'], 'count': [total_endpoints, passed, failed, indexed, cris_cerif, literature_openaire, data_openaire, nl_didl, rioxx]})
     display(summary)
     summary_chart_path = IMG_DIR / 'oai_endpoint_summary.png'
@@ -1463,27 +4519,24 @@ def _(mo):
 
 
 @app.cell
-def _(DATA_DIR, pd):
+def _(etl_data, write_artifact):
     from IPython.display import HTML, display
     OPENAIRE_ORG_URL = 'https://explore.openaire.eu/search/organization?organizationId='
     OPENAIRE_DATASOURCE_URL = 'https://explore.openaire.eu/search/dataprovider?datasourceId='
-    orgs_path_2 = DATA_DIR / 'nl_orgs_openaire.xlsx'
-    history_path_5 = DATA_DIR / 'nl_orgs_openaire_datasources_numFound_history.xlsx'
-    metrics_path_1 = DATA_DIR / 'nl_orgs_openaire_datasources_with_endpoint_metrics.xlsx'
-    print(f'Loading organisations from {orgs_path_2} ...')
-    orgs_df_2 = pd.read_excel(orgs_path_2)[['OpenAIRE_ORG_ID', 'name']].rename(columns={'name': 'Organisation'})
+    print('Loading organisations ...')
+    orgs_df_2 = etl_data.orgs()[['OpenAIRE_ORG_ID', 'name']].rename(columns={'name': 'Organisation'})
     print(f'Loaded {len(orgs_df_2)} organisation rows')
-    print(f'Loading datasource history from {history_path_5} ...')
-    history_df_4 = pd.read_excel(history_path_5)
-    print(f'Loaded history with {len(history_df_4)} rows')
-    print(f'Loading endpoint metrics from {metrics_path_1} ...')
-    metrics_df_2 = pd.read_excel(metrics_path_1)
+    print('Loading latest datasource snapshot ...')
+    history_df_4 = etl_data.latest_snapshot()
+    print(f'Loaded latest snapshot with {len(history_df_4)} rows')
+    print('Loading endpoint metrics ...')
+    metrics_df_2 = etl_data.endpoint_metrics()
     print(f'Loaded metrics with {len(metrics_df_2)} rows')
     if history_df_4.empty:
-        raise ValueError('History workbook is empty; run the snapshot steps first.')
-    latest_date_4 = history_df_4['date_retrieved'].max()
+        raise ValueError('History store is empty; run the snapshot steps first.')
+    latest_date_4 = history_df_4['date_retrieved'].max().date().isoformat()
     print(f'Latest snapshot date detected: {latest_date_4}')
-    latest_snapshot = history_df_4[history_df_4['date_retrieved'] == latest_date_4].copy()
+    latest_snapshot = history_df_4
     print(f'Latest snapshot records: {len(latest_snapshot)}')
     value_cols = ['Total Research Products', 'Publications', 'Research data', 'Research software', 'Other research products']
     latest_snapshot = latest_snapshot[['OpenAIRE_DataSource_ID', *value_cols, 'date_retrieved']]
@@ -1501,14 +4554,15 @@ def _(DATA_DIR, pd):
     dashboard_df['Latest Snapshot Date'] = latest_date_4
     org_totals_1 = dashboard_df.groupby('Organisation Name')['Total Research Products'].sum(min_count=1).fillna(0)
     dashboard_df['Total Research Products by Affiliation'] = dashboard_df['Organisation Name'].map(org_totals_1).fillna(0)
-    dashboard_export_path = DATA_DIR / 'nl_orgs_dashboard_data.xlsx'
+    dashboard_export_name = 'nl_orgs_dashboard_data'
     export_columns = ['Organisation Name', 'Organisation', 'OpenAIRE_ORG_ID', 'Datasource Name', 'OpenAIRE_DataSource_ID', 'OpenAIRE Compatibility', 'Type', 'oai_status', 'OAI-endpoint', 'metadata_prefixes_detected', 'Total Research Products', 'Publications', 'Research data', 'Research software', 'Other research products', 'detected_support_oai_cerif_openaire', 'detected_support_oai_openaire', 'detected_support_openaire_data', 'detected_support_nl_didl', 'detected_support_rioxx', 'has_endpoint', 'Latest Snapshot Date', 'Total Research Products by Affiliation']
     missing_cols = [col for col in export_columns if col not in dashboard_df.columns]
     if missing_cols:
         raise KeyError(f'Missing expected columns for dashboard export: {missing_cols}')
-    print(f'Writing dashboard export to {dashboard_export_path} ...')
-    dashboard_df[export_columns].to_excel(dashboard_export_path, index=False)
+    print(f'Writing dashboard export {dashboard_export_name} ...')
+    write_artifact(dashboard_export_name, dashboard_df[export_columns])
     print('Dashboard export complete.')
+    print(etl_data.summary())
     display(HTML('\n        <p>\n            Dashboard data exported to <code>data/nl_orgs_dashboard_data.xlsx</code>.<br>\n            Launch the Streamlit dashboard via <code>streamlit run streamlit_app.py</code>.<br>\n            Ensure this notebook cell is rerun whenever new snapshots are captured so the app reflects the latest data.\n        </p>\n        '))
     return (display,)
 
@@ -1531,11 +4585,10 @@ def _(mo):
 
 
 @app.cell
-def _():
+def _(DATA_DIR):
     import duckdb
-    import pathlib
 
-    DUCKDB_PATH = pathlib.Path("data/ducklake.duckdb")   # <-- new file, never overwrites anything
+    DUCKDB_PATH = DATA_DIR / "ducklake.duckdb"   # <-- new file, never overwrites anything
     con = duckdb.connect(DUCKDB_PATH)
     return (con,)
 
@@ -1556,9 +4609,12 @@ def _(con):
         org_id VARCHAR PRIMARY KEY,
         name VARCHAR,
         country VARCHAR,
-        type VARCHAR
+        type VARCHAR,
+        total_research_products BIGINT
       )
     """)
+    # Databases created before the organisation totals were loaded
+    con.execute("ALTER TABLE orgs ADD COLUMN IF NOT EXISTS total_research_products BIGINT")
 
     # 2️⃣ datasources
     con.execute("""
@@ -1571,6 +4627,15 @@ def _(con):
       )
     """)
 
+    # A datasource can belong to several organisations; datasources.org_id only keeps the first link
+    con.execute("""
+      CREATE TABLE IF NOT EXISTS org_datasources (
+        org_id VARCHAR,
+        ds_id VARCHAR,
+        PRIMARY KEY (org_id, ds_id)
+      )
+    """)
+
     # 3️⃣ snapshot
     con.execute("""
       CREATE TABLE IF NOT EXISTS snapshot (
@@ -1607,90 +4672,103 @@ def _(con):
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
-    Insert the data from your Excel files.
+    Load the pipeline artifacts. Dimension tables are upserted on their primary keys, and only snapshot dates from the newest loaded one onwards are read from the history store. Rows that left an artifact stay in the database unless `--prune` is passed, because a rerun of one stage cannot tell a removed row from one it failed to fetch. The whole load runs in one transaction and reports its time per table.
     """)
     return
 
 
 @app.cell
-def _(DATA_DIR, con, pd):
-    # read Excel into Pandas (you already have the files in `data/`)
-    df_orgs = pd.read_excel(DATA_DIR / "nl_orgs_openaire.xlsx")
-    df_ds   = pd.read_excel(DATA_DIR / "nl_orgs_openaire_datasources.xlsx")
-    df_snap = pd.read_excel(DATA_DIR / "nl_orgs_openaire_datasources_numFound_history.xlsx")
-    df_end  = pd.read_excel(DATA_DIR / "nl_orgs_openaire_datasources_with_endpoint_metrics.xlsx")
-
-    # keep column names same as table schema
-    # orgs
-    df_orgs_clean = df_orgs.rename(columns={"OpenAIRE_ORG_ID": "org_id"}).copy()
-    if "country" not in df_orgs_clean:
-        df_orgs_clean["country"] = pd.NA
-    if "Type" in df_orgs_clean:
-        df_orgs_clean["type"] = df_orgs_clean["Type"]
-    elif "type" not in df_orgs_clean:
-        df_orgs_clean["type"] = pd.NA
-    df_orgs_clean = df_orgs_clean[["org_id", "name", "country", "type"]]
-    df_orgs_clean = df_orgs_clean[df_orgs_clean["org_id"].fillna("").astype(str).str.strip() != ""]
-    df_orgs_clean = df_orgs_clean.drop_duplicates(subset=["org_id"])
-
-    con.execute("DELETE FROM orgs")  # keep DB up‑to‑date on re‑run
-    con.register("orgs_df", df_orgs_clean)
-    con.execute("INSERT INTO orgs SELECT * FROM orgs_df")
-
-    # datasources
-    df_ds_clean = df_ds.rename(columns={
-        "OpenAIRE_DataSource_ID": "ds_id",
-        "OpenAIRE_ORG_ID": "org_id",
-        "Name": "name",
-        "Type": "type",
-        "OAI-endpoint": "oai_endpoint"
-    })[['ds_id','org_id','name','type','oai_endpoint']]
-    df_ds_clean = df_ds_clean[df_ds_clean["ds_id"].fillna("").astype(str).str.strip() != ""]
-    df_ds_clean = df_ds_clean.drop_duplicates(subset=["ds_id"])
-    con.execute("DELETE FROM datasources")
-    con.register("ds_df", df_ds_clean)
-    con.execute("INSERT INTO datasources SELECT * FROM ds_df")
-
-    # snapshot (flatten columns)
-    df_snap_clean = df_snap.rename(columns={
-        "OpenAIRE_DataSource_ID": "ds_id",
-        "Total Research Products": "totals",
-        "Publications": "publications",
-        "Research data": "research_data",
-        "Research software": "research_software",
-        "Other research products": "other_products",
-        "date_retrieved": "snapshot_date"
-    })[['ds_id','totals','publications','research_data',
-         'research_software','other_products','snapshot_date']]
-    df_snap_clean = df_snap_clean[df_snap_clean["ds_id"].fillna("").astype(str).str.strip() != ""]
-    df_snap_clean = df_snap_clean.drop_duplicates(subset=["ds_id", "snapshot_date"])
-    con.execute("DELETE FROM snapshot")
-    con.register("snap_df", df_snap_clean)
-    con.execute("INSERT INTO snapshot SELECT * FROM snap_df")
-
-    # endpoint metrics
-    df_end_clean = df_end.rename(columns={
-        "OpenAIRE_DataSource_ID": "ds_id",
-        "oai_status": "oai_status",
-        "metadata_prefixes_detected": "metadata_prefixes_detected",
-        "openaireCompatibility": "openaire_compatibility",
-        "detected_support_oai_cerif_openaire": "detected_support_oai_cerif_openaire",
-        "detected_support_oai_openaire": "detected_support_oai_openaire",
-        "detected_support_openaire_data": "detected_support_openaire_data",
-        "detected_support_nl_didl": "detected_support_nl_didl",
-        "detected_support_rioxx": "detected_support_rioxx",
-        "OAI-endpoint": "oai_endpoint"
-    })
-    df_end_clean['has_endpoint'] = df_end_clean['oai_endpoint'].astype(str).str.strip() != ''
-    df_end_clean = df_end_clean.drop_duplicates(subset=["ds_id"])
-    df_end_clean = df_end_clean[['ds_id','oai_status','metadata_prefixes_detected',
-        'openaire_compatibility','detected_support_oai_cerif_openaire',
-        'detected_support_oai_openaire','detected_support_openaire_data',
-        'detected_support_nl_didl','detected_support_rioxx',
-        'has_endpoint']]
-    con.execute("DELETE FROM endpoint_metrics")
-    con.register("end_df", df_end_clean)
-    con.execute("INSERT INTO endpoint_metrics SELECT * FROM end_df")
+def _(artifact_path, con, etl_flag, numfound_history, read_artifact, time):
+    # Load the stage artifacts straight from Parquet into DuckDB, upserting on the primary keys in one transaction
+    def sql_literal(value: str) -> str:
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def artifact_relation(name: str):
+        """FROM clause for an artifact: a Parquet scan, or the legacy workbook registered as a frame."""
+        path = artifact_path(name)
+        if path.exists():
+            return f"read_parquet({sql_literal(path)})"
+        frame = read_artifact(name)
+        if frame is None:
+            return None
+        con.register(f"{name}_frame", frame)
+        return f'"{name}_frame"'
+
+    dimension_loads = {
+        # table: (primary key columns, artifact, SELECT list in table column order, which row wins for a duplicate key)
+        "orgs": (
+            ("org_id",),
+            "nl_orgs_openaire",
+            '"OpenAIRE_ORG_ID" AS org_id, name, NULL::VARCHAR AS country, NULL::VARCHAR AS type, "Total Research Products" AS total_research_products',
+            "name, total_research_products DESC NULLS LAST",
+        ),
+        "datasources": (
+            ("ds_id",),
+            "nl_orgs_openaire_datasources",
+            '"OpenAIRE_DataSource_ID" AS ds_id, "OpenAIRE_ORG_ID" AS org_id, "Name" AS name, "Type" AS type, "OAI-endpoint" AS oai_endpoint',
+            # A data source linked to several organisations keeps the same org_id on every run
+            "org_id NULLS LAST, name, oai_endpoint",
+        ),
+        "org_datasources": (("org_id", "ds_id"), "nl_orgs_openaire_datasources", '"OpenAIRE_ORG_ID" AS org_id, "OpenAIRE_DataSource_ID" AS ds_id', "org_id, ds_id"),
+        "endpoint_metrics": (
+            ("ds_id",),
+            "nl_orgs_openaire_datasources_with_endpoint_metrics",
+            '"OpenAIRE_DataSource_ID" AS ds_id, oai_status, metadata_prefixes_detected, "openaireCompatibility" AS openaire_compatibility, '
+            "detected_support_oai_cerif_openaire, detected_support_oai_openaire, detected_support_openaire_data, detected_support_nl_didl, detected_support_rioxx, "
+            """coalesce(trim("OAI-endpoint"), '') <> '' AS has_endpoint""",
+            "oai_status, metadata_prefixes_detected, openaire_compatibility",
+        ),
+    }
+    load_timings: list[tuple[str, int, float]] = []
+    con.begin()
+    try:
+        for table, (key_columns, artifact_name, select_list, tie_break) in dimension_loads.items():
+            started = time.perf_counter()
+            relation = artifact_relation(artifact_name)
+            if relation is None:
+                print(f"Skipping {table}: artifact {artifact_name} not found.")
+                continue
+            key_list = ", ".join(key_columns)
+            keys_present = " AND ".join(f"coalesce(trim({key}), '') <> ''" for key in key_columns)
+            keys_match = " AND ".join(f"staged.{key} = {table}.{key}" for key in key_columns)
+            con.execute(
+                f"CREATE OR REPLACE TEMP TABLE staged_{table} AS SELECT * FROM (SELECT {select_list} FROM {relation}) "
+                f"WHERE {keys_present} QUALIFY row_number() OVER (PARTITION BY {key_list} ORDER BY {tie_break}) = 1"
+            )
+            con.execute(f"INSERT OR REPLACE INTO {table} SELECT * FROM staged_{table}")
+            if etl_flag("prune"):
+                # Rows that disappeared from the artifact are removed in the same transaction, so readers never see a gap
+                con.execute(f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM staged_{table} AS staged WHERE {keys_match})")
+            staged_rows = con.execute(f"SELECT count(*) FROM staged_{table}").fetchone()[0]
+            con.execute(f"DROP TABLE staged_{table}")
+            load_timings.append((table, staged_rows, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        if numfound_history.dates():
+            # Only partitions from the newest loaded date onwards are scanned; that date is re-upserted
+            # in case its snapshot was re-run after the previous load
+            loaded_until = con.execute("SELECT max(snapshot_date) FROM snapshot").fetchone()[0]
+            history_glob = sql_literal(numfound_history.root / "*" / "*.parquet")
+            snapshot_rows = con.execute(
+                f"""
+                INSERT OR REPLACE INTO snapshot
+                SELECT "OpenAIRE_DataSource_ID", "Total Research Products", "Publications", "Research data",
+                       "Research software", "Other research products", CAST(date_retrieved AS DATE)
+                FROM read_parquet({history_glob}, hive_partitioning = true)
+                WHERE coalesce(trim("OpenAIRE_DataSource_ID"), '') <> ''
+                  AND CAST(date_retrieved AS DATE) >= coalesce(?::DATE, DATE '1900-01-01')
+                """,
+                [loaded_until],
+            ).fetchone()[0]
+            load_timings.append(("snapshot", snapshot_rows, time.perf_counter() - started))
+        else:
+            print(f"Skipping snapshot: no partitions in {numfound_history.root}.")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    for table, rows, seconds in load_timings:
+        print(f"Loaded {rows:>7,} rows into {table:<17} in {seconds:.2f}s")
     return
 
 
@@ -1708,6 +4786,160 @@ def _(con):
     return
 
 
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    Materialise the aggregates the report steps and the dashboard read: the latest snapshot per datasource, organisation totals next to their summed datasource totals, and endpoint support counts per Type × openaireCompatibility. Each table is keyed for a primary-key lookup. Only datasources with snapshot dates at or after the last refresh are recomputed; the organisation and endpoint tables are small and are rebuilt from the refreshed rows in the same transaction.
+    """)
+    return
+
+
+@app.cell
+def _(con, time):
+    detected_support_columns = [
+        "detected_support_oai_cerif_openaire",
+        "detected_support_oai_openaire",
+        "detected_support_openaire_data",
+        "detected_support_nl_didl",
+        "detected_support_rioxx",
+    ]
+    con.execute("""
+      CREATE TABLE IF NOT EXISTS agg_datasource_latest (
+        ds_id VARCHAR PRIMARY KEY,
+        org_id VARCHAR,
+        name VARCHAR,
+        type VARCHAR,
+        snapshot_date DATE,
+        totals INT,
+        publications INT,
+        research_data INT,
+        research_software INT,
+        other_products INT,
+        previous_snapshot_date DATE,
+        previous_totals INT
+      )
+    """)
+    con.execute("""
+      CREATE TABLE IF NOT EXISTS agg_org_totals (
+        org_id VARCHAR PRIMARY KEY,
+        name VARCHAR,
+        org_totals BIGINT,
+        datasource_totals BIGINT,
+        datasource_count INT,
+        snapshot_date DATE
+      )
+    """)
+    con.execute(f"""
+      CREATE TABLE IF NOT EXISTS agg_endpoint_support (
+        type VARCHAR,
+        openaire_compatibility VARCHAR,
+        datasources INT,
+        with_endpoint INT,
+        oai_ok INT,
+        {", ".join(f"{column} INT" for column in detected_support_columns)},
+        PRIMARY KEY (type, openaire_compatibility)
+      )
+    """)
+    con.execute("""
+      CREATE TABLE IF NOT EXISTS agg_refresh_state (
+        aggregate VARCHAR PRIMARY KEY,
+        snapshot_date DATE,
+        refreshed_at TIMESTAMP
+      )
+    """)
+
+    refresh_timings: list[tuple[str, int, float]] = []
+    con.begin()
+    try:
+        refresh_started = time.perf_counter()
+        watermark = con.execute("SELECT snapshot_date FROM agg_refresh_state WHERE aggregate = 'agg_datasource_latest'").fetchone()
+        since = watermark[0] if watermark else None
+        # Datasources with snapshot rows at or after the watermark get their latest and previous rows recomputed
+        con.execute(
+            """
+            INSERT OR REPLACE INTO agg_datasource_latest
+            WITH ranked AS (
+                SELECT *, row_number() OVER (PARTITION BY ds_id ORDER BY snapshot_date DESC) AS recency
+                FROM snapshot
+                WHERE ds_id IN (SELECT ds_id FROM snapshot WHERE snapshot_date >= coalesce(?::DATE, DATE '1900-01-01'))
+            )
+            SELECT latest.ds_id, NULL, NULL, NULL, latest.snapshot_date, latest.totals, latest.publications,
+                   latest.research_data, latest.research_software, latest.other_products,
+                   previous.snapshot_date, previous.totals
+            FROM ranked AS latest
+            LEFT JOIN ranked AS previous ON previous.ds_id = latest.ds_id AND previous.recency = 2
+            WHERE latest.recency = 1
+            """,
+            [since],
+        )
+        # Datasource metadata can change without a new snapshot, so it is refreshed for every row
+        con.execute("""
+            UPDATE agg_datasource_latest
+            SET org_id = datasources.org_id, name = coalesce(datasources.name, agg_datasource_latest.ds_id), type = datasources.type
+            FROM datasources
+            WHERE datasources.ds_id = agg_datasource_latest.ds_id
+        """)
+        con.execute("""
+            INSERT OR REPLACE INTO agg_refresh_state
+            SELECT 'agg_datasource_latest', max(snapshot_date), now()::TIMESTAMP FROM snapshot
+        """)
+        latest_rows = con.execute("SELECT count(*) FROM agg_datasource_latest").fetchone()[0]
+        refresh_timings.append(("agg_datasource_latest", latest_rows, time.perf_counter() - refresh_started))
+
+        refresh_started = time.perf_counter()
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE staged_org_totals AS
+            SELECT orgs.org_id, any_value(orgs.name) AS name,
+                   coalesce(any_value(orgs.total_research_products), 0) AS org_totals,
+                   coalesce(sum(latest.totals), 0) AS datasource_totals,
+                   count(links.ds_id) AS datasource_count,
+                   max(latest.snapshot_date) AS snapshot_date
+            FROM orgs
+            LEFT JOIN org_datasources AS links ON links.org_id = orgs.org_id
+            LEFT JOIN agg_datasource_latest AS latest ON latest.ds_id = links.ds_id
+            GROUP BY orgs.org_id
+        """)
+        con.execute("INSERT OR REPLACE INTO agg_org_totals SELECT * FROM staged_org_totals")
+        con.execute("DELETE FROM agg_org_totals WHERE org_id NOT IN (SELECT org_id FROM staged_org_totals)")
+        org_rows = con.execute("SELECT count(*) FROM staged_org_totals").fetchone()[0]
+        con.execute("DROP TABLE staged_org_totals")
+        refresh_timings.append(("agg_org_totals", org_rows, time.perf_counter() - refresh_started))
+
+        refresh_started = time.perf_counter()
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE staged_endpoint_support AS
+            SELECT coalesce(datasources.type, 'Unknown') AS type,
+                   coalesce(metrics.openaire_compatibility, 'Unknown') AS openaire_compatibility,
+                   count(*) AS datasources,
+                   count_if(metrics.has_endpoint) AS with_endpoint,
+                   count_if(metrics.oai_status = 'ok') AS oai_ok,
+                   {", ".join(f"count_if(metrics.{column}) AS {column}" for column in detected_support_columns)}
+            FROM endpoint_metrics AS metrics
+            LEFT JOIN datasources ON datasources.ds_id = metrics.ds_id
+            GROUP BY ALL
+        """)
+        con.execute("INSERT OR REPLACE INTO agg_endpoint_support SELECT * FROM staged_endpoint_support")
+        con.execute("""
+            DELETE FROM agg_endpoint_support
+            WHERE NOT EXISTS (
+                SELECT 1 FROM staged_endpoint_support AS staged
+                WHERE staged.type = agg_endpoint_support.type
+                  AND staged.openaire_compatibility = agg_endpoint_support.openaire_compatibility
+            )
+        """)
+        support_rows = con.execute("SELECT count(*) FROM staged_endpoint_support").fetchone()[0]
+        con.execute("DROP TABLE staged_endpoint_support")
+        refresh_timings.append(("agg_endpoint_support", support_rows, time.perf_counter() - refresh_started))
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    print(f"Aggregates refreshed from snapshot date {since or 'start'} onwards:")
+    for aggregate, row_count, elapsed in refresh_timings:
+        print(f"  {aggregate:<22} {row_count:>7,} rows in {elapsed:.2f}s")
+    return
+
+
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""